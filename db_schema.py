@@ -0,0 +1,696 @@
+"""
+Схема базы COMPASS: версионированные миграции и проверка планов запросов.
+
+Модуль общий для server.py и tg_bot.py. Номер последней применённой
+миграции хранится в PRAGMA user_version, поэтому каждая миграция
+выполняется один раз, а при старте достаточно прочитать одно число.
+"""
+import logging
+import sqlite3
+from typing import List, Optional
+
+log = logging.getLogger("compass_db_schema")
+
+
+# =========================
+# Шаги миграций, которые нельзя выразить одним SQL
+# =========================
+def _table_columns(conn: sqlite3.Connection, table: str) -> set:
+    return {row[1] for row in conn.execute(f"PRAGMA table_info({table})").fetchall()}
+
+
+def _add_askeza_time_column(conn: sqlite3.Connection):
+    """
+    В старой версии notification_settings было поле askeza_time — время
+    по умолчанию для новых аскез. Делаем колонку обязательной частью схемы,
+    чтобы бот читал её обычным SELECT, а не проверял наличие при каждом вызове.
+    """
+    if "askeza_time" not in _table_columns(conn, "notification_settings"):
+        conn.execute("ALTER TABLE notification_settings ADD COLUMN askeza_time TEXT DEFAULT NULL")
+
+
+def _fold_askeza_notification_settings(conn: sqlite3.Connection):
+    """
+    migrate_askeza_notifications.sql создавал таблицу askeza_notification_settings,
+    которую бот никогда не читал (он работает с askeza_reminder_settings).
+    Переносим из неё настройки, которых ещё нет, и удаляем таблицу.
+    Строки удалённых пользователей и аскез пропускаем: INSERT OR IGNORE не спасает
+    от нарушения внешнего ключа, и миграция упала бы целиком.
+    """
+    exists = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type='table' AND name='askeza_notification_settings'"
+    ).fetchone()
+    if not exists:
+        return
+    conn.execute("""
+        INSERT OR IGNORE INTO askeza_reminder_settings (telegram_id, askeza_id, time, enabled, created_at, updated_at)
+        SELECT n.telegram_id, n.askeza_id, n.time, n.enabled, n.created_at, n.updated_at
+        FROM askeza_notification_settings n
+        JOIN users u ON u.telegram_id = n.telegram_id
+        JOIN askeza_entries a ON a.id = n.askeza_id AND a.telegram_id = n.telegram_id
+    """)
+    conn.execute("DROP TABLE askeza_notification_settings")
+
+
+# Пересчёт строки emotion_daily_rollup за день изменённой записи ({row} — NEW или OLD)
+_ROLLUP_COLUMNS = """
+    telegram_id, date, COUNT(*), SUM(level),
+    MAX(CASE WHEN type = 'morning' THEN level END),
+    MAX(CASE WHEN type = 'evening' THEN level END),
+    MAX(CASE WHEN type = 'morning' THEN emotion END),
+    MAX(CASE WHEN type = 'evening' THEN emotion END),
+    AVG(day_rating), AVG(sleep_quality)
+"""
+
+_ROLLUP_REFRESH = """
+    DELETE FROM emotion_daily_rollup WHERE telegram_id = {row}.telegram_id AND date = {row}.date;
+    INSERT INTO emotion_daily_rollup
+    SELECT """ + _ROLLUP_COLUMNS + """
+    FROM emotion_entries
+    WHERE telegram_id = {row}.telegram_id AND date = {row}.date
+    GROUP BY telegram_id, date;
+"""
+
+
+# Таблицы, число строк которых ведётся триггерами в table_counters
+COUNTED_TABLES = ['users', 'client_profiles', 'user_responses', 'emotion_entries', 'journal_entries', 'askeza_entries']
+
+
+def _counter_steps(table: str) -> list:
+    return [
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_count_{table}_insert AFTER INSERT ON {table}
+        BEGIN
+            UPDATE table_counters SET row_count = row_count + 1 WHERE name = '{table}';
+        END
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_count_{table}_delete AFTER DELETE ON {table}
+        BEGIN
+            UPDATE table_counters SET row_count = row_count - 1 WHERE name = '{table}';
+        END
+        """,
+        f"INSERT OR REPLACE INTO table_counters (name, row_count) SELECT '{table}', COUNT(*) FROM {table}",
+    ]
+
+
+# Таблицы, изменения которых отдаёт /sync: у каждой строки есть updated_seq —
+# значение общего счётчика sync_state.seq на момент последней вставки/изменения
+SYNCED_TABLES = ['users', 'client_profiles', 'emotion_entries', 'journal_entries', 'askeza_entries']
+
+_SYNC_BUMP = "UPDATE sync_state SET seq = seq + 1 WHERE id = 1;"
+_SYNC_SEQ = "(SELECT seq FROM sync_state WHERE id = 1)"
+
+
+def _sync_steps(table: str) -> list:
+    return [
+        # У существующих строк updated_seq = 1: их отдаёт первая синхронизация (since=0)
+        f"ALTER TABLE {table} ADD COLUMN updated_seq INTEGER NOT NULL DEFAULT 1",
+        f"CREATE INDEX IF NOT EXISTS idx_{table}_sync ON {table} (telegram_id, updated_seq)",
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_sync_{table}_insert AFTER INSERT ON {table}
+        BEGIN
+            {_SYNC_BUMP}
+            UPDATE {table} SET updated_seq = {_SYNC_SEQ} WHERE id = NEW.id;
+        END
+        """,
+        # Условие отсекает UPDATE из триггера вставки и не даёт триггеру сработать дважды
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_sync_{table}_update AFTER UPDATE ON {table}
+        WHEN NEW.updated_seq = OLD.updated_seq
+        BEGIN
+            {_SYNC_BUMP}
+            UPDATE {table} SET updated_seq = {_SYNC_SEQ} WHERE id = NEW.id;
+        END
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_sync_{table}_delete AFTER DELETE ON {table}
+        BEGIN
+            {_SYNC_BUMP}
+            INSERT INTO sync_tombstones (seq, telegram_id, table_name, row_id, deleted_at)
+            VALUES ({_SYNC_SEQ}, OLD.telegram_id, '{table}', OLD.id, datetime('now'));
+        END
+        """,
+    ]
+
+
+# Лента изменений для процессов, которые держат данные в памяти (бот, кэш сервера):
+# запись в changes — "у пользователя telegram_id изменилась таблица source".
+# Читатель помнит последний обработанный seq и перечитывает только этих пользователей.
+CHANGE_FEED_TABLES = [
+    'users', 'client_profiles', 'notification_settings', 'askeza_entries', 'askeza_reminder_settings',
+    'emotion_entries', 'journal_entries', 'user_responses',
+]
+
+
+def _change_steps(table: str, update_of: Optional[str] = None, events=("insert", "update", "delete"),
+                  when: Optional[str] = None) -> list:
+    update = f"AFTER UPDATE OF {update_of}" if update_of else "AFTER UPDATE"
+    if table in SYNCED_TABLES and not update_of:
+        # UPDATE из триггеров синхронизации меняет только updated_seq — это не изменение данных
+        update += f" ON {table} WHEN NEW.updated_seq = OLD.updated_seq"
+    elif when:
+        update += f" ON {table} WHEN {when}"
+    else:
+        update += f" ON {table}"
+    steps = []
+    for event in events:
+        row = "OLD" if event == "delete" else "NEW"
+        timing = update if event == "update" else f"AFTER {event.upper()} ON {table}"
+        steps.append(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_changes_{table}_{event} {timing}
+        BEGIN
+            INSERT INTO changes (telegram_id, source, changed_at) VALUES ({row}.telegram_id, '{table}', datetime('now'));
+        END
+        """)
+    return steps
+
+
+# Время напоминаний в минутах от полуночи: {таблица: (ключ строки, {колонка минут: колонка HH:MM})}.
+# Колонки пишут триггеры при каждой записи HH:MM — одинаково для сервера и бота,
+# поэтому планировщик бота сравнивает целые числа, а не разбирает строки.
+# NULL — время не задано или не в формате HH:MM.
+MINUTE_COLUMNS = {
+    "notification_settings": ("telegram_id", {
+        "checkin_min": "checkin_time",
+        "checkout_min": "checkout_time",
+        "askeza_min": "askeza_time",
+        "quiet_start_min": "quiet_start",
+        "quiet_end_min": "quiet_end",
+    }),
+    "askeza_reminder_settings": ("telegram_id, askeza_id", {
+        "time_min": "time",
+    }),
+}
+
+
+def _minutes_sql(column: str) -> str:
+    # тот же формат, что hhmm_is_valid в tg_bot.py
+    value = f"trim({column})"
+    return (f"CASE WHEN {value} GLOB '[01][0-9]:[0-5][0-9]' OR {value} GLOB '2[0-3]:[0-5][0-9]' "
+            f"THEN CAST(substr({value}, 1, 2) AS INTEGER) * 60 + CAST(substr({value}, 4, 2) AS INTEGER) END")
+
+
+def _minute_steps(table: str) -> list:
+    key, columns = MINUTE_COLUMNS[table]
+    assignments = ", ".join(f"{minutes} = {_minutes_sql(text)}" for minutes, text in columns.items())
+    match = " AND ".join(f"{column} = NEW.{column}" for column in key.split(", "))
+    stale = " OR ".join(f"{minutes} IS NOT {_minutes_sql(text)}" for minutes, text in columns.items())
+    unchanged = " AND ".join(f"NEW.{minutes} IS OLD.{minutes}" for minutes in columns)
+    return [
+        *[f"ALTER TABLE {table} ADD COLUMN {minutes} INTEGER DEFAULT NULL" for minutes in columns],
+        f"UPDATE {table} SET {assignments}",
+        *[f"""
+        CREATE TRIGGER IF NOT EXISTS trg_minutes_{table}_{event} {timing}
+        BEGIN
+            UPDATE {table} SET {assignments} WHERE {match} AND ({stale});
+        END
+        """ for event, timing in (
+            ("insert", f"AFTER INSERT ON {table}"),
+            ("update", f"AFTER UPDATE OF {', '.join(columns.values())} ON {table}"),
+        )],
+        # Пересчёт минут — не новое изменение настроек: лента его пропускает
+        f"DROP TRIGGER IF EXISTS trg_changes_{table}_update",
+        *_change_steps(table, events=("update",), when=unchanged),
+    ]
+
+
+# =========================
+# Миграции: (версия, описание, шаги). Шаг — SQL-строка или функция(conn).
+# Версии 1 и 2 повторяют схему, которую раньше создавали init_database()
+# и ensure_tables() через IF NOT EXISTS, поэтому на существующей базе
+# они ничего не ломают.
+# =========================
+MIGRATIONS = [
+    (1, "Таблицы приложения и составные индексы", [
+        """
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            telegram_id INTEGER UNIQUE NOT NULL,
+            telegram_username TEXT,
+            telegram_first_name TEXT,
+            telegram_last_name TEXT,
+            name TEXT NOT NULL,
+            birth_date TEXT NOT NULL,
+            birth_place TEXT NOT NULL,
+            about_me TEXT NOT NULL,
+            problem TEXT NOT NULL,
+            created_at TEXT NOT NULL
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS client_profiles (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            telegram_id INTEGER UNIQUE NOT NULL,
+            selected_widgets TEXT NOT NULL DEFAULT '[]',
+            widget_order TEXT NOT NULL DEFAULT '[]',
+            is_pro BOOLEAN NOT NULL DEFAULT 0,
+            energy INTEGER NOT NULL DEFAULT 850,
+            completed_askezas INTEGER NOT NULL DEFAULT 0,
+            settings TEXT NOT NULL DEFAULT '{}',
+            created_at TEXT NOT NULL,
+            updated_at TEXT NOT NULL,
+            FOREIGN KEY (telegram_id) REFERENCES users (telegram_id)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS user_responses (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            telegram_id INTEGER NOT NULL,
+            response_type TEXT NOT NULL,
+            response_data TEXT NOT NULL,
+            date TEXT NOT NULL,
+            created_at TEXT NOT NULL,
+            FOREIGN KEY (telegram_id) REFERENCES users (telegram_id)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS emotion_entries (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            telegram_id INTEGER NOT NULL,
+            type TEXT NOT NULL CHECK (type IN ('morning', 'evening')),
+            emotion TEXT NOT NULL,
+            level INTEGER NOT NULL CHECK (level >= 1 AND level <= 10),
+            date TEXT NOT NULL,
+            feelings TEXT,
+            goals TEXT,
+            gratitude TEXT,
+            day_reflection TEXT,
+            tomorrow_goals TEXT,
+            day_rating INTEGER CHECK (day_rating >= 1 AND day_rating <= 10),
+            sleep_quality INTEGER CHECK (sleep_quality >= 1 AND sleep_quality <= 10),
+            morning_mood TEXT,
+            today_goals TEXT,
+            intention TEXT,
+            created_at TEXT NOT NULL,
+            FOREIGN KEY (telegram_id) REFERENCES users (telegram_id),
+            UNIQUE(telegram_id, date, type)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS journal_entries (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            telegram_id INTEGER NOT NULL,
+            title TEXT NOT NULL,
+            content TEXT NOT NULL,
+            mood TEXT,
+            tags TEXT,
+            created_at TEXT NOT NULL,
+            FOREIGN KEY (telegram_id) REFERENCES users (telegram_id)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS askeza_entries (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            telegram_id INTEGER NOT NULL,
+            title TEXT NOT NULL,
+            icon TEXT NOT NULL,
+            color TEXT NOT NULL,
+            duration INTEGER NOT NULL,
+            current_day INTEGER NOT NULL DEFAULT 0,
+            is_active BOOLEAN NOT NULL DEFAULT 1,
+            show_on_home BOOLEAN NOT NULL DEFAULT 0,
+            created_at TEXT NOT NULL,
+            updated_at TEXT NOT NULL,
+            FOREIGN KEY (telegram_id) REFERENCES users (telegram_id)
+        )
+        """,
+        # id в индексах не указываем: он входит в каждый индекс как rowid
+        "CREATE INDEX IF NOT EXISTS idx_emotion_entries_tg_date_created ON emotion_entries (telegram_id, date, created_at)",
+        "CREATE INDEX IF NOT EXISTS idx_journal_entries_tg_created ON journal_entries (telegram_id, created_at)",
+        "CREATE INDEX IF NOT EXISTS idx_askeza_entries_tg_created ON askeza_entries (telegram_id, created_at)",
+        "CREATE INDEX IF NOT EXISTS idx_askeza_entries_tg_home_created ON askeza_entries (telegram_id, show_on_home, created_at)",
+        "CREATE INDEX IF NOT EXISTS idx_askeza_entries_tg_active ON askeza_entries (telegram_id, is_active)",
+        "CREATE INDEX IF NOT EXISTS idx_user_responses_tg_created ON user_responses (telegram_id, created_at)",
+        "CREATE INDEX IF NOT EXISTS idx_user_responses_tg_type_created ON user_responses (telegram_id, response_type, created_at)",
+        # users.telegram_id и client_profiles.telegram_id уже UNIQUE
+        "DROP INDEX IF EXISTS idx_users_telegram_id",
+        "DROP INDEX IF EXISTS idx_client_profiles_telegram_id",
+        # Одноколоночные индексы — префиксы составных
+        "DROP INDEX IF EXISTS idx_user_responses_telegram_id",
+        "DROP INDEX IF EXISTS idx_emotion_entries_telegram_id",
+        "DROP INDEX IF EXISTS idx_journal_entries_telegram_id",
+        "DROP INDEX IF EXISTS idx_askeza_entries_telegram_id",
+        # Индексы таблиц бота, дублирующие PRIMARY KEY / UNIQUE
+        "DROP INDEX IF EXISTS idx_askeza_reminders_tg",
+        "DROP INDEX IF EXISTS idx_reminder_log_tgd_kind_date",
+    ]),
+    (2, "Таблицы напоминаний бота", [
+        """
+        CREATE TABLE IF NOT EXISTS notification_settings (
+          telegram_id INTEGER PRIMARY KEY,
+          timezone TEXT NOT NULL DEFAULT 'Europe/Moscow',
+
+          checkin_time  TEXT NOT NULL DEFAULT '12:00',
+          checkout_time TEXT NOT NULL DEFAULT '21:00',
+
+          enable_checkin  INTEGER NOT NULL DEFAULT 1,
+          enable_checkout INTEGER NOT NULL DEFAULT 1,
+
+          -- мастер-переключатель "все аскезы"
+          enable_askeza   INTEGER NOT NULL DEFAULT 1,
+
+          quiet_start TEXT DEFAULT NULL,
+          quiet_end   TEXT DEFAULT NULL,
+
+          created_at TEXT NOT NULL DEFAULT (datetime('now')),
+          updated_at TEXT NOT NULL DEFAULT (datetime('now')),
+
+          FOREIGN KEY (telegram_id) REFERENCES users (telegram_id) ON DELETE CASCADE
+        )
+        """,
+        # Пер-аскеза: включено/выключено + своё время
+        """
+        CREATE TABLE IF NOT EXISTS askeza_reminder_settings (
+          telegram_id INTEGER NOT NULL,
+          askeza_id   INTEGER NOT NULL,
+          time        TEXT    NOT NULL DEFAULT '12:00',
+          enabled     INTEGER NOT NULL DEFAULT 1,
+          created_at  TEXT NOT NULL DEFAULT (datetime('now')),
+          updated_at  TEXT NOT NULL DEFAULT (datetime('now')),
+          PRIMARY KEY (telegram_id, askeza_id),
+          FOREIGN KEY (telegram_id) REFERENCES users (telegram_id) ON DELETE CASCADE
+        )
+        """,
+        # Лог, чтобы не слать по 2 раза в день одно и то же
+        """
+        CREATE TABLE IF NOT EXISTS reminder_log (
+          id INTEGER PRIMARY KEY AUTOINCREMENT,
+          telegram_id INTEGER NOT NULL,
+          kind TEXT NOT NULL,    -- 'checkin' | 'checkout' | 'askeza:<id>'
+          date TEXT NOT NULL,    -- YYYY-MM-DD (локальная дата пользователя)
+          sent_at TEXT NOT NULL, -- ISO UTC
+          UNIQUE(telegram_id, kind, date)
+        )
+        """,
+    ]),
+    (3, "Наследие старых версий бота: askeza_time и askeza_notification_settings", [
+        _add_askeza_time_column,
+        _fold_askeza_notification_settings,
+    ]),
+    (4, "Ключи идемпотентности пакетной записи", [
+        # Повтор пакета с тем же ключом не создаёт запись второй раз,
+        # а возвращает id, созданный в первый раз
+        """
+        CREATE TABLE IF NOT EXISTS idempotency_keys (
+            telegram_id INTEGER NOT NULL,
+            key TEXT NOT NULL,
+            op TEXT NOT NULL,
+            result_id INTEGER,
+            created_at TEXT NOT NULL,
+            PRIMARY KEY (telegram_id, key)
+        ) WITHOUT ROWID
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_idempotency_keys_created ON idempotency_keys (created_at)",
+    ]),
+    (5, "Дневная сводка эмоций для графиков", [
+        # Одна строка на пользователя и день: в emotion_entries на день не больше
+        # одной утренней и одной вечерней записи, поэтому сводка — их "разворот"
+        """
+        CREATE TABLE IF NOT EXISTS emotion_daily_rollup (
+            telegram_id INTEGER NOT NULL,
+            date TEXT NOT NULL,
+            entries INTEGER NOT NULL,
+            level_sum INTEGER NOT NULL,
+            morning_level INTEGER,
+            evening_level INTEGER,
+            morning_emotion TEXT,
+            evening_emotion TEXT,
+            day_rating REAL,
+            sleep_quality REAL,
+            PRIMARY KEY (telegram_id, date)
+        ) WITHOUT ROWID
+        """,
+        # Триггеры пересчитывают день целиком из emotion_entries (не больше двух строк
+        # по индексу). Так сводка верна и для INSERT OR REPLACE, при котором SQLite
+        # без PRAGMA recursive_triggers удаляет старую строку без DELETE-триггеров.
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_emotion_rollup_insert AFTER INSERT ON emotion_entries
+        BEGIN
+            {_ROLLUP_REFRESH.format(row="NEW")}
+        END
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_emotion_rollup_delete AFTER DELETE ON emotion_entries
+        BEGIN
+            {_ROLLUP_REFRESH.format(row="OLD")}
+        END
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_emotion_rollup_update AFTER UPDATE ON emotion_entries
+        BEGIN
+            {_ROLLUP_REFRESH.format(row="OLD")}
+            {_ROLLUP_REFRESH.format(row="NEW")}
+        END
+        """,
+        # Заполняем сводку по уже существующим записям
+        f"""
+        INSERT OR REPLACE INTO emotion_daily_rollup
+        SELECT {_ROLLUP_COLUMNS}
+        FROM emotion_entries
+        GROUP BY telegram_id, date
+        """,
+    ]),
+    (6, "Счётчики строк таблиц для /info", [
+        """
+        CREATE TABLE IF NOT EXISTS table_counters (
+            name TEXT PRIMARY KEY,
+            row_count INTEGER NOT NULL
+        ) WITHOUT ROWID
+        """,
+        *[step for table in COUNTED_TABLES for step in _counter_steps(table)],
+        # INSERT OR REPLACE в emotion_entries удаляет старую строку без DELETE-триггера:
+        # заранее вычитаем строку, которую заменит вставка
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_count_emotion_entries_replace BEFORE INSERT ON emotion_entries
+        WHEN EXISTS (
+            SELECT 1 FROM emotion_entries
+            WHERE telegram_id = NEW.telegram_id AND date = NEW.date AND type = NEW.type
+        )
+        BEGIN
+            UPDATE table_counters SET row_count = row_count - 1 WHERE name = 'emotion_entries';
+        END
+        """,
+    ]),
+    (7, "Последовательность изменений для инкрементальной синхронизации", [
+        """
+        CREATE TABLE IF NOT EXISTS sync_state (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            seq INTEGER NOT NULL,
+            pruned_seq INTEGER NOT NULL DEFAULT 0
+        )
+        """,
+        "INSERT OR IGNORE INTO sync_state (id, seq) VALUES (1, 1)",
+        # Удалённые строки: клиент убирает их из локального кэша
+        """
+        CREATE TABLE IF NOT EXISTS sync_tombstones (
+            seq INTEGER PRIMARY KEY,
+            telegram_id INTEGER NOT NULL,
+            table_name TEXT NOT NULL,
+            row_id INTEGER NOT NULL,
+            deleted_at TEXT NOT NULL
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_sync_tombstones_user ON sync_tombstones (telegram_id, seq)",
+        "CREATE INDEX IF NOT EXISTS idx_sync_tombstones_deleted ON sync_tombstones (deleted_at)",
+        *[step for table in SYNCED_TABLES for step in _sync_steps(table)],
+        # INSERT OR REPLACE в emotion_entries удаляет старую строку без DELETE-триггера:
+        # записываем надгробие для неё заранее
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_sync_emotion_entries_replace BEFORE INSERT ON emotion_entries
+        WHEN EXISTS (
+            SELECT 1 FROM emotion_entries
+            WHERE telegram_id = NEW.telegram_id AND date = NEW.date AND type = NEW.type
+        )
+        BEGIN
+            {_SYNC_BUMP}
+            INSERT INTO sync_tombstones (seq, telegram_id, table_name, row_id, deleted_at)
+            SELECT {_SYNC_SEQ}, telegram_id, 'emotion_entries', id, datetime('now')
+            FROM emotion_entries
+            WHERE telegram_id = NEW.telegram_id AND date = NEW.date AND type = NEW.type;
+        END
+        """,
+        # Сводку пересчитываем только при изменении данных, а не служебного updated_seq
+        "DROP TRIGGER IF EXISTS trg_emotion_rollup_update",
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_emotion_rollup_update
+        AFTER UPDATE OF telegram_id, date, type, emotion, level, day_rating, sleep_quality ON emotion_entries
+        BEGIN
+            {_ROLLUP_REFRESH.format(row="OLD")}
+            {_ROLLUP_REFRESH.format(row="NEW")}
+        END
+        """,
+    ]),
+    (8, "Лента изменений для кэшей в памяти", [
+        # AUTOINCREMENT: seq не переиспользуется и после удаления старых записей
+        """
+        CREATE TABLE IF NOT EXISTS changes (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            telegram_id INTEGER NOT NULL,
+            source TEXT NOT NULL,
+            changed_at TEXT NOT NULL
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_changes_changed_at ON changes (changed_at)",
+        # Расписанию бота важны появление, удаление и (де)активация аскез
+        *_change_steps("askeza_entries", update_of="telegram_id, is_active"),
+    ]),
+    (9, "Лента изменений для всех пользовательских таблиц", [
+        # Кэшу ответов server.py важны любые изменения аскез, а не только (де)активация
+        "DROP TRIGGER IF EXISTS trg_changes_askeza_entries_update",
+        *_change_steps("askeza_entries", events=("update",)),
+        *[step for table in CHANGE_FEED_TABLES if table != "askeza_entries" for step in _change_steps(table)],
+    ]),
+    (10, "Время напоминаний в минутах от полуночи", [
+        *_minute_steps("notification_settings"),
+        *_minute_steps("askeza_reminder_settings"),
+    ]),
+    (11, "INSERT OR REPLACE в emotion_entries через DELETE-триггеры", [
+        # Соединения server.py и бота включают PRAGMA recursive_triggers: тогда строку,
+        # которую удаляет INSERT OR REPLACE, обрабатывают обычные DELETE-триггеры
+        # (счётчик, надгробие /sync, сводка). BEFORE INSERT-компенсации из миграций 6 и 7
+        # срабатывали и для INSERT OR IGNORE / ON CONFLICT DO UPDATE, где строка не удаляется.
+        # Писать в базу без recursive_triggers нельзя: REPLACE разойдётся со счётчиками.
+        "DROP TRIGGER IF EXISTS trg_count_emotion_entries_replace",
+        "DROP TRIGGER IF EXISTS trg_sync_emotion_entries_replace",
+    ]),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def schema_version(conn: sqlite3.Connection) -> int:
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn: sqlite3.Connection) -> int:
+    """
+    Применяет к базе миграции новее PRAGMA user_version и возвращает итоговую версию.
+    Если база актуальна — это одно чтение PRAGMA, без DDL и блокировок.
+    """
+    version = schema_version(conn)
+    if version >= SCHEMA_VERSION:
+        return version
+
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        # Перечитываем версию под блокировкой: миграции мог применить другой процесс
+        version = schema_version(conn)
+        for migration_version, description, steps in MIGRATIONS:
+            if migration_version <= version:
+                continue
+            for step in steps:
+                if callable(step):
+                    step(conn)
+                else:
+                    conn.execute(step)
+            conn.execute(f"PRAGMA user_version = {migration_version}")
+            log.info("Применена миграция %s: %s", migration_version, description)
+            version = migration_version
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return version
+
+
+# =========================
+# Проверка планов горячих запросов (EXPLAIN QUERY PLAN)
+# Ни один из них не должен сортировать через временный B-tree или сканировать
+# таблицу целиком, кроме явно разрешённых таблиц.
+# =========================
+HOT_QUERIES = [
+    # server.py
+    ("get_user", "SELECT * FROM users WHERE telegram_id = ?", ()),
+    ("get_client_profile", "SELECT * FROM client_profiles WHERE telegram_id = ?", ()),
+    ("get_askeza_entries",
+     "SELECT * FROM askeza_entries WHERE telegram_id = ? AND (created_at, id) < (?, ?) "
+     "ORDER BY created_at DESC, id DESC LIMIT ?", ()),
+    ("get_home_askezas",
+     "SELECT * FROM askeza_entries WHERE telegram_id = ? AND show_on_home = 1 ORDER BY created_at DESC", ()),
+    ("get_emotion_entries",
+     "SELECT * FROM emotion_entries WHERE telegram_id = ? AND (date, created_at, id) < (?, ?, ?) "
+     "ORDER BY date DESC, created_at DESC, id DESC LIMIT ?", ()),
+    ("get_emotion_entry_by_date",
+     "SELECT * FROM emotion_entries WHERE telegram_id = ? AND date = ? AND type = ?", ()),
+    ("get_journal_entries",
+     "SELECT * FROM journal_entries WHERE telegram_id = ? AND (created_at, id) < (?, ?) "
+     "ORDER BY created_at DESC, id DESC LIMIT ?", ()),
+    ("get_user_responses",
+     "SELECT * FROM user_responses WHERE telegram_id = ? AND (created_at, id) < (?, ?) "
+     "ORDER BY created_at DESC, id DESC LIMIT ?", ()),
+    ("get_user_responses_by_type",
+     "SELECT * FROM user_responses WHERE telegram_id = ? AND response_type = ? AND (created_at, id) < (?, ?) "
+     "ORDER BY created_at DESC, id DESC LIMIT ?", ()),
+    ("sync_emotions",
+     "SELECT * FROM emotion_entries WHERE telegram_id = ? AND updated_seq > ? ORDER BY updated_seq", ()),
+    ("sync_journal",
+     "SELECT * FROM journal_entries WHERE telegram_id = ? AND updated_seq > ? ORDER BY updated_seq", ()),
+    ("sync_askezas",
+     "SELECT * FROM askeza_entries WHERE telegram_id = ? AND updated_seq > ? ORDER BY updated_seq", ()),
+    ("sync_tombstones",
+     "SELECT * FROM sync_tombstones WHERE telegram_id = ? AND seq > ? ORDER BY seq", ()),
+    ("changes_since", "SELECT seq, telegram_id, source FROM changes WHERE seq > ? ORDER BY seq", ()),
+    ("changes_prune", "DELETE FROM changes WHERE changed_at < ?", ()),
+    ("bootstrap_emotions",
+     "SELECT * FROM emotion_entries WHERE telegram_id = ? AND date = ? AND type IN ('morning', 'evening')", ()),
+    ("bootstrap_journal",
+     "SELECT * FROM journal_entries WHERE telegram_id = ? ORDER BY created_at DESC, id DESC LIMIT ?", ()),
+    ("emotion_stats",
+     "SELECT date, SUM(entries), AVG(morning_level) FROM emotion_daily_rollup "
+     "WHERE telegram_id = ? AND date BETWEEN ? AND ? GROUP BY 1 ORDER BY 1", ()),
+    # tg_bot.py
+    ("bot_reminder_users",
+     "SELECT u.telegram_id, s.timezone FROM users u LEFT JOIN notification_settings s ON s.telegram_id = u.telegram_id",
+     ("u",)),
+    ("bot_active_askezas",
+     "SELECT id, title, duration, current_day FROM askeza_entries WHERE telegram_id=? AND is_active=1 ORDER BY id DESC", ()),
+    ("bot_schedule_askezas",
+     "SELECT a.telegram_id, a.id, COALESCE(CASE WHEN r.telegram_id IS NULL THEN s.askeza_min ELSE r.time_min END, 720), "
+     "COALESCE(r.enabled, 1) "
+     "FROM askeza_entries a LEFT JOIN askeza_reminder_settings r ON r.telegram_id=a.telegram_id AND r.askeza_id=a.id "
+     "LEFT JOIN notification_settings s ON s.telegram_id=a.telegram_id WHERE a.is_active=1",
+     ("a",)),
+    ("bot_schedule_user_askezas",
+     "SELECT a.telegram_id, a.id, COALESCE(CASE WHEN r.telegram_id IS NULL THEN s.askeza_min ELSE r.time_min END, 720), "
+     "COALESCE(r.enabled, 1) "
+     "FROM askeza_entries a LEFT JOIN askeza_reminder_settings r ON r.telegram_id=a.telegram_id AND r.askeza_id=a.id "
+     "LEFT JOIN notification_settings s ON s.telegram_id=a.telegram_id WHERE a.is_active=1 AND a.telegram_id = ?",
+     ()),
+    ("bot_askeza_by_id", "SELECT title, duration, current_day FROM askeza_entries WHERE id=? AND is_active=1", ()),
+    ("bot_already_sent", "SELECT 1 FROM reminder_log WHERE telegram_id=? AND kind=? AND date=? LIMIT 1", ()),
+    ("bot_emotion_entry_exists",
+     "SELECT 1 FROM emotion_entries WHERE telegram_id=? AND date=? AND type=? LIMIT 1", ()),
+]
+
+
+def check_query_plans(conn: sqlite3.Connection) -> List[str]:
+    """Возвращает список проблем в планах горячих запросов (пустой — всё в порядке)"""
+    problems = []
+    for name, query, allowed_scans in HOT_QUERIES:
+        try:
+            plan = conn.execute(f"EXPLAIN QUERY PLAN {query}", [None] * query.count("?")).fetchall()
+        except sqlite3.OperationalError as e:
+            problems.append(f"{name}: {e}")
+            continue
+        for row in plan:
+            detail = row[3]
+            if "TEMP B-TREE" in detail:
+                problems.append(f"{name}: {detail}")
+            elif detail.startswith("SCAN ") and detail.split()[1] not in allowed_scans:
+                problems.append(f"{name}: {detail}")
+    return problems
+
+
+if __name__ == "__main__":
+    # python db_schema.py <путь к базе> — миграция и проверка планов (например, в CI)
+    import sys
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    path = sys.argv[1] if len(sys.argv) > 1 else "compass.db"
+    with sqlite3.connect(path) as db:
+        migrate(db)
+        found = check_query_plans(db)
+    for problem in found:
+        log.warning("Неоптимальный план запроса: %s", problem)
+    sys.exit(1 if found else 0)
@@ -1,14 +1,31 @@
 from fastapi import FastAPI, HTTPException, Request, File, UploadFile
-from fastapi.responses import JSONResponse, FileResponse
+from fastapi.responses import Response, StreamingResponse
+from starlette.background import BackgroundTask
 from fastapi.middleware.cors import CORSMiddleware
+import asyncio
+import gzip
+import hashlib
 import sqlite3
 import json
 import logging
-from datetime import datetime
+from datetime import datetime, timedelta
 from typing import Optional, List, Dict, Any
 import os
+import queue
 import shutil
-from contextlib import contextmanager
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
+from contextlib import contextmanager, asynccontextmanager
+
+try:
+    import zstandard
+except ImportError:  # zstd-сжатие экспорта — только если пакет установлен
+    zstandard = None
+
+from db_schema import COUNTED_TABLES, SYNCED_TABLES, MINUTE_COLUMNS, SCHEMA_VERSION, migrate, schema_version, check_query_plans
 
 # Настройка логирования
 logging.basicConfig(
@@ -17,7 +34,23 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-app = FastAPI(title="Compass Database API", version="1.0.0")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Схема проверяется один раз при старте; POST /init дальше только отвечает из кэша
+    await run_db(init_database)
+    await write_db(prune_sync_tombstones)
+    await write_db(prune_changes)
+    await run_db(change_listener.reset)
+    watcher = asyncio.create_task(watch_changes())
+    yield
+    watcher.cancel()
+    change_listener.close()
+    db_writer.shutdown()
+    db_executor.shutdown()
+    db_pool.close_all()
+
+
+app = FastAPI(title="Compass Database API", version="1.0.0", lifespan=lifespan)
 
 # CORS настройки
 app.add_middleware(
@@ -26,160 +59,824 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "ETag", "X-Checksum-SHA256", "Content-Disposition"],
 )
 
 DATABASE_PATH = "compass.db"
 
+# Настройки пула соединений (можно переопределить через ENV)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "8"))
+DB_POOL_TIMEOUT_SEC = float(os.getenv("DB_POOL_TIMEOUT_SEC", "10"))
+DB_BUSY_TIMEOUT_SEC = float(os.getenv("DB_BUSY_TIMEOUT_SEC", "30"))
+DB_CACHE_SIZE_KB = int(os.getenv("DB_CACHE_SIZE_KB", "16384"))
+DB_MMAP_SIZE = int(os.getenv("DB_MMAP_SIZE", str(128 * 1024 * 1024)))
+DB_HEALTHCHECK_IDLE_SEC = float(os.getenv("DB_HEALTHCHECK_IDLE_SEC", "60"))
+
+# Потоки для запросов к базе: не больше, чем соединений в пуле
+DB_MAX_WORKERS = int(os.getenv("DB_MAX_WORKERS", str(DB_POOL_SIZE)))
+DB_MAX_QUEUE = int(os.getenv("DB_MAX_QUEUE", "256"))
+
+# Group commit: записи, пришедшие в пределах окна, коммитятся одной транзакцией
+DB_GROUP_COMMIT_WINDOW_MS = float(os.getenv("DB_GROUP_COMMIT_WINDOW_MS", "5"))
+DB_GROUP_COMMIT_MAX_BATCH = int(os.getenv("DB_GROUP_COMMIT_MAX_BATCH", "64"))
+DB_WRITE_MAX_QUEUE = int(os.getenv("DB_WRITE_MAX_QUEUE", "1024"))
+
+# Размер страницы для списков (если limit не передан) и его верхняя граница
+API_PAGE_SIZE = int(os.getenv("API_PAGE_SIZE", "100"))
+API_MAX_PAGE_SIZE = int(os.getenv("API_MAX_PAGE_SIZE", "500"))
+# Сколько последних записей журнала отдаёт /bootstrap по умолчанию
+BOOTSTRAP_JOURNAL_LIMIT = int(os.getenv("BOOTSTRAP_JOURNAL_LIMIT", "20"))
+
+# Сколько дней хранятся записи об удалённых строках для /sync
+SYNC_TOMBSTONE_TTL_DAYS = int(os.getenv("SYNC_TOMBSTONE_TTL_DAYS", "90"))
+
+
+def open_connection(path: str) -> sqlite3.Connection:
+    """Открывает соединение и один раз выставляет все PRAGMA"""
+    conn = sqlite3.connect(path, timeout=DB_BUSY_TIMEOUT_SEC, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.execute("PRAGMA foreign_keys = ON")
+    # INSERT OR REPLACE вызывает DELETE-триггеры для заменяемой строки (см. миграцию 11 в db_schema)
+    conn.execute("PRAGMA recursive_triggers = ON")
+    conn.execute(f"PRAGMA cache_size = {-DB_CACHE_SIZE_KB}")
+    conn.execute(f"PRAGMA mmap_size = {DB_MMAP_SIZE}")
+    conn.execute(f"PRAGMA busy_timeout = {int(DB_BUSY_TIMEOUT_SEC * 1000)}")
+    return conn
+
+
+class PoolTimeoutError(Exception):
+    """Все соединения пула заняты дольше DB_POOL_TIMEOUT_SEC"""
+
+
+class ConnectionPool:
+    """
+    Ограниченный пул соединений SQLite.
+    PRAGMA выполняются один раз при создании соединения, а не на каждый запрос.
+    Соединения создаются лениво, не больше size штук.
+    """
+
+    def __init__(self, path: str, size: int, timeout: float):
+        self.path = path
+        self.size = max(size, 1)
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._paused = False
+        self._created = 0
+        self._metrics = {
+            "acquired": 0,
+            "waited": 0,
+            "timeouts": 0,
+            "wait_time_total_ms": 0.0,
+            "wait_time_max_ms": 0.0,
+            "opened": 0,
+            "discarded": 0,
+            "health_check_failures": 0,
+        }
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = open_connection(self.path)
+        with self._lock:
+            self._metrics["opened"] += 1
+        return conn
+
+    def _healthy(self, conn: sqlite3.Connection, idle_since: float) -> bool:
+        if time.monotonic() - idle_since < DB_HEALTHCHECK_IDLE_SEC:
+            return True
+        try:
+            conn.execute("SELECT 1").fetchone()
+            return True
+        except sqlite3.Error as e:
+            logger.warning(f"Соединение из пула не прошло проверку: {e}")
+            with self._lock:
+                self._metrics["health_check_failures"] += 1
+            return False
+
+    def _discard(self, conn: sqlite3.Connection):
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+        with self._changed:
+            self._created -= 1
+            self._metrics["discarded"] += 1
+            self._changed.notify_all()
+
+    def acquire(self) -> sqlite3.Connection:
+        started = time.monotonic()
+        waited = False
+        with self._changed:
+            # На время обслуживания базы (импорт) новые соединения не выдаём
+            while self._paused:
+                waited = True
+                remaining = self.timeout - (time.monotonic() - started)
+                if remaining <= 0:
+                    self._metrics["timeouts"] += 1
+                    raise PoolTimeoutError("База данных на обслуживании")
+                self._changed.wait(remaining)
+        while True:
+            try:
+                conn, idle_since = self._idle.get_nowait()
+            except queue.Empty:
+                with self._lock:
+                    can_create = self._created < self.size
+                    if can_create:
+                        self._created += 1
+                if can_create:
+                    try:
+                        conn = self._connect()
+                    except Exception:
+                        with self._lock:
+                            self._created -= 1
+                        raise
+                    break
+                waited = True
+                remaining = self.timeout - (time.monotonic() - started)
+                try:
+                    conn, idle_since = self._idle.get(timeout=max(remaining, 0.001))
+                except queue.Empty:
+                    with self._lock:
+                        self._metrics["timeouts"] += 1
+                    raise PoolTimeoutError("Нет свободных соединений с базой данных")
+
+            if self._healthy(conn, idle_since):
+                break
+            self._discard(conn)
+
+        wait_ms = (time.monotonic() - started) * 1000
+        with self._lock:
+            self._metrics["acquired"] += 1
+            if waited:
+                self._metrics["waited"] += 1
+            self._metrics["wait_time_total_ms"] += wait_ms
+            self._metrics["wait_time_max_ms"] = max(self._metrics["wait_time_max_ms"], wait_ms)
+        return conn
+
+    def release(self, conn: sqlite3.Connection, broken: bool = False):
+        if not broken and conn.in_transaction:
+            try:
+                conn.rollback()
+            except sqlite3.Error:
+                broken = True
+        if broken:
+            self._discard(conn)
+        else:
+            self._idle.put((conn, time.monotonic()))
+            with self._changed:
+                self._changed.notify_all()
+
+    def pause_and_drain(self, timeout: float):
+        """Перестаёт выдавать соединения, ждёт возврата занятых и закрывает все"""
+        deadline = time.monotonic() + timeout
+        with self._changed:
+            self._paused = True
+            while self._created - self._idle.qsize() > 0:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._paused = False
+                    self._changed.notify_all()
+                    raise PoolTimeoutError("Не дождались освобождения соединений с базой данных")
+                self._changed.wait(remaining)
+        self.close_all()
+
+    def resume(self):
+        with self._changed:
+            self._paused = False
+            self._changed.notify_all()
+
+    def close_all(self):
+        """Закрывает все свободные соединения (занятые закроются при возврате)"""
+        while True:
+            try:
+                conn, _ = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(conn)
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            data = dict(self._metrics)
+            created = self._created
+        idle = self._idle.qsize()
+        data.update({
+            "size": self.size,
+            "open": created,
+            "idle": idle,
+            "in_use": created - idle,
+            "wait_time_avg_ms": round(data["wait_time_total_ms"] / data["acquired"], 3) if data["acquired"] else 0.0,
+        })
+        data["wait_time_total_ms"] = round(data["wait_time_total_ms"], 3)
+        data["wait_time_max_ms"] = round(data["wait_time_max_ms"], 3)
+        return data
+
+
+db_pool = ConnectionPool(DATABASE_PATH, DB_POOL_SIZE, DB_POOL_TIMEOUT_SEC)
+
+
 @contextmanager
 def get_db_connection():
-    """Контекстный менеджер для безопасной работы с базой данных"""
+    """Контекстный менеджер для безопасной работы с базой данных (соединение берётся из пула)"""
     conn = None
+    broken = False
     try:
-        conn = sqlite3.connect(DATABASE_PATH, timeout=30.0)
-        conn.row_factory = sqlite3.Row
-        conn.execute("PRAGMA foreign_keys = ON")
-        conn.execute("PRAGMA journal_mode = WAL")
+        conn = db_pool.acquire()
         yield conn
     except Exception as e:
         if conn:
-            conn.rollback()
+            try:
+                conn.rollback()
+            except sqlite3.Error:
+                broken = True
         logger.error(f"Ошибка базы данных: {e}")
         raise
     finally:
         if conn:
-            conn.close()
+            db_pool.release(conn, broken=broken)
+
+
+class DatabaseExecutor:
+    """
+    Выделенный пул потоков для блокирующих вызовов sqlite3.
+    Обработчики FastAPI не выполняют запросы к базе в event loop,
+    а отправляют их сюда; очередь ожидания ограничена DB_MAX_QUEUE.
+    """
+
+    def __init__(self, workers: int, max_queue: int):
+        self.workers = max(workers, 1)
+        self.max_queue = max(max_queue, 1)
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="compass-db")
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._metrics = {
+            "submitted": 0,
+            "rejected": 0,
+            "queue_wait_total_ms": 0.0,
+            "queue_wait_max_ms": 0.0,
+            "exec_time_total_ms": 0.0,
+            "exec_time_max_ms": 0.0,
+        }
+
+    async def run(self, fn, *args):
+        with self._lock:
+            if self._pending >= self.max_queue:
+                self._metrics["rejected"] += 1
+                raise HTTPException(status_code=503, detail="База данных перегружена, повторите запрос позже")
+            self._pending += 1
+            self._metrics["submitted"] += 1
+        submitted_at = time.monotonic()
+
+        def task():
+            started_at = time.monotonic()
+            try:
+                return fn(*args)
+            finally:
+                finished_at = time.monotonic()
+                self._record(started_at - submitted_at, finished_at - started_at)
+
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, task)
+        except PoolTimeoutError as e:
+            raise HTTPException(status_code=503, detail=str(e))
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+    def _record(self, wait_sec: float, exec_sec: float):
+        wait_ms = wait_sec * 1000
+        exec_ms = exec_sec * 1000
+        with self._lock:
+            self._metrics["queue_wait_total_ms"] += wait_ms
+            self._metrics["queue_wait_max_ms"] = max(self._metrics["queue_wait_max_ms"], wait_ms)
+            self._metrics["exec_time_total_ms"] += exec_ms
+            self._metrics["exec_time_max_ms"] = max(self._metrics["exec_time_max_ms"], exec_ms)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            data = dict(self._metrics)
+            pending = self._pending
+        done = data["submitted"] - pending
+        data.update({
+            "workers": self.workers,
+            "max_queue": self.max_queue,
+            "pending": pending,
+            "queue_wait_avg_ms": round(data["queue_wait_total_ms"] / done, 3) if done > 0 else 0.0,
+            "exec_time_avg_ms": round(data["exec_time_total_ms"] / done, 3) if done > 0 else 0.0,
+        })
+        for key in ("queue_wait_total_ms", "queue_wait_max_ms", "exec_time_total_ms", "exec_time_max_ms"):
+            data[key] = round(data[key], 3)
+        return data
+
+
+db_executor = DatabaseExecutor(DB_MAX_WORKERS, DB_MAX_QUEUE)
+
+
+async def run_db(fn, *args):
+    """Выполняет блокирующую функцию работы с базой в пуле потоков БД"""
+    return await db_executor.run(fn, *args)
+
+
+class DatabaseWriter:
+    """
+    Единственный писатель в базу.
+    Все изменения выполняются в отдельном потоке на своём соединении;
+    задания, пришедшие в пределах DB_GROUP_COMMIT_WINDOW_MS, объединяются
+    в одну транзакцию (group commit). Каждое задание выполняется в своём
+    SAVEPOINT, поэтому ошибка одного не откатывает остальные.
+    """
+
+    _STOP = object()
+
+    def __init__(self, path: str, window_ms: float, max_batch: int, max_queue: int):
+        self.path = path
+        self.window_sec = max(window_ms, 0.0) / 1000
+        self.max_batch = max(max_batch, 1)
+        self.max_queue = max(max_queue, 1)
+        self._queue = queue.Queue()
+        self._thread = None
+        self._paused = False
+        self._closed = False
+        self._start_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._metrics = {
+            "writes": 0,
+            "failed": 0,
+            "rejected": 0,
+            "batches": 0,
+            "batch_size_max": 0,
+            "commit_time_total_ms": 0.0,
+            "commit_time_max_ms": 0.0,
+            "queue_wait_total_ms": 0.0,
+            "queue_wait_max_ms": 0.0,
+        }
+
+    def _ensure_running(self):
+        with self._start_lock:
+            if self._paused:
+                # задание дождётся в очереди конца обслуживания (resume)
+                return
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="compass-db-writer", daemon=True)
+                self._thread.start()
 
-def init_database():
-    """Инициализация базы данных с созданием всех необходимых таблиц"""
+    async def submit(self, fn, *args):
+        """
+        Ставит fn(conn, *args) в очередь писателя и ждёт результата.
+        fn не должна вызывать commit(): транзакцией управляет писатель.
+        """
+        if self._closed:
+            raise HTTPException(status_code=503, detail="Сервер останавливается, повторите запрос позже")
+        if self._queue.qsize() >= self.max_queue:
+            with self._lock:
+                self._metrics["rejected"] += 1
+            raise HTTPException(status_code=503, detail="База данных перегружена, повторите запрос позже")
+        self._ensure_running()
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._queue.put((fn, args, loop, future, time.monotonic()))
+        return await future
+
+    def stop(self):
+        """Останавливает поток писателя, дождавшись уже поставленных заданий"""
+        with self._start_lock:
+            thread = self._thread
+            self._thread = None
+        if thread is not None and thread.is_alive():
+            self._queue.put(self._STOP)
+            thread.join()
+
+    def shutdown(self):
+        """Остановка сервера: выполняет поставленные задания, не дошедшим до писателя — ошибка"""
+        with self._start_lock:
+            self._closed = True
+        self.stop()
+        pending = []
+        while True:
+            try:
+                job = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if job is not self._STOP:
+                pending.append(job)
+        if pending:
+            logger.warning(f"Писатель остановлен, отклонено заданий в очереди: {len(pending)}")
+            self._resolve_batch(pending, [(False, RuntimeError("Писатель базы данных остановлен"))] * len(pending))
+
+    def pause(self):
+        """Выполняет уже поставленные задания и останавливает писателя; новые ждут resume()"""
+        with self._start_lock:
+            self._paused = True
+        self.stop()
+
+    def resume(self):
+        with self._start_lock:
+            self._paused = False
+        if not self._queue.empty():
+            self._ensure_running()
+
+    def _collect_batch(self, first) -> list:
+        batch = [first]
+        deadline = time.monotonic() + self.window_sec
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                job = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if job is self._STOP:
+                self._queue.put(job)
+                break
+            batch.append(job)
+        return batch
+
+    def _run(self):
+        conn = None
+        try:
+            while True:
+                job = self._queue.get()
+                if job is self._STOP:
+                    break
+                batch = self._collect_batch(job)
+                if conn is None:
+                    try:
+                        conn = open_connection(self.path)
+                        conn.isolation_level = None  # транзакциями управляем вручную
+                    except Exception as e:
+                        logger.error(f"Писатель не смог открыть базу данных: {e}")
+                        conn = None
+                        self._resolve_batch(batch, [(False, e)] * len(batch))
+                        continue
+                try:
+                    self._execute_batch(conn, batch)
+                except Exception as e:
+                    # Не удался даже откат: соединение в неизвестном состоянии — открываем заново.
+                    # Поток писателя продолжает работу, иначе все следующие write_db зависнут.
+                    logger.error(f"Писатель потерял соединение с базой данных: {e}")
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+                    conn = None
+                    self._resolve_batch(batch, [(False, e)] * len(batch))
+        finally:
+            if conn is not None:
+                conn.close()
+
+    def _execute_batch(self, conn: sqlite3.Connection, batch: list):
+        started = time.monotonic()
+        results = []
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            for fn, args, _loop, _future, _queued_at in batch:
+                conn.execute("SAVEPOINT job")
+                try:
+                    result = fn(conn, *args)
+                    conn.execute("RELEASE SAVEPOINT job")
+                    results.append((True, result))
+                except Exception as e:
+                    conn.execute("ROLLBACK TO SAVEPOINT job")
+                    conn.execute("RELEASE SAVEPOINT job")
+                    results.append((False, e))
+            conn.execute("COMMIT")
+        except Exception as e:
+            logger.error(f"Ошибка группового коммита: {e}")
+            results = [(False, e)] * len(batch)
+            if conn.in_transaction:
+                # если откат не удастся, пачку завершит с ошибкой _run
+                conn.execute("ROLLBACK")
+
+        finished = time.monotonic()
+        commit_ms = (finished - started) * 1000
+        with self._lock:
+            self._metrics["batches"] += 1
+            self._metrics["batch_size_max"] = max(self._metrics["batch_size_max"], len(batch))
+            self._metrics["commit_time_total_ms"] += commit_ms
+            self._metrics["commit_time_max_ms"] = max(self._metrics["commit_time_max_ms"], commit_ms)
+            for (_fn, _args, _loop, _future, queued_at), (ok, _) in zip(batch, results):
+                wait_ms = (started - queued_at) * 1000
+                self._metrics["queue_wait_total_ms"] += wait_ms
+                self._metrics["queue_wait_max_ms"] = max(self._metrics["queue_wait_max_ms"], wait_ms)
+                self._metrics["writes" if ok else "failed"] += 1
+
+        self._resolve_batch(batch, results)
+
+    def _resolve_batch(self, batch: list, results: list):
+        for (_fn, _args, loop, future, _queued_at), (ok, value) in zip(batch, results):
+            try:
+                loop.call_soon_threadsafe(self._resolve, future, ok, value)
+            except RuntimeError:
+                pass  # event loop уже закрыт — результат ждать некому
+
+    @staticmethod
+    def _resolve(future: asyncio.Future, ok: bool, value):
+        # done() — будущее уже получило ошибку при аварийной обработке пачки
+        if future.done():
+            return
+        if ok:
+            future.set_result(value)
+        else:
+            future.set_exception(value)
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            data = dict(self._metrics)
+        done = data["writes"] + data["failed"]
+        data.update({
+            "window_ms": self.window_sec * 1000,
+            "max_batch": self.max_batch,
+            "pending": self._queue.qsize(),
+            "batch_size_avg": round(done / data["batches"], 3) if data["batches"] else 0.0,
+            "commit_time_avg_ms": round(data["commit_time_total_ms"] / data["batches"], 3) if data["batches"] else 0.0,
+            "queue_wait_avg_ms": round(data["queue_wait_total_ms"] / done, 3) if done else 0.0,
+        })
+        for key in ("commit_time_total_ms", "commit_time_max_ms", "queue_wait_total_ms", "queue_wait_max_ms"):
+            data[key] = round(data[key], 3)
+        return data
+
+
+db_writer = DatabaseWriter(DATABASE_PATH, DB_GROUP_COMMIT_WINDOW_MS, DB_GROUP_COMMIT_MAX_BATCH, DB_WRITE_MAX_QUEUE)
+
+
+async def write_db(fn, *args):
+    """Выполняет fn(conn, *args) через писателя с групповым коммитом"""
+    return await db_writer.submit(fn, *args)
+
+# Версия схемы (PRAGMA user_version), до которой база уже доведена в этом процессе.
+# Пока она равна SCHEMA_VERSION, init_database() не трогает базу.
+# Сбрасывается при замене файла базы (импорт).
+schema_ready_version: Optional[int] = None
+schema_lock = threading.Lock()
+
+def init_database() -> int:
+    """Инициализация базы данных: применяет недостающие миграции схемы (db_schema.py)"""
+    global schema_ready_version
+    if schema_ready_version == SCHEMA_VERSION:
+        return schema_ready_version
     try:
-        with get_db_connection() as conn:
-            cursor = conn.cursor()
-            
-            # Таблица пользователей
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS users (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    telegram_id INTEGER UNIQUE NOT NULL,
-                    telegram_username TEXT,
-                    telegram_first_name TEXT,
-                    telegram_last_name TEXT,
-                    name TEXT NOT NULL,
-                    birth_date TEXT NOT NULL,
-                    birth_place TEXT NOT NULL,
-                    about_me TEXT NOT NULL,
-                    problem TEXT NOT NULL,
-                    created_at TEXT NOT NULL
-                )
-            ''')
-            
-            # Таблица профилей клиентов
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS client_profiles (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    telegram_id INTEGER UNIQUE NOT NULL,
-                    selected_widgets TEXT NOT NULL DEFAULT '[]',
-                    widget_order TEXT NOT NULL DEFAULT '[]',
-                    is_pro BOOLEAN NOT NULL DEFAULT 0,
-                    energy INTEGER NOT NULL DEFAULT 850,
-                    completed_askezas INTEGER NOT NULL DEFAULT 0,
-                    settings TEXT NOT NULL DEFAULT '{}',
-                    created_at TEXT NOT NULL,
-                    updated_at TEXT NOT NULL,
-                    FOREIGN KEY (telegram_id) REFERENCES users (telegram_id)
-                )
-            ''')
-            
-            # Таблица ответов пользователей
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS user_responses (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    telegram_id INTEGER NOT NULL,
-                    response_type TEXT NOT NULL,
-                    response_data TEXT NOT NULL,
-                    date TEXT NOT NULL,
-                    created_at TEXT NOT NULL,
-                    FOREIGN KEY (telegram_id) REFERENCES users (telegram_id)
-                )
-            ''')
-            
-            # Таблица эмоциональных записей
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS emotion_entries (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    telegram_id INTEGER NOT NULL,
-                    type TEXT NOT NULL CHECK (type IN ('morning', 'evening')),
-                    emotion TEXT NOT NULL,
-                    level INTEGER NOT NULL CHECK (level >= 1 AND level <= 10),
-                    date TEXT NOT NULL,
-                    feelings TEXT,
-                    goals TEXT,
-                    gratitude TEXT,
-                    day_reflection TEXT,
-                    tomorrow_goals TEXT,
-                    day_rating INTEGER CHECK (day_rating >= 1 AND day_rating <= 10),
-                    sleep_quality INTEGER CHECK (sleep_quality >= 1 AND sleep_quality <= 10),
-                    morning_mood TEXT,
-                    today_goals TEXT,
-                    intention TEXT,
-                    created_at TEXT NOT NULL,
-                    FOREIGN KEY (telegram_id) REFERENCES users (telegram_id),
-                    UNIQUE(telegram_id, date, type)
-                )
-            ''')
-            
-            # Таблица журнальных записей
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS journal_entries (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    telegram_id INTEGER NOT NULL,
-                    title TEXT NOT NULL,
-                    content TEXT NOT NULL,
-                    mood TEXT,
-                    tags TEXT,
-                    created_at TEXT NOT NULL,
-                    FOREIGN KEY (telegram_id) REFERENCES users (telegram_id)
-                )
-            ''')
-            
-            # Таблица аскез
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS askeza_entries (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    telegram_id INTEGER NOT NULL,
-                    title TEXT NOT NULL,
-                    icon TEXT NOT NULL,
-                    color TEXT NOT NULL,
-                    duration INTEGER NOT NULL,
-                    current_day INTEGER NOT NULL DEFAULT 0,
-                    is_active BOOLEAN NOT NULL DEFAULT 1,
-                    show_on_home BOOLEAN NOT NULL DEFAULT 0,
-                    created_at TEXT NOT NULL,
-                    updated_at TEXT NOT NULL,
-                    FOREIGN KEY (telegram_id) REFERENCES users (telegram_id)
-                )
-            ''')
-            
-            # Создаем индексы для оптимизации
-            cursor.execute('CREATE INDEX IF NOT EXISTS idx_users_telegram_id ON users (telegram_id)')
-            cursor.execute('CREATE INDEX IF NOT EXISTS idx_client_profiles_telegram_id ON client_profiles (telegram_id)')
-            cursor.execute('CREATE INDEX IF NOT EXISTS idx_user_responses_telegram_id ON user_responses (telegram_id)')
-            cursor.execute('CREATE INDEX IF NOT EXISTS idx_emotion_entries_telegram_id ON emotion_entries (telegram_id)')
-            cursor.execute('CREATE INDEX IF NOT EXISTS idx_journal_entries_telegram_id ON journal_entries (telegram_id)')
-            cursor.execute('CREATE INDEX IF NOT EXISTS idx_askeza_entries_telegram_id ON askeza_entries (telegram_id)')
-            
-            conn.commit()
-            logger.info("База данных успешно инициализирована")
+        with schema_lock:
+            if schema_ready_version != SCHEMA_VERSION:
+                with get_db_connection() as conn:
+                    schema_ready_version = migrate(conn)
+                logger.info(f"База данных успешно инициализирована, версия схемы {schema_ready_version}")
+        return schema_ready_version
             
     except Exception as e:
         logger.error(f"Ошибка инициализации базы данных: {e}")
         raise HTTPException(status_code=500, detail=f"Ошибка инициализации базы данных: {str(e)}")
 
+# Постраничная выдача списков (keyset pagination)
+# Курсор — значения ключа сортировки последней записи страницы через запятую,
+# например "2025-01-01T10:00:00,42". Следующая страница: ?after=<курсор>.
+# Курсор следующей страницы возвращается в заголовке X-Next-Cursor: тело ответа
+# остаётся списком, как и до постраничной выдачи, чтобы не ломать существующих клиентов.
+# Без limit и after список отдаётся целиком (прежнее поведение).
+def page_limit(limit: Optional[int], after: Optional[str] = None) -> Optional[int]:
+    if not limit or limit <= 0:
+        return API_PAGE_SIZE if after else None
+    return min(limit, API_MAX_PAGE_SIZE)
+
+def fetch_limit(page_size: Optional[int]) -> int:
+    """LIMIT для выборки страницы: на одну строку больше (признак следующей страницы); -1 — без ограничения"""
+    return page_size + 1 if page_size else -1
+
+def parse_cursor(after: Optional[str], fields: int) -> Optional[list]:
+    if not after:
+        return None
+    parts = after.rsplit(',', fields - 1)
+    try:
+        if len(parts) != fields:
+            raise ValueError(after)
+        parts[-1] = int(parts[-1])
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Некорректный курсор")
+    return parts
+
+# Служебные колонки, которые ведут триггеры базы (db_schema): в ответы API не попадают
+INTERNAL_COLUMNS = {"updated_seq", *(column for _key, columns in MINUTE_COLUMNS.values() for column in columns)}
+
+def row_dict(row) -> Dict[str, Any]:
+    """Строка таблицы для ответа API — без служебных колонок"""
+    return {key: row[key] for key in row.keys() if key not in INTERNAL_COLUMNS}
+
+def paginated_page(rows: list, limit: Optional[int], keys: List[str]):
+    """
+    rows выбраны с LIMIT limit + 1: лишняя строка означает, что есть следующая страница.
+    Возвращает (строки страницы, заголовки с X-Next-Cursor).
+    """
+    headers = {}
+    if limit and len(rows) > limit:
+        rows = rows[:limit]
+        headers["X-Next-Cursor"] = ",".join(str(rows[-1][key]) for key in keys)
+    return [row_dict(row) for row in rows], headers
+
+def etag_body(payload: Any):
+    body = json.dumps(payload, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    return body, '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+
+def etag_matches(request: Request, etag: str) -> bool:
+    if_none_match = request.headers.get("if-none-match", "")
+    return etag in [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+
+def cached_entry_response(request: Request, body: bytes, etag: str, headers: dict) -> Response:
+    """JSON-ответ с ETag; если клиент прислал тот же If-None-Match — 304 без тела"""
+    headers = {**headers, "ETag": etag, "Cache-Control": "no-cache"}
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+# Кэш ответов пользовательских GET-запросов в памяти процесса.
+# Ключ — (шаблон пути, telegram_id, параметры запроса); значение — готовое тело, ETag и заголовки.
+# Запись сбрасывают эндпоинты записи этого пользователя (invalidate_user), импорт и очистка — весь кэш.
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "4096"))
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+
+class ResponseCache:
+    """
+    LRU-кэш ответов. Все методы вызываются из event loop, поэтому блокировки не нужны.
+    Поколение пользователя увеличивается при каждом сбросе: ответ, прочитанный из базы
+    до записи, но готовый уже после сброса, в кэш не попадает.
+    """
+    
+    def __init__(self, max_entries: int, max_bytes: int):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # key -> (body, etag, headers)
+        self._keys_by_user: Dict[int, set] = {}
+        self._generations: Dict[int, int] = {}
+        self._size = 0
+        self.hits = 0
+        self.misses = 0
+    
+    def generation(self, telegram_id: int) -> int:
+        return self._generations.get(telegram_id, 0)
+    
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry
+    
+    def put(self, key, telegram_id: int, generation: int, entry):
+        if self.max_entries <= 0 or generation != self.generation(telegram_id):
+            return
+        self._remove(key)
+        self._entries[key] = entry
+        self._keys_by_user.setdefault(telegram_id, set()).add(key)
+        self._size += len(entry[0])
+        while self._entries and (len(self._entries) > self.max_entries or self._size > self.max_bytes):
+            self._remove(next(iter(self._entries)))
+    
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        self._size -= len(entry[0])
+        keys = self._keys_by_user.get(key[1])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._keys_by_user[key[1]]
+    
+    def invalidate_user(self, telegram_id: int):
+        self._generations[telegram_id] = self.generation(telegram_id) + 1
+        for key in list(self._keys_by_user.get(telegram_id, ())):
+            self._remove(key)
+    
+    def clear(self):
+        for telegram_id in list(self._generations) + list(self._keys_by_user):
+            self._generations[telegram_id] = self.generation(telegram_id) + 1
+        self._entries.clear()
+        self._keys_by_user.clear()
+        self._size = 0
+    
+    def metrics(self) -> dict:
+        return {"entries": len(self._entries), "bytes": self._size, "hits": self.hits, "misses": self.misses}
+
+response_cache = ResponseCache(RESPONSE_CACHE_MAX_ENTRIES, RESPONSE_CACHE_MAX_BYTES)
+
+# Лента изменений (таблица changes, её пишут триггеры при любой записи — из этого
+# процесса, других воркеров сервера или бота). Свои записи эндпоинты сбрасывают
+# сразу; лента нужна, чтобы кэш замечал чужие.
+CHANGES_POLL_SEC = float(os.getenv("CHANGES_POLL_SEC", "1.0"))
+CHANGES_RETENTION_HOURS = int(os.getenv("CHANGES_RETENTION_HOURS", "24"))
+# Счётчик AUTOINCREMENT, а не MAX(seq): не откатывается, когда очистка удалила всю ленту
+CHANGES_LAST_SEQ_SQL = "SELECT COALESCE((SELECT seq FROM sqlite_sequence WHERE name = 'changes'), 0)"
+
+class ChangeListener:
+    """
+    Читает changes на собственном соединении. PRAGMA data_version меняется только
+    после коммита другого соединения — пока базу не меняли, опрос не читает таблицу.
+    """
+    
+    def __init__(self):
+        self._conn = None
+        self._data_version = None
+        self._seq = 0
+        self.received = 0
+    
+    def _connection(self):
+        if self._conn is None:
+            # вызовы идут по одному (из цикла watch_changes), но из разных потоков пула
+            self._conn = sqlite3.connect(DATABASE_PATH, timeout=DB_BUSY_TIMEOUT_SEC, check_same_thread=False)
+        return self._conn
+    
+    def reset(self):
+        """Начинает с конца ленты: при старте кэш пуст, после импорта — сброшен"""
+        self._seq = self._connection().execute(CHANGES_LAST_SEQ_SQL).fetchone()[0]
+        self._data_version = None
+    
+    def poll(self) -> Optional[set]:
+        """telegram_id изменившихся пользователей; None — лента прервана, нужен сброс всего кэша"""
+        conn = self._connection()
+        version = conn.execute("PRAGMA data_version").fetchone()[0]
+        if version == self._data_version:
+            return set()
+        self._data_version = version
+        rows = conn.execute("SELECT seq, telegram_id FROM changes WHERE seq > ? ORDER BY seq", (self._seq,)).fetchall()
+        if rows:
+            # seq идут подряд; разрыв — записи удалены очисткой, пока мы отставали
+            gap = rows[0][0] > self._seq + 1
+            self._seq = rows[-1][0]
+            self.received += len(rows)
+            return None if gap else {row[1] for row in rows}
+        last_seq = conn.execute(CHANGES_LAST_SEQ_SQL).fetchone()[0]
+        if last_seq < self._seq:
+            # файл базы заменён (импорт) — лента началась заново
+            self._seq = last_seq
+            return None
+        return set()
+    
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+change_listener = ChangeListener()
+
+def prune_changes(conn):
+    expire_before = (datetime.utcnow() - timedelta(hours=CHANGES_RETENTION_HOURS)).strftime('%Y-%m-%d %H:%M:%S')
+    deleted = conn.execute('DELETE FROM changes WHERE changed_at < ?', (expire_before,)).rowcount
+    if deleted:
+        logger.info(f"Удалено старых записей ленты изменений: {deleted}")
+
+async def watch_changes():
+    """Сбрасывает кэш ответов по ленте изменений; раз в час чистит старые записи ленты"""
+    next_prune = time.monotonic() + 3600
+    while True:
+        await asyncio.sleep(CHANGES_POLL_SEC)
+        try:
+            if maintenance_lock.locked():
+                continue
+            changed = await run_db(change_listener.poll)
+            if changed is None:
+                response_cache.clear()
+            else:
+                for telegram_id in changed:
+                    response_cache.invalidate_user(telegram_id)
+            if time.monotonic() >= next_prune:
+                next_prune = time.monotonic() + 3600
+                await write_db(prune_changes)
+        except Exception as e:
+            logger.error(f"Ошибка чтения ленты изменений: {e}")
+
+async def cached_response(request: Request, telegram_id: int, load, *variant) -> Response:
+    """
+    Ответ из кэша или от load() — корутины, возвращающей данные ответа либо (данные, заголовки).
+    variant — значения по умолчанию, от которых зависит ответ, но которых нет в строке запроса
+    (например, сегодняшняя дата).
+    """
+    route = request.scope.get("route")
+    key = (
+        route.path if route else request.url.path,
+        telegram_id,
+        tuple(sorted(request.query_params.multi_items())) + variant,
+    )
+    entry = response_cache.get(key)
+    if entry is None:
+        generation = response_cache.generation(telegram_id)
+        result = await load()
+        payload, headers = result if isinstance(result, tuple) else (result, {})
+        body, etag = etag_body(payload)
+        entry = (body, etag, headers)
+        response_cache.put(key, telegram_id, generation, entry)
+    return cached_entry_response(request, *entry)
+
 @app.post("/api/database/init")
 async def initialize_database():
-    """Инициализация базы данных"""
+    """Проверка готовности базы: после старта сервера — ответ из памяти без обращения к базе"""
     try:
-        init_database()
-        return {"message": "База данных успешно инициализирована"}
+        version = schema_ready_version
+        if version != SCHEMA_VERSION:
+            version = await run_db(init_database)
+        return {"message": "База данных успешно инициализирована", "schemaVersion": version}
     except Exception as e:
         logger.error(f"Ошибка инициализации: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -192,7 +889,7 @@ async def create_user(request: Request):
         user_data = await request.json()
         logger.info(f"Создание пользователя: {user_data}")
         
-        with get_db_connection() as conn:
+        def insert(conn):
             cursor = conn.cursor()
             cursor.execute('''
                 INSERT INTO users (telegram_id, telegram_username, telegram_first_name, 
@@ -211,31 +908,41 @@ async def create_user(request: Request):
                 user_data['problem'],
                 user_data['created_at']
             ))
-            conn.commit()
-            user_id = cursor.lastrowid
-            logger.info(f"Пользователь создан с ID: {user_id}")
-            return {"id": user_id}
+            return cursor.lastrowid
+        
+        user_id = await write_db(insert)
+        response_cache.invalidate_user(user_data['telegram_id'])
+        logger.info(f"Пользователь создан с ID: {user_id}")
+        return {"id": user_id}
             
     except sqlite3.IntegrityError as e:
         logger.error(f"Пользователь уже существует: {e}")
         raise HTTPException(status_code=409, detail="Пользователь уже существует")
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Ошибка создания пользователя: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/api/database/users/{telegram_id}")
-async def get_user(telegram_id: int):
+async def get_user(telegram_id: int, request: Request):
     """Получение пользователя по Telegram ID"""
-    try:
+    def select():
         with get_db_connection() as conn:
             cursor = conn.cursor()
             cursor.execute('SELECT * FROM users WHERE telegram_id = ?', (telegram_id,))
-            user = cursor.fetchone()
+            return cursor.fetchone()
+    
+    async def load():
+        user = await run_db(select)
             
-            if user:
-                return dict(user)
-            else:
-                raise HTTPException(status_code=404, detail="Пользователь не найден")
+        if user:
+            return row_dict(user)
+        else:
+            raise HTTPException(status_code=404, detail="Пользователь не найден")
+    
+    try:
+        return await cached_response(request, telegram_id, load)
                 
     except HTTPException:
         raise
@@ -251,7 +958,7 @@ async def create_client_profile_endpoint(request: Request):
         profile_data = await request.json()
         logger.info(f"Создание профиля клиента: {profile_data}")
         
-        with get_db_connection() as conn:
+        def insert(conn):
             cursor = conn.cursor()
             cursor.execute('''
                 INSERT INTO client_profiles (telegram_id, selected_widgets, widget_order, 
@@ -269,31 +976,41 @@ async def create_client_profile_endpoint(request: Request):
                 profile_data['created_at'],
                 profile_data['updated_at']
             ))
-            conn.commit()
-            profile_id = cursor.lastrowid
-            logger.info(f"Профиль клиента создан с ID: {profile_id}")
-            return {"id": profile_id}
+            return cursor.lastrowid
+        
+        profile_id = await write_db(insert)
+        response_cache.invalidate_user(profile_data['telegram_id'])
+        logger.info(f"Профиль клиента создан с ID: {profile_id}")
+        return {"id": profile_id}
             
     except sqlite3.IntegrityError as e:
         logger.error(f"Профиль клиента уже существует: {e}")
         raise HTTPException(status_code=409, detail="Профиль клиента уже существует")
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Ошибка создания профиля клиента: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/api/database/client-profile/{telegram_id}")
-async def get_client_profile(telegram_id: int):
+async def get_client_profile(telegram_id: int, request: Request):
     """Получение профиля клиента по Telegram ID"""
-    try:
+    def select():
         with get_db_connection() as conn:
             cursor = conn.cursor()
             cursor.execute('SELECT * FROM client_profiles WHERE telegram_id = ?', (telegram_id,))
-            profile = cursor.fetchone()
+            return cursor.fetchone()
+    
+    async def load():
+        profile = await run_db(select)
             
-            if profile:
-                return dict(profile)
-            else:
-                raise HTTPException(status_code=404, detail="Профиль клиента не найден")
+        if profile:
+            return row_dict(profile)
+        else:
+            raise HTTPException(status_code=404, detail="Профиль клиента не найден")
+    
+    try:
+        return await cached_response(request, telegram_id, load)
                 
     except HTTPException:
         raise
@@ -326,16 +1043,17 @@ async def update_client_profile(telegram_id: int, request: Request):
         logger.info(f"SQL запрос: {query}")
         logger.info(f"Значения: {values}")
         
-        with get_db_connection() as conn:
+        def update(conn):
             cursor = conn.cursor()
             cursor.execute(query, values)
             
             if cursor.rowcount == 0:
                 raise HTTPException(status_code=404, detail="Профиль клиента не найден")
-            
-            conn.commit()
-            logger.info(f"Профиль клиента {telegram_id} успешно обновлен")
-            return {"message": "Профиль клиента обновлен"}
+        
+        await write_db(update)
+        response_cache.invalidate_user(telegram_id)
+        logger.info(f"Профиль клиента {telegram_id} успешно обновлен")
+        return {"message": "Профиль клиента обновлен"}
             
     except HTTPException:
         raise
@@ -351,7 +1069,7 @@ async def create_askeza(request: Request):
         askeza_data = await request.json()
         logger.info(f"Создание аскезы: {askeza_data}")
         
-        with get_db_connection() as conn:
+        def insert(conn):
             cursor = conn.cursor()
             cursor.execute('''
                 INSERT INTO askeza_entries (telegram_id, title, icon, color, duration, 
@@ -370,37 +1088,57 @@ async def create_askeza(request: Request):
                 askeza_data['created_at'],
                 askeza_data['updated_at']
             ))
-            conn.commit()
-            askeza_id = cursor.lastrowid
-            logger.info(f"Аскеза создана с ID: {askeza_id}")
-            return {"id": askeza_id}
+            return cursor.lastrowid
+        
+        askeza_id = await write_db(insert)
+        response_cache.invalidate_user(askeza_data['telegram_id'])
+        logger.info(f"Аскеза создана с ID: {askeza_id}")
+        return {"id": askeza_id}
             
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Ошибка создания аскезы: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/api/database/askeza/user/{telegram_id}")
-async def get_askeza_entries(telegram_id: int):
-    """Получение всех аскез пользователя"""
-    try:
+async def get_askeza_entries(telegram_id: int, request: Request, after: Optional[str] = None, limit: Optional[int] = None):
+    """Получение аскез пользователя (постранично)"""
+    def select():
         with get_db_connection() as conn:
             cursor = conn.cursor()
-            cursor.execute('''
-                SELECT * FROM askeza_entries 
-                WHERE telegram_id = ? 
-                ORDER BY created_at DESC
-            ''', (telegram_id,))
-            askezas = cursor.fetchall()
-            return [dict(askeza) for askeza in askezas]
+            query = 'SELECT * FROM askeza_entries WHERE telegram_id = ?'
+            params = [telegram_id]
             
+            if key:
+                query += ' AND (created_at, id) < (?, ?)'
+                params.extend(key)
+            
+            query += ' ORDER BY created_at DESC, id DESC LIMIT ?'
+            params.append(fetch_limit(page_size))
+            
+            cursor.execute(query, params)
+            return cursor.fetchall()
+    
+    try:
+        key = parse_cursor(after, 2)
+        page_size = page_limit(limit, after)
+        
+        async def load():
+            return paginated_page(await run_db(select), page_size, ['created_at', 'id'])
+        
+        return await cached_response(request, telegram_id, load)
+            
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Ошибка получения аскез: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/api/database/askeza/user/{telegram_id}/home")
-async def get_home_askezas(telegram_id: int):
+async def get_home_askezas(telegram_id: int, request: Request):
     """Получение аскез для отображения на главной странице"""
-    try:
+    def select():
         with get_db_connection() as conn:
             cursor = conn.cursor()
             cursor.execute('''
@@ -408,10 +1146,18 @@ async def get_home_askezas(telegram_id: int):
                 WHERE telegram_id = ? AND show_on_home = 1
                 ORDER BY created_at DESC
             ''', (telegram_id,))
-            askezas = cursor.fetchall()
-            logger.info(f"Найдено аскез для главной страницы: {len(askezas)}")
-            return [dict(askeza) for askeza in askezas]
+            return [row_dict(askeza) for askeza in cursor.fetchall()]
+    
+    async def load():
+        askezas = await run_db(select)
+        logger.info(f"Найдено аскез для главной страницы: {len(askezas)}")
+        return askezas
+    
+    try:
+        return await cached_response(request, telegram_id, load)
             
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Ошибка получения аскез для главной: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -436,18 +1182,20 @@ async def update_askeza(askeza_id: int, request: Request):
         
         values.append(askeza_id)
         
-        query = f"UPDATE askeza_entries SET {', '.join(set_clauses)} WHERE id = ?"
+        # RETURNING — владелец аскезы, чей кэш ответов нужно сбросить
+        query = f"UPDATE askeza_entries SET {', '.join(set_clauses)} WHERE id = ? RETURNING telegram_id"
         
-        with get_db_connection() as conn:
+        def update(conn):
             cursor = conn.cursor()
-            cursor.execute(query, values)
+            row = cursor.execute(query, values).fetchone()
             
-            if cursor.rowcount == 0:
+            if row is None:
                 raise HTTPException(status_code=404, detail="Аскеза не найдена")
-            
-            conn.commit()
-            logger.info(f"Аскеза {askeza_id} успешно обновлена")
-            return {"message": "Аскеза обновлена"}
+            return row[0]
+        
+        response_cache.invalidate_user(await write_db(update))
+        logger.info(f"Аскеза {askeza_id} успешно обновлена")
+        return {"message": "Аскеза обновлена"}
             
     except HTTPException:
         raise
@@ -458,17 +1206,18 @@ async def update_askeza(askeza_id: int, request: Request):
 @app.delete("/api/database/askeza/{askeza_id}")
 async def delete_askeza(askeza_id: int):
     """Удаление аскезы"""
+    def delete(conn):
+        cursor = conn.cursor()
+        row = cursor.execute('DELETE FROM askeza_entries WHERE id = ? RETURNING telegram_id', (askeza_id,)).fetchone()
+        
+        if row is None:
+            raise HTTPException(status_code=404, detail="Аскеза не найдена")
+        return row[0]
+    
     try:
-        with get_db_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute('DELETE FROM askeza_entries WHERE id = ?', (askeza_id,))
-            
-            if cursor.rowcount == 0:
-                raise HTTPException(status_code=404, detail="Аскеза не найдена")
-            
-            conn.commit()
-            logger.info(f"Аскеза {askeza_id} удалена")
-            return {"message": "Аскеза удалена"}
+        response_cache.invalidate_user(await write_db(delete))
+        logger.info(f"Аскеза {askeza_id} удалена")
+        return {"message": "Аскеза удалена"}
             
     except HTTPException:
         raise
@@ -477,6 +1226,34 @@ async def delete_askeza(askeza_id: int):
         raise HTTPException(status_code=500, detail=str(e))
 
 # Методы для работы с эмоциональными записями
+EMOTION_INSERT_SQL = '''
+    INSERT OR REPLACE INTO emotion_entries 
+    (telegram_id, type, emotion, level, date, feelings, goals, gratitude,
+     day_reflection, tomorrow_goals, day_rating, sleep_quality, 
+     morning_mood, today_goals, intention, created_at)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+'''
+
+def emotion_params(emotion_data: dict) -> tuple:
+    return (
+        emotion_data['telegram_id'],
+        emotion_data['type'],
+        emotion_data['emotion'],
+        emotion_data['level'],
+        emotion_data['date'],
+        emotion_data.get('feelings'),
+        emotion_data.get('goals'),
+        emotion_data.get('gratitude'),
+        emotion_data.get('day_reflection'),
+        emotion_data.get('tomorrow_goals'),
+        emotion_data.get('day_rating'),
+        emotion_data.get('sleep_quality'),
+        emotion_data.get('morning_mood'),
+        emotion_data.get('today_goals'),
+        emotion_data.get('intention'),
+        emotion_data['created_at']
+    )
+
 @app.post("/api/database/emotions")
 async def create_emotion_entry(request: Request):
     """Создание эмоциональной записи"""
@@ -484,82 +1261,78 @@ async def create_emotion_entry(request: Request):
         emotion_data = await request.json()
         logger.info(f"Создание эмоциональной записи: {emotion_data}")
         
-        with get_db_connection() as conn:
+        def insert(conn):
             cursor = conn.cursor()
-            cursor.execute('''
-                INSERT OR REPLACE INTO emotion_entries 
-                (telegram_id, type, emotion, level, date, feelings, goals, gratitude,
-                 day_reflection, tomorrow_goals, day_rating, sleep_quality, 
-                 morning_mood, today_goals, intention, created_at)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                emotion_data['telegram_id'],
-                emotion_data['type'],
-                emotion_data['emotion'],
-                emotion_data['level'],
-                emotion_data['date'],
-                emotion_data.get('feelings'),
-                emotion_data.get('goals'),
-                emotion_data.get('gratitude'),
-                emotion_data.get('day_reflection'),
-                emotion_data.get('tomorrow_goals'),
-                emotion_data.get('day_rating'),
-                emotion_data.get('sleep_quality'),
-                emotion_data.get('morning_mood'),
-                emotion_data.get('today_goals'),
-                emotion_data.get('intention'),
-                emotion_data['created_at']
-            ))
-            conn.commit()
-            emotion_id = cursor.lastrowid
-            logger.info(f"Эмоциональная запись создана с ID: {emotion_id}")
-            return {"id": emotion_id}
+            cursor.execute(EMOTION_INSERT_SQL, emotion_params(emotion_data))
+            return cursor.lastrowid
+        
+        emotion_id = await write_db(insert)
+        response_cache.invalidate_user(emotion_data['telegram_id'])
+        logger.info(f"Эмоциональная запись создана с ID: {emotion_id}")
+        return {"id": emotion_id}
             
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Ошибка создания эмоциональной записи: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/api/database/emotions/user/{telegram_id}")
-async def get_emotion_entries(telegram_id: int, limit: Optional[int] = None):
-    """Получение эмоциональных записей пользователя"""
-    try:
+async def get_emotion_entries(telegram_id: int, request: Request, after: Optional[str] = None, limit: Optional[int] = None):
+    """Получение эмоциональных записей пользователя (постранично, курсор "date,created_at,id")"""
+    def select():
         with get_db_connection() as conn:
             cursor = conn.cursor()
-            query = '''
-                SELECT * FROM emotion_entries 
-                WHERE telegram_id = ? 
-                ORDER BY date DESC, created_at DESC
-            '''
+            query = 'SELECT * FROM emotion_entries WHERE telegram_id = ?'
             params = [telegram_id]
             
-            if limit:
-                query += ' LIMIT ?'
-                params.append(limit)
+            if key:
+                query += ' AND (date, created_at, id) < (?, ?, ?)'
+                params.extend(key)
+            
+            query += ' ORDER BY date DESC, created_at DESC, id DESC LIMIT ?'
+            params.append(fetch_limit(page_size))
             
             cursor.execute(query, params)
-            emotions = cursor.fetchall()
-            return [dict(emotion) for emotion in emotions]
+            return cursor.fetchall()
+    
+    try:
+        key = parse_cursor(after, 3)
+        page_size = page_limit(limit, after)
+        
+        async def load():
+            return paginated_page(await run_db(select), page_size, ['date', 'created_at', 'id'])
+        
+        return await cached_response(request, telegram_id, load)
             
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Ошибка получения эмоциональных записей: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/api/database/emotions/user/{telegram_id}/date/{date}/{type}")
-async def get_emotion_entry_by_date(telegram_id: int, date: str, type: str):
+async def get_emotion_entry_by_date(telegram_id: int, date: str, type: str, request: Request):
     """Получение эмоциональной записи по дате и типу"""
-    try:
+    def select():
         with get_db_connection() as conn:
             cursor = conn.cursor()
             cursor.execute('''
                 SELECT * FROM emotion_entries 
                 WHERE telegram_id = ? AND date = ? AND type = ?
             ''', (telegram_id, date, type))
-            emotion = cursor.fetchone()
+            return cursor.fetchone()
+    
+    async def load():
+        emotion = await run_db(select)
             
-            if emotion:
-                return dict(emotion)
-            else:
-                raise HTTPException(status_code=404, detail="Эмоциональная запись не найдена")
+        if emotion:
+            return row_dict(emotion)
+        else:
+            raise HTTPException(status_code=404, detail="Эмоциональная запись не найдена")
+    
+    try:
+        return await cached_response(request, telegram_id, load)
                 
     except HTTPException:
         raise
@@ -567,7 +1340,148 @@ async def get_emotion_entry_by_date(telegram_id: int, date: str, type: str):
         logger.error(f"Ошибка получения эмоциональной записи: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+# Агрегаты для графиков эмоций — считаются по emotion_daily_rollup (строка на день),
+# а не по полным записям с текстовыми полями
+STATS_BUCKETS = {
+    "day": "date",
+    "week": "date(date, 'weekday 0', '-6 days')",  # понедельник недели
+    "month": "substr(date, 1, 7) || '-01'",
+}
+STATS_DEFAULT_DAYS = int(os.getenv("STATS_DEFAULT_DAYS", "30"))
+
+def parse_stats_date(value: Optional[str], default) -> str:
+    if not value:
+        return default.isoformat()
+    try:
+        return datetime.strptime(value, "%Y-%m-%d").date().isoformat()
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Некорректная дата: {value}")
+
+def stats_row(row) -> dict:
+    return {
+        "days": row["days"],
+        "entries": row["entries"] or 0,
+        "avgLevel": row["avg_level"],
+        "avgMorningLevel": row["avg_morning_level"],
+        "avgEveningLevel": row["avg_evening_level"],
+        "avgDayRating": row["avg_day_rating"],
+        "avgSleepQuality": row["avg_sleep_quality"],
+    }
+
+@app.get("/api/database/emotions/user/{telegram_id}/stats")
+async def get_emotion_stats(telegram_id: int, request: Request, bucket: str = "day"):
+    """Средние, количество, распределение эмоций и серии дней с записями за период"""
+    def select():
+        aggregates = '''
+            COUNT(*) AS days,
+            SUM(entries) AS entries,
+            ROUND(SUM(level_sum) * 1.0 / SUM(entries), 2) AS avg_level,
+            ROUND(AVG(morning_level), 2) AS avg_morning_level,
+            ROUND(AVG(evening_level), 2) AS avg_evening_level,
+            ROUND(AVG(day_rating), 2) AS avg_day_rating,
+            ROUND(AVG(sleep_quality), 2) AS avg_sleep_quality
+        '''
+        with get_db_connection() as conn:
+            conn.execute('BEGIN')
+            try:
+                totals = conn.execute(f'''
+                    SELECT {aggregates} FROM emotion_daily_rollup
+                    WHERE telegram_id = ? AND date BETWEEN ? AND ?
+                ''', (telegram_id, date_from, date_to)).fetchone()
+                
+                buckets = conn.execute(f'''
+                    SELECT {STATS_BUCKETS[bucket]} AS bucket, {aggregates}
+                    FROM emotion_daily_rollup
+                    WHERE telegram_id = ? AND date BETWEEN ? AND ?
+                    GROUP BY 1 ORDER BY 1
+                ''', (telegram_id, date_from, date_to)).fetchall()
+                
+                emotions = conn.execute('''
+                    SELECT emotion, COUNT(*) AS count FROM (
+                        SELECT morning_emotion AS emotion FROM emotion_daily_rollup
+                        WHERE telegram_id = ? AND date BETWEEN ? AND ?
+                        UNION ALL
+                        SELECT evening_emotion FROM emotion_daily_rollup
+                        WHERE telegram_id = ? AND date BETWEEN ? AND ?
+                    )
+                    WHERE emotion IS NOT NULL
+                    GROUP BY emotion ORDER BY count DESC, emotion
+                ''', (telegram_id, date_from, date_to) * 2).fetchall()
+                
+                # Серии подряд идущих дней с записями (gaps and islands):
+                # у дней одной серии разность "день - номер по порядку" одинакова
+                islands = conn.execute('''
+                    WITH numbered AS (
+                        SELECT date,
+                               julianday(date) - ROW_NUMBER() OVER (ORDER BY date) AS island
+                        FROM emotion_daily_rollup
+                        WHERE telegram_id = ? AND date <= ?
+                    )
+                    SELECT MIN(date) AS start, MAX(date) AS end, COUNT(*) AS length
+                    FROM numbered
+                    GROUP BY island
+                    ORDER BY end DESC
+                ''', (telegram_id, date_to)).fetchall()
+            finally:
+                conn.commit()
+        
+        # Текущая серия не прерывается, если за последний день периода записи ещё нет
+        day_before_to = (datetime.strptime(date_to, "%Y-%m-%d") - timedelta(days=1)).date().isoformat()
+        current = islands[0]["length"] if islands and islands[0]["end"] >= day_before_to else 0
+        longest = max(
+            (
+                (datetime.strptime(row["end"], "%Y-%m-%d") - datetime.strptime(max(row["start"], date_from), "%Y-%m-%d")).days + 1
+                for row in islands if row["end"] >= date_from
+            ),
+            default=0,
+        )
+        
+        return {
+            "from": date_from,
+            "to": date_to,
+            "bucket": bucket,
+            "totals": stats_row(totals),
+            "buckets": [{"bucket": row["bucket"], **stats_row(row)} for row in buckets],
+            "emotions": [{"emotion": row["emotion"], "count": row["count"]} for row in emotions],
+            "streaks": {"current": current, "longest": longest},
+        }
+    
+    try:
+        if bucket not in STATS_BUCKETS:
+            raise HTTPException(status_code=400, detail="bucket: day, week или month")
+        today = datetime.now().date()
+        date_to = parse_stats_date(request.query_params.get("to"), today)
+        date_from = parse_stats_date(request.query_params.get("from"), today - timedelta(days=STATS_DEFAULT_DAYS - 1))
+        if date_from > date_to:
+            raise HTTPException(status_code=400, detail="from позже to")
+        
+        async def load():
+            return await run_db(select)
+        
+        return await cached_response(request, telegram_id, load, date_from, date_to)
+            
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Ошибка расчёта статистики эмоций: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 # Методы для работы с журнальными записями
+JOURNAL_INSERT_SQL = '''
+    INSERT INTO journal_entries (telegram_id, title, content, mood, tags, created_at)
+    VALUES (?, ?, ?, ?, ?, ?)
+'''
+
+def journal_params(journal_data: dict) -> tuple:
+    return (
+        journal_data['telegram_id'],
+        journal_data['title'],
+        journal_data['content'],
+        journal_data.get('mood'),
+        journal_data.get('tags'),
+        journal_data['created_at']
+    )
+
 @app.post("/api/database/journal")
 async def create_journal_entry(request: Request):
     """Создание журнальной записи"""
@@ -575,54 +1489,71 @@ async def create_journal_entry(request: Request):
         journal_data = await request.json()
         logger.info(f"Создание журнальной записи: {journal_data}")
         
-        with get_db_connection() as conn:
+        def insert(conn):
             cursor = conn.cursor()
-            cursor.execute('''
-                INSERT INTO journal_entries (telegram_id, title, content, mood, tags, created_at)
-                VALUES (?, ?, ?, ?, ?, ?)
-            ''', (
-                journal_data['telegram_id'],
-                journal_data['title'],
-                journal_data['content'],
-                journal_data.get('mood'),
-                journal_data.get('tags'),
-                journal_data['created_at']
-            ))
-            conn.commit()
-            journal_id = cursor.lastrowid
-            logger.info(f"Журнальная запись создана с ID: {journal_id}")
-            return {"id": journal_id}
+            cursor.execute(JOURNAL_INSERT_SQL, journal_params(journal_data))
+            return cursor.lastrowid
+        
+        journal_id = await write_db(insert)
+        response_cache.invalidate_user(journal_data['telegram_id'])
+        logger.info(f"Журнальная запись создана с ID: {journal_id}")
+        return {"id": journal_id}
             
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Ошибка создания журнальной записи: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/api/database/journal/user/{telegram_id}")
-async def get_journal_entries(telegram_id: int, limit: Optional[int] = None):
-    """Получение журнальных записей пользователя"""
-    try:
+async def get_journal_entries(telegram_id: int, request: Request, after: Optional[str] = None, limit: Optional[int] = None):
+    """Получение журнальных записей пользователя (постранично)"""
+    def select():
         with get_db_connection() as conn:
             cursor = conn.cursor()
-            query = '''
-                SELECT * FROM journal_entries 
-                WHERE telegram_id = ? 
-                ORDER BY created_at DESC
-            '''
+            query = 'SELECT * FROM journal_entries WHERE telegram_id = ?'
             params = [telegram_id]
             
-            if limit:
-                query += ' LIMIT ?'
-                params.append(limit)
+            if key:
+                query += ' AND (created_at, id) < (?, ?)'
+                params.extend(key)
+            
+            query += ' ORDER BY created_at DESC, id DESC LIMIT ?'
+            params.append(fetch_limit(page_size))
             
             cursor.execute(query, params)
-            journals = cursor.fetchall()
-            return [dict(journal) for journal in journals]
+            return cursor.fetchall()
+    
+    try:
+        key = parse_cursor(after, 2)
+        page_size = page_limit(limit, after)
+        
+        async def load():
+            return paginated_page(await run_db(select), page_size, ['created_at', 'id'])
+        
+        return await cached_response(request, telegram_id, load)
             
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Ошибка получения журнальных записей: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 # Методы для работы с ответами пользователей
+USER_RESPONSE_INSERT_SQL = '''
+    INSERT INTO user_responses (telegram_id, response_type, response_data, date, created_at)
+    VALUES (?, ?, ?, ?, ?)
+'''
+
+def user_response_params(response_data: dict) -> tuple:
+    return (
+        response_data['telegram_id'],
+        response_data['response_type'],
+        response_data['response_data'],
+        response_data['date'],
+        response_data['created_at']
+    )
+
 @app.post("/api/database/user-responses")
 async def create_user_response(request: Request):
     """Создание ответа пользователя"""
@@ -630,31 +1561,26 @@ async def create_user_response(request: Request):
         response_data = await request.json()
         logger.info(f"Создание ответа пользователя: {response_data}")
         
-        with get_db_connection() as conn:
+        def insert(conn):
             cursor = conn.cursor()
-            cursor.execute('''
-                INSERT INTO user_responses (telegram_id, response_type, response_data, date, created_at)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (
-                response_data['telegram_id'],
-                response_data['response_type'],
-                response_data['response_data'],
-                response_data['date'],
-                response_data['created_at']
-            ))
-            conn.commit()
-            response_id = cursor.lastrowid
-            logger.info(f"Ответ пользователя создан с ID: {response_id}")
-            return {"id": response_id}
+            cursor.execute(USER_RESPONSE_INSERT_SQL, user_response_params(response_data))
+            return cursor.lastrowid
+        
+        response_id = await write_db(insert)
+        response_cache.invalidate_user(response_data['telegram_id'])
+        logger.info(f"Ответ пользователя создан с ID: {response_id}")
+        return {"id": response_id}
             
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Ошибка создания ответа пользователя: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/api/database/user-responses/{telegram_id}")
-async def get_user_responses(telegram_id: int, type: Optional[str] = None, limit: Optional[int] = None):
-    """Получение ответов пользователя"""
-    try:
+async def get_user_responses(telegram_id: int, request: Request, type: Optional[str] = None, after: Optional[str] = None, limit: Optional[int] = None):
+    """Получение ответов пользователя (постранично)"""
+    def select():
         with get_db_connection() as conn:
             cursor = conn.cursor()
             query = 'SELECT * FROM user_responses WHERE telegram_id = ?'
@@ -664,125 +1590,948 @@ async def get_user_responses(telegram_id: int, type: Optional[str] = None, limit
                 query += ' AND response_type = ?'
                 params.append(type)
             
-            query += ' ORDER BY created_at DESC'
+            if key:
+                query += ' AND (created_at, id) < (?, ?)'
+                params.extend(key)
             
-            if limit:
-                query += ' LIMIT ?'
-                params.append(limit)
+            query += ' ORDER BY created_at DESC, id DESC LIMIT ?'
+            params.append(fetch_limit(page_size))
             
             cursor.execute(query, params)
-            responses = cursor.fetchall()
-            return [dict(response) for response in responses]
+            return cursor.fetchall()
+    
+    try:
+        key = parse_cursor(after, 2)
+        page_size = page_limit(limit, after)
+        
+        async def load():
+            return paginated_page(await run_db(select), page_size, ['created_at', 'id'])
+        
+        return await cached_response(request, telegram_id, load)
             
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Ошибка получения ответов пользователя: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 # Утилитарные методы
-@app.get("/api/database/info")
-async def get_database_info():
-    """Получение информации о базе данных"""
+# Пакетная запись (офлайн-очередь клиента)
+# Тело: [{"op": "emotion" | "journal" | "user_response", "key": "<uuid>", "data": {...}}, ...]
+# Весь пакет — одна транзакция писателя, по одному executemany на таблицу.
+# Повтор операции с уже виденным ключом возвращает прежний id и ничего не пишет.
+BATCH_OPERATIONS = {
+    "emotion": (EMOTION_INSERT_SQL, emotion_params),
+    "journal": (JOURNAL_INSERT_SQL, journal_params),
+    "user_response": (USER_RESPONSE_INSERT_SQL, user_response_params),
+}
+BATCH_MAX_OPERATIONS = int(os.getenv("BATCH_MAX_OPERATIONS", "500"))
+IDEMPOTENCY_TTL_DAYS = int(os.getenv("IDEMPOTENCY_TTL_DAYS", "30"))
+
+def insert_batch_rows(conn, op: str, items: list, results: list):
+    """
+    Вставляет строки одной таблицы одним executemany. id выводятся из last_insert_rowid():
+    у таблиц AUTOINCREMENT, а писатель один, поэтому id пакета идут подряд.
+    Если executemany упал (например, нет пользователя), вставляем по одной,
+    чтобы ошибка касалась только своей операции.
+    """
+    sql, _ = BATCH_OPERATIONS[op]
+    conn.execute("SAVEPOINT batch_rows")
+    try:
+        conn.executemany(sql, [params for _, params in items])
+        last_id = conn.execute("SELECT last_insert_rowid()").fetchone()[0]
+        ids = range(last_id - len(items) + 1, last_id + 1)
+        conn.execute("RELEASE batch_rows")
+    except sqlite3.DatabaseError:
+        conn.execute("ROLLBACK TO batch_rows")
+        conn.execute("RELEASE batch_rows")
+        ids = []
+        for index, params in items:
+            conn.execute("SAVEPOINT batch_row")
+            try:
+                ids.append(conn.execute(sql, params).lastrowid)
+                conn.execute("RELEASE batch_row")
+            except sqlite3.DatabaseError as e:
+                conn.execute("ROLLBACK TO batch_row")
+                conn.execute("RELEASE batch_row")
+                ids.append(None)
+                results[index] = {"index": index, "key": results[index]["key"], "status": "error", "error": str(e)}
+    
+    for (index, params), row_id in zip(items, ids):
+        if row_id is not None:
+            results[index].update(status="created", id=row_id)
+    
+    if op == "emotion":
+        # INSERT OR REPLACE: при повторе (telegram_id, date, type) внутри пакета
+        # ранняя строка заменена поздней — отдаём id итоговой строки
+        final_ids = {}
+        for index, params in items:
+            if results[index]["status"] == "created":
+                final_ids[(params[0], params[4], params[1])] = results[index]["id"]
+        for index, params in items:
+            if results[index]["status"] == "created":
+                results[index]["id"] = final_ids[(params[0], params[4], params[1])]
+
+def apply_batch(conn, operations: list) -> list:
+    """Выполняется в писателе: conn уже внутри транзакции"""
+    now = datetime.now().isoformat()
+    results = []
+    parsed = []  # (index, op, telegram_id, key, params)
+    for index, item in enumerate(operations):
+        key = item.get("key") if isinstance(item, dict) else None
+        results.append({"index": index, "key": key, "status": "pending"})
+        try:
+            op = item["op"]
+            if op not in BATCH_OPERATIONS:
+                raise ValueError(f"Неизвестная операция: {op}")
+            params = BATCH_OPERATIONS[op][1](item["data"])
+            parsed.append((index, op, int(item["data"]["telegram_id"]), key, params))
+        except (KeyError, TypeError, ValueError) as e:
+            detail = f"Не хватает поля {e}" if isinstance(e, KeyError) else str(e)
+            results[index] = {"index": index, "key": key, "status": "error", "error": detail}
+    
+    # Уже обработанные ключи (в том числе повторы внутри пакета)
+    keyed = sorted({(telegram_id, key) for _, _, telegram_id, key, _ in parsed if key})
+    known = {}
+    for start in range(0, len(keyed), 400):
+        chunk = keyed[start:start + 400]
+        rows = conn.execute(
+            "SELECT telegram_id, key, result_id FROM idempotency_keys WHERE (telegram_id, key) IN (VALUES "
+            + ",".join(["(?, ?)"] * len(chunk)) + ")",
+            [value for pair in chunk for value in pair],
+        ).fetchall()
+        known.update({(row[0], row[1]): row[2] for row in rows})
+    
+    by_op = {op: [] for op in BATCH_OPERATIONS}
+    first_with_key = {}
+    for index, op, telegram_id, key, params in parsed:
+        if key and (telegram_id, key) in known:
+            results[index].update(status="duplicate", id=known[(telegram_id, key)])
+        elif key and (telegram_id, key) in first_with_key:
+            results[index].update(status="duplicate", duplicate_of=first_with_key[(telegram_id, key)])
+        else:
+            if key:
+                first_with_key[(telegram_id, key)] = index
+            by_op[op].append((index, params))
+    
+    for op, items in by_op.items():
+        if items:
+            insert_batch_rows(conn, op, items, results)
+    
+    # Повторы внутри пакета получают id первой операции с тем же ключом
+    for result in results:
+        if "duplicate_of" in result:
+            original = results[result.pop("duplicate_of")]
+            if original["status"] == "error":
+                result.update(status="error", error=original["error"])
+            else:
+                result["id"] = original.get("id")
+    
+    conn.executemany(
+        "INSERT OR IGNORE INTO idempotency_keys (telegram_id, key, op, result_id, created_at) VALUES (?, ?, ?, ?, ?)",
+        [
+            (telegram_id, key, op, results[index]["id"], now)
+            for index, op, telegram_id, key, _ in parsed
+            if key and results[index]["status"] == "created"
+        ],
+    )
+    
+    expire_before = (datetime.now() - timedelta(days=IDEMPOTENCY_TTL_DAYS)).isoformat()
+    conn.execute("DELETE FROM idempotency_keys WHERE created_at < ?", (expire_before,))
+    return results
+
+def batch_telegram_ids(operations: list) -> set:
+    telegram_ids = set()
+    for item in operations:
+        try:
+            telegram_ids.add(int(item["data"]["telegram_id"]))
+        except (KeyError, TypeError, ValueError):
+            pass
+    return telegram_ids
+
+@app.post("/api/database/batch")
+async def write_batch(request: Request):
+    """Пакетная запись эмоций, журнала и ответов пользователя одной транзакцией"""
+    try:
+        operations = await request.json()
+        if not isinstance(operations, list):
+            raise HTTPException(status_code=400, detail="Ожидается массив операций")
+        if len(operations) > BATCH_MAX_OPERATIONS:
+            raise HTTPException(status_code=413, detail=f"Не больше {BATCH_MAX_OPERATIONS} операций в пакете")
+        
+        results = await write_db(apply_batch, operations) if operations else []
+        for telegram_id in batch_telegram_ids(operations):
+            response_cache.invalidate_user(telegram_id)
+        created = sum(1 for result in results if result["status"] == "created")
+        logger.info(f"Пакетная запись: {len(results)} операций, создано {created}")
+        return {"results": results}
+            
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Ошибка пакетной записи: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+# Стартовое состояние мини-приложения одним запросом
+@app.get("/api/database/bootstrap/{telegram_id}")
+async def get_bootstrap(telegram_id: int, request: Request, date: Optional[str] = None, journal_limit: Optional[int] = None):
+    """Пользователь, профиль, аскезы главной, записи эмоций за день и последние записи журнала"""
+    def select():
+        with get_db_connection() as conn:
+            # Все чтения в одной транзакции — согласованный снимок
+            conn.execute('BEGIN')
+            try:
+                user = conn.execute('SELECT * FROM users WHERE telegram_id = ?', (telegram_id,)).fetchone()
+                if not user:
+                    return None
+                
+                profile = conn.execute('SELECT * FROM client_profiles WHERE telegram_id = ?', (telegram_id,)).fetchone()
+                home_askezas = conn.execute('''
+                    SELECT * FROM askeza_entries 
+                    WHERE telegram_id = ? AND show_on_home = 1
+                    ORDER BY created_at DESC
+                ''', (telegram_id,)).fetchall()
+                emotions = conn.execute('''
+                    SELECT * FROM emotion_entries 
+                    WHERE telegram_id = ? AND date = ? AND type IN ('morning', 'evening')
+                ''', (telegram_id, day)).fetchall()
+                journal = conn.execute('''
+                    SELECT * FROM journal_entries 
+                    WHERE telegram_id = ?
+                    ORDER BY created_at DESC, id DESC LIMIT ?
+                ''', (telegram_id, page_size + 1)).fetchall()
+            finally:
+                conn.commit()
+        
+        by_type = {row['type']: row_dict(row) for row in emotions}
+        next_cursor = None
+        if len(journal) > page_size:
+            journal = journal[:page_size]
+            next_cursor = f"{journal[-1]['created_at']},{journal[-1]['id']}"
+        
+        return {
+            "user": row_dict(user),
+            "clientProfile": row_dict(profile) if profile else None,
+            "homeAskezas": [row_dict(row) for row in home_askezas],
+            "date": day,
+            "morning": by_type.get('morning'),
+            "evening": by_type.get('evening'),
+            "journal": [row_dict(row) for row in journal],
+            "journalNextCursor": next_cursor,
+        }
+    
     try:
+        day = date or datetime.now().date().isoformat()
+        # Нулевой и отрицательный лимит — как в списках: берём значение по умолчанию
+        if not journal_limit or journal_limit <= 0:
+            journal_limit = BOOTSTRAP_JOURNAL_LIMIT
+        page_size = page_limit(journal_limit)
+        
+        async def load():
+            state = await run_db(select)
+            if state is None:
+                raise HTTPException(status_code=404, detail="Пользователь не найден")
+            return state
+        
+        return await cached_response(request, telegram_id, load, day)
+            
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Ошибка получения стартового состояния: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+# Инкрементальная синхронизация локального кэша мини-приложения.
+# Каждая вставка/изменение строки в db_schema.SYNCED_TABLES получает updated_seq —
+# следующее значение общего счётчика sync_state.seq, удаление — запись в sync_tombstones.
+# Клиент хранит seq из ответа и в следующий раз передаёт его в ?since=.
+SYNC_KEYS = {
+    'users': 'user',
+    'client_profiles': 'clientProfile',
+    'emotion_entries': 'emotions',
+    'journal_entries': 'journal',
+    'askeza_entries': 'askezas',
+}
+
+def prune_sync_tombstones(conn):
+    """Удаляет старые надгробия; клиентам с since не новее удалённых нужна полная синхронизация"""
+    expire_before = (datetime.now() - timedelta(days=SYNC_TOMBSTONE_TTL_DAYS)).strftime('%Y-%m-%d %H:%M:%S')
+    pruned = conn.execute(
+        'SELECT MAX(seq) FROM sync_tombstones WHERE deleted_at < ?', (expire_before,)
+    ).fetchone()[0]
+    if pruned is not None:
+        conn.execute('DELETE FROM sync_tombstones WHERE seq <= ?', (pruned,))
+        conn.execute('UPDATE sync_state SET pruned_seq = MAX(pruned_seq, ?) WHERE id = 1', (pruned,))
+        logger.info(f"Удалены надгробия синхронизации до seq {pruned}")
+
+@app.get("/api/database/sync/{telegram_id}")
+async def sync_user_data(telegram_id: int, since: int = 0):
+    """
+    Строки пользователя, вставленные/изменённые после since, и id удалённых.
+    Если since старше удалённых надгробий или новее текущего seq (база заменена импортом) —
+    reset: true и полный набор строк (как since=0).
+    """
+    def select():
+        with get_db_connection() as conn:
+            # Все чтения в одной транзакции — согласованный снимок
+            conn.execute('BEGIN')
+            try:
+                seq, pruned_seq = conn.execute('SELECT seq, pruned_seq FROM sync_state WHERE id = 1').fetchone()
+                # since новее текущего seq — база заменена (импорт), клиенту нужен полный набор
+                reset = 0 < since < pruned_seq or since > seq
+                start = 0 if reset else since
+                
+                changes = {}
+                for table in SYNCED_TABLES:
+                    rows = conn.execute(
+                        f'SELECT * FROM {table} WHERE telegram_id = ? AND updated_seq > ? ORDER BY updated_seq',
+                        (telegram_id, start),
+                    ).fetchall()
+                    changes[SYNC_KEYS[table]] = [row_dict(row) for row in rows]
+                
+                deleted = {SYNC_KEYS[table]: [] for table in SYNCED_TABLES}
+                if not reset:
+                    for row in conn.execute(
+                        'SELECT table_name, row_id FROM sync_tombstones WHERE telegram_id = ? AND seq > ? ORDER BY seq',
+                        (telegram_id, since),
+                    ):
+                        deleted[SYNC_KEYS[row['table_name']]].append(row['row_id'])
+            finally:
+                conn.commit()
+        
+        return {
+            "seq": seq,
+            "since": since,
+            "reset": reset or since == 0,
+            "changes": changes,
+            "deleted": deleted,
+        }
+    
+    try:
+        if since < 0:
+            raise HTTPException(status_code=400, detail="since должен быть неотрицательным")
+        return await run_db(select)
+            
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Ошибка синхронизации: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+# Ключи ответа /info для таблиц из db_schema.COUNTED_TABLES
+INFO_COUNT_KEYS = {
+    'users': 'userCount',
+    'client_profiles': 'clientProfileCount',
+    'user_responses': 'userResponsesCount',
+    'emotion_entries': 'emotionCount',
+    'journal_entries': 'journalCount',
+    'askeza_entries': 'askezaCount',
+}
+
+@app.get("/api/database/info")
+async def get_database_info(exact: bool = False):
+    """
+    Получение информации о базе данных.
+    По умолчанию числа строк берутся из table_counters (ведутся триггерами) — O(1).
+    ?exact=1 — точный пересчёт COUNT(*) с исправлением счётчиков и размеры таблиц из dbstat.
+    """
+    def recount(conn):
+        # Через писателя: пока идёт пересчёт, счётчики никто не меняет
+        counts = {table: conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0] for table in COUNTED_TABLES}
+        conn.executemany(
+            'INSERT OR REPLACE INTO table_counters (name, row_count) VALUES (?, ?)',
+            list(counts.items()),
+        )
+        return counts
+    
+    def select(counts):
         with get_db_connection() as conn:
             cursor = conn.cursor()
             
             info = {}
-            tables = ['users', 'client_profiles', 'user_responses', 'emotion_entries', 'journal_entries', 'askeza_entries']
-            
-            for table in tables:
-                cursor.execute(f'SELECT COUNT(*) FROM {table}')
-                count = cursor.fetchone()[0]
-                # Исправляем формирование ключей для соответствия ожидаемому формату
-                if table == 'users':
-                    info['userCount'] = count
-                elif table == 'client_profiles':
-                    info['clientProfileCount'] = count
-                elif table == 'user_responses':
-                    info['userResponsesCount'] = count
-                elif table == 'emotion_entries':
-                    info['emotionCount'] = count
-                elif table == 'journal_entries':
-                    info['journalCount'] = count
-                elif table == 'askeza_entries':
-                    info['askezaCount'] = count
+            if counts is None:
+                counts = dict(cursor.execute('SELECT name, row_count FROM table_counters').fetchall())
+            
+            for table in COUNTED_TABLES:
+                info[INFO_COUNT_KEYS[table]] = counts.get(table, 0)
+            
+            page_size = cursor.execute('PRAGMA page_size').fetchone()[0]
+            page_count = cursor.execute('PRAGMA page_count').fetchone()[0]
+            info['pageSize'] = page_size
+            info['pageCount'] = page_count
+            info['freePages'] = cursor.execute('PRAGMA freelist_count').fetchone()[0]
+            info['sizeBytes'] = page_size * page_count
+            
+            if exact:
+                try:
+                    cursor.execute('SELECT name, COUNT(*), SUM(pgsize) FROM dbstat GROUP BY name ORDER BY SUM(pgsize) DESC')
+                    info['tables'] = [{"name": row[0], "pages": row[1], "sizeBytes": row[2]} for row in cursor.fetchall()]
+                except sqlite3.OperationalError:
+                    # SQLite собран без SQLITE_ENABLE_DBSTAT_VTAB
+                    info['tables'] = None
             
             return info
+    
+    try:
+        counts = await write_db(recount) if exact else None
+        return await run_db(select, counts)
             
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Ошибка получения информации о базе: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/api/database/pool")
+async def get_pool_metrics():
+    """Метрики пула соединений, пула потоков, писателя базы данных и кэша ответов"""
+    metrics = db_pool.metrics()
+    metrics["executor"] = db_executor.metrics()
+    metrics["writer"] = db_writer.metrics()
+    metrics["responseCache"] = response_cache.metrics()
+    return metrics
+
 @app.delete("/api/database/clear")
 async def clear_database():
     """Очистка всех данных из базы"""
+    def delete(conn):
+        cursor = conn.cursor()
+        
+        tables = ['askeza_entries', 'journal_entries', 'emotion_entries', 'user_responses', 'client_profiles', 'users']
+        
+        for table in tables:
+            cursor.execute(f'DELETE FROM {table}')
+    
     try:
-        with get_db_connection() as conn:
-            cursor = conn.cursor()
-            
-            tables = ['askeza_entries', 'journal_entries', 'emotion_entries', 'user_responses', 'client_profiles', 'users']
-            
-            for table in tables:
-                cursor.execute(f'DELETE FROM {table}')
-            
-            conn.commit()
-            logger.info("База данных очищена")
-            return {"message": "База данных очищена"}
+        await write_db(delete)
+        response_cache.clear()
+        logger.info("База данных очищена")
+        return {"message": "База данных очищена"}
             
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Ошибка очистки базы данных: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+# Экспорт: снимок через online backup API во временный файл рядом с базой.
+# Снимок включает данные, ещё не перенесённые из compass.db-wal, и не может
+# оказаться "порванным" посреди checkpoint. Копирование идёт в одной
+# read-транзакции — в WAL-режиме она не блокирует писателей.
+EXPORT_CHUNK_SIZE = 1024 * 1024
+EXPORT_COMPRESSIONS = {
+    "none": ("application/octet-stream", ".db"),
+    "gzip": ("application/gzip", ".db.gz"),
+    "zstd": ("application/zstd", ".db.zst"),
+}
+
+def remove_files(*paths):
+    for path in paths:
+        if path and os.path.exists(path):
+            os.remove(path)
+
+def make_export_file(compression: str) -> tuple:
+    """Создаёт снимок базы (при необходимости сжатый) и возвращает (путь, размер, sha256)"""
+    directory = os.path.dirname(os.path.abspath(DATABASE_PATH))
+    fd, snapshot_path = tempfile.mkstemp(prefix="compass_export_", suffix=".db", dir=directory)
+    os.close(fd)
+    export_path = snapshot_path
+    try:
+        source = sqlite3.connect(DATABASE_PATH, timeout=DB_BUSY_TIMEOUT_SEC)
+        target = sqlite3.connect(snapshot_path)
+        try:
+            source.backup(target)
+        finally:
+            target.close()
+            source.close()
+        
+        if compression != "none":
+            export_path = snapshot_path + EXPORT_COMPRESSIONS[compression][1].removeprefix(".db")
+            with open(snapshot_path, "rb") as src, open(export_path, "wb") as dst:
+                if compression == "gzip":
+                    with gzip.GzipFile(fileobj=dst, mode="wb", compresslevel=6) as packed:
+                        shutil.copyfileobj(src, packed, EXPORT_CHUNK_SIZE)
+                else:
+                    zstandard.ZstdCompressor(level=3).copy_stream(src, dst)
+            os.remove(snapshot_path)
+        
+        digest = hashlib.sha256()
+        with open(export_path, "rb") as f:
+            for chunk in iter(lambda: f.read(EXPORT_CHUNK_SIZE), b""):
+                digest.update(chunk)
+        return export_path, os.path.getsize(export_path), digest.hexdigest()
+    except Exception:
+        remove_files(snapshot_path, export_path)
+        raise
+
+def iter_file(path: str):
+    try:
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(EXPORT_CHUNK_SIZE), b""):
+                yield chunk
+    finally:
+        # на случай обрыва загрузки клиентом, когда фоновая задача не запускается
+        remove_files(path)
+
 @app.get("/api/database/export")
-async def export_database():
-    """Экспорт базы данных"""
-    try:
-        if os.path.exists(DATABASE_PATH):
-            return FileResponse(
-                DATABASE_PATH,
-                media_type='application/octet-stream',
-                filename='compass_backup.db'
-            )
-        else:
+async def export_database(compression: str = "none"):
+    """Экспорт базы данных: согласованный снимок, опционально gzip/zstd, SHA-256 в X-Checksum-SHA256"""
+    try:
+        if compression not in EXPORT_COMPRESSIONS:
+            raise HTTPException(status_code=400, detail="compression: none, gzip или zstd")
+        if compression == "zstd" and zstandard is None:
+            raise HTTPException(status_code=400, detail="Сжатие zstd недоступно: не установлен пакет zstandard")
+        if not os.path.exists(DATABASE_PATH):
             raise HTTPException(status_code=404, detail="База данных не найдена")
+        
+        export_path, size, checksum = await run_db(make_export_file, compression)
+        media_type, extension = EXPORT_COMPRESSIONS[compression]
+        logger.info(f"Экспорт базы: {size} байт, sha256 {checksum}")
+        return StreamingResponse(
+            iter_file(export_path),
+            media_type=media_type,
+            headers={
+                "Content-Disposition": f'attachment; filename="compass_backup{extension}"',
+                "Content-Length": str(size),
+                "X-Checksum-SHA256": checksum,
+            },
+            background=BackgroundTask(remove_files, export_path),
+        )
             
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Ошибка экспорта базы данных: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+# Импорт базы.
+# Загрузка сохраняется во временный файл, проверяется (quick_check/integrity_check,
+# версия схемы) и доводится миграциями до текущей схемы — всё это без
+# блокировок живой базы. Затем под блокировкой обслуживания (писатель
+# остановлен, пул соединений опустошён) содержимое переносится в живую базу
+# через online backup API: это одна транзакция записи, поэтому бот, работающий
+# с тем же файлом, видит либо старую базу, либо новую целиком.
+IMPORT_MAX_BYTES = int(os.getenv("IMPORT_MAX_BYTES", str(512 * 1024 * 1024)))
+DB_MAINTENANCE_TIMEOUT_SEC = float(os.getenv("DB_MAINTENANCE_TIMEOUT_SEC", "30"))
+SQLITE_HEADER = b"SQLite format 3\x00"
+
+maintenance_lock = threading.Lock()
+
+@contextmanager
+def database_maintenance():
+    """Монопольный доступ процесса к базе: писатель остановлен, соединения пула закрыты"""
+    with maintenance_lock:
+        db_writer.pause()
+        try:
+            db_pool.pause_and_drain(DB_MAINTENANCE_TIMEOUT_SEC)
+            try:
+                yield
+            finally:
+                db_pool.resume()
+        finally:
+            db_writer.resume()
+
+def save_upload(source) -> str:
+    """Копирует загруженный файл во временный файл рядом с базой (блокирующая операция)"""
+    directory = os.path.dirname(os.path.abspath(DATABASE_PATH))
+    fd, path = tempfile.mkstemp(prefix="compass_import_", suffix=".db", dir=directory)
+    try:
+        size = 0
+        with os.fdopen(fd, "wb") as target:
+            for chunk in iter(lambda: source.read(EXPORT_CHUNK_SIZE), b""):
+                size += len(chunk)
+                if size > IMPORT_MAX_BYTES:
+                    raise HTTPException(status_code=413, detail="Файл базы слишком большой")
+                target.write(chunk)
+        with open(path, "rb") as f:
+            if f.read(len(SQLITE_HEADER)) != SQLITE_HEADER:
+                raise HTTPException(status_code=400, detail="Файл не является базой SQLite")
+        return path
+    except Exception:
+        remove_files(path)
+        raise
+
+def prepare_import_file(path: str, full_check: bool) -> Dict[str, Any]:
+    """Проверяет загруженную базу и применяет к ней миграции (живую базу не трогает)"""
+    conn = sqlite3.connect(path)
+    try:
+        try:
+            check = conn.execute("PRAGMA integrity_check" if full_check else "PRAGMA quick_check").fetchall()
+        except sqlite3.DatabaseError as e:
+            raise HTTPException(status_code=400, detail=f"Файл базы повреждён: {e}")
+        if [row[0] for row in check] != ["ok"]:
+            raise HTTPException(status_code=400, detail=f"Проверка целостности не пройдена: {check[0][0]}")
+        
+        version = schema_version(conn)
+        if version > SCHEMA_VERSION:
+            raise HTTPException(status_code=400, detail=f"База новее сервера: схема {version}, поддерживается до {SCHEMA_VERSION}")
+        has_users = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'users'").fetchone()
+        if not has_users:
+            raise HTTPException(status_code=400, detail="В файле нет таблиц COMPASS")
+        
+        conn.execute("PRAGMA journal_mode = DELETE")
+        migrate(conn)
+        foreign_key_errors = len(conn.execute("PRAGMA foreign_key_check").fetchall())
+        
+        # В WAL-режиме backup не может поменять размер страницы живой базы
+        with get_db_connection() as live:
+            live_page_size = live.execute("PRAGMA page_size").fetchone()[0]
+        if conn.execute("PRAGMA page_size").fetchone()[0] != live_page_size:
+            conn.execute(f"PRAGMA page_size = {live_page_size}")
+            conn.execute("VACUUM")
+        
+        return {"schemaVersion": version, "migratedTo": schema_version(conn), "foreignKeyErrors": foreign_key_errors}
+    finally:
+        conn.close()
+
+def copy_database(source_path: str, target_path: str):
+    """Копирует базу целиком через online backup API (одна транзакция записи в target)"""
+    source = sqlite3.connect(source_path, timeout=DB_BUSY_TIMEOUT_SEC)
+    target = sqlite3.connect(target_path, timeout=DB_BUSY_TIMEOUT_SEC)
+    try:
+        source.backup(target)
+    finally:
+        target.close()
+        source.close()
+
+def restore_database_file(import_path: str):
+    """Заменяет содержимое живой базы проверенным файлом (блокирующая операция)"""
+    global schema_ready_version
+    backup_path = f"{DATABASE_PATH}.backup"
+    with database_maintenance():
+        # Резервная копия текущей базы — тоже согласованный снимок, включая WAL
+        copy_database(DATABASE_PATH, backup_path)
+        schema_ready_version = None
+        try:
+            copy_database(import_path, DATABASE_PATH)
+        except Exception:
+            logger.error("Импорт не удался, возвращаем резервную копию")
+            copy_database(backup_path, DATABASE_PATH)
+            raise
+    init_database()
+
+# Данные одного пользователя: (таблица, способ слияния, ключ).
+# Порядок важен — сначала родительские строки (внешние ключи на users).
+#   upsert  — строка с тем же ключом обновляется импортируемыми значениями
+#   replace — INSERT OR REPLACE (emotion_entries: так же пишет и API; заменяемую строку
+#             обрабатывают DELETE-триггеры, соединение включает recursive_triggers)
+#   new     — вставляется, только если такой строки (по ключу) ещё нет
+#   ignore  — INSERT OR IGNORE по UNIQUE-ключу таблицы
+USER_DATA_TABLES = [
+    ("users", "upsert", ("telegram_id",)),
+    ("client_profiles", "upsert", ("telegram_id",)),
+    ("notification_settings", "upsert", ("telegram_id",)),
+    ("emotion_entries", "replace", ("telegram_id", "date", "type")),
+    ("journal_entries", "new", ("telegram_id", "created_at", "title")),
+    ("user_responses", "new", ("telegram_id", "response_type", "created_at")),
+    ("askeza_entries", "new", ("telegram_id", "title", "created_at")),
+    ("askeza_reminder_settings", "upsert", ("telegram_id", "askeza_id")),
+    ("reminder_log", "ignore", ("telegram_id", "kind", "date")),
+]
+
+def table_columns(conn, table: str) -> List[str]:
+    return [row[1] for row in conn.execute(f"PRAGMA table_info({table})").fetchall()]
+
+# Допустимые JSON-типы значений по объявленному типу колонки; остальные колонки не проверяются
+IMPORT_VALUE_TYPES = {"INTEGER": (int,), "REAL": (int, float), "TEXT": (str,)}
+
+def import_row_rules(conn) -> Dict[str, tuple]:
+    """
+    Правила проверки импортируемых строк по схеме базы:
+    {таблица: (обязательные колонки, {колонка: допустимые типы})}.
+    id назначается заново, telegram_id берётся из пути, служебные колонки ведут триггеры.
+    """
+    rules = {}
+    for table, _mode, _key in USER_DATA_TABLES:
+        required, types = [], {}
+        for _cid, name, declared, notnull, _default, _pk in conn.execute(f"PRAGMA table_info({table})"):
+            if name in ("id", "telegram_id") or name in INTERNAL_COLUMNS:
+                continue
+            if notnull:
+                required.append(name)
+            if declared.upper() in IMPORT_VALUE_TYPES:
+                types[name] = IMPORT_VALUE_TYPES[declared.upper()]
+        rules[table] = (required, types)
+    return rules
+
+def check_import_row(table: str, row: dict, rules: Dict[str, tuple]):
+    required, types = rules[table]
+    # id не переносится, но по нему пересчитываются ссылки на аскезы
+    row_id = row.get("id")
+    if row_id is not None and (isinstance(row_id, bool) or not isinstance(row_id, int)):
+        raise ValueError(f"{table}.id: недопустимое значение {row_id!r}")
+    missing = [column for column in required if row.get(column) is None]
+    if missing:
+        raise ValueError(f"{table}: нет обязательных полей {', '.join(missing)}")
+    for column, allowed in types.items():
+        value = row.get(column)
+        if value is not None and (isinstance(value, bool) or not isinstance(value, allowed)):
+            raise ValueError(f"{table}.{column}: недопустимое значение {value!r}")
+
+def _import_user_records(conn, telegram_id: int, records: Dict[str, list]) -> Dict[str, int]:
+    """
+    Сливает записи одного пользователя в базу (conn — соединение писателя, внутри транзакции).
+    records: {таблица: [строка-словарь, ...]} в формате строк таблиц COMPASS.
+    id строк не переносятся — назначаются заново; ссылки на аскезы
+    (askeza_reminder_settings.askeza_id, reminder_log.kind = 'askeza:<id>') пересчитываются.
+    Возвращает число вставленных/обновлённых строк по таблицам.
+    """
+    imported = {}
+    askeza_ids = {}  # id аскезы в источнике -> id в этой базе
+    for table, mode, key in USER_DATA_TABLES:
+        rows = [dict(row, telegram_id=telegram_id) for row in records.get(table, [])]
+        if not rows:
+            continue
+        # Служебные колонки (INTERNAL_COLUMNS) назначают триггеры этой базы
+        columns = [column for column in table_columns(conn, table) if column != "id" and column not in INTERNAL_COLUMNS]
+        
+        if table == "askeza_entries":
+            # id нужны по одной строке, чтобы пересчитать ссылки; аскез у пользователя немного
+            count = 0
+            for row in rows:
+                params = [row.get(column) for column in columns]
+                existing = conn.execute(
+                    "SELECT id FROM askeza_entries WHERE telegram_id = ? AND title = ? AND created_at = ?",
+                    (telegram_id, row.get("title"), row.get("created_at")),
+                ).fetchone()
+                if existing:
+                    new_id = existing[0]
+                else:
+                    new_id = conn.execute(
+                        f"INSERT INTO askeza_entries ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+                        params,
+                    ).lastrowid
+                    count += 1
+                if row.get("id") is not None:
+                    askeza_ids[int(row["id"])] = new_id
+            imported[table] = count
+            continue
+        
+        if table == "askeza_reminder_settings":
+            rows = [dict(row, askeza_id=askeza_ids[int(row["askeza_id"])]) for row in rows if int(row["askeza_id"]) in askeza_ids]
+        elif table == "reminder_log":
+            for row in rows:
+                kind = row.get("kind") or ""
+                if kind.startswith("askeza:"):
+                    old_id = int(kind.split(":", 1)[1])
+                    row["kind"] = f"askeza:{askeza_ids.get(old_id, old_id)}"
+        
+        placeholders = ", ".join("?" * len(columns))
+        if mode == "upsert":
+            updates = ", ".join(f"{column} = excluded.{column}" for column in columns if column not in key)
+            sql = (f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({placeholders}) "
+                   f"ON CONFLICT ({', '.join(key)}) DO UPDATE SET {updates}")
+        elif mode == "replace":
+            sql = f"INSERT OR REPLACE INTO {table} ({', '.join(columns)}) VALUES ({placeholders})"
+        elif mode == "ignore":
+            sql = f"INSERT OR IGNORE INTO {table} ({', '.join(columns)}) VALUES ({placeholders})"
+        else:
+            match = " AND ".join(f"{column} IS ?" for column in key)
+            sql = (f"INSERT INTO {table} ({', '.join(columns)}) SELECT {placeholders} "
+                   f"WHERE NOT EXISTS (SELECT 1 FROM {table} WHERE {match})")
+        
+        params = []
+        for row in rows:
+            values = [row.get(column) for column in columns]
+            if mode == "new":
+                values += [row.get(column) for column in key]
+            params.append(values)
+        cursor = conn.executemany(sql, params)
+        imported[table] = cursor.rowcount
+    return imported
+
+def read_user_records(path: str, telegram_id: int) -> Dict[str, list]:
+    """Читает строки пользователя из проверенного файла базы"""
+    conn = sqlite3.connect(path)
+    conn.row_factory = sqlite3.Row
+    try:
+        records = {}
+        for table, _mode, _key in USER_DATA_TABLES:
+            rows = conn.execute(f"SELECT * FROM {table} WHERE telegram_id = ?", (telegram_id,)).fetchall()
+            records[table] = [dict(row) for row in rows]
+        return records
+    finally:
+        conn.close()
+
 @app.post("/api/database/import")
-async def import_database(database: UploadFile = File(...)):
-    """Импорт базы данных"""
+async def import_database(
+    database: UploadFile = File(...),
+    mode: str = "replace",
+    telegram_id: Optional[int] = None,
+    full_check: bool = False,
+):
+    """
+    Импорт базы данных.
+    mode=replace — заменить всю базу; mode=merge&telegram_id=... — слить данные одного пользователя.
+    """
+    import_path = None
     try:
-        # Создаем резервную копию текущей базы
-        if os.path.exists(DATABASE_PATH):
-            backup_path = f"{DATABASE_PATH}.backup"
-            shutil.copy2(DATABASE_PATH, backup_path)
+        if mode not in ("replace", "merge"):
+            raise HTTPException(status_code=400, detail="mode: replace или merge")
+        if mode == "merge" and telegram_id is None:
+            raise HTTPException(status_code=400, detail="Для mode=merge нужен telegram_id")
         
-        # Сохраняем загруженную базу
-        with open(DATABASE_PATH, "wb") as buffer:
-            shutil.copyfileobj(database.file, buffer)
+        import_path = await run_db(save_upload, database.file)
+        checks = await run_db(prepare_import_file, import_path, full_check)
         
-        # Проверяем целостность загруженной базы
-        init_database()
+        if mode == "merge":
+            records = await run_db(read_user_records, import_path, telegram_id)
+            if not records["users"]:
+                raise HTTPException(status_code=404, detail="Пользователь не найден в файле")
+            imported = await write_db(_import_user_records, telegram_id, records)
+            response_cache.invalidate_user(telegram_id)
+            logger.info(f"Данные пользователя {telegram_id} импортированы: {imported}")
+            return {"message": "Данные пользователя импортированы", "imported": imported, **checks}
         
+        await run_db(restore_database_file, import_path)
+        response_cache.clear()
         logger.info("База данных успешно импортирована")
-        return {"message": "База данных успешно импортирована"}
+        return {"message": "База данных успешно импортирована", **checks}
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Ошибка импорта базы данных: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        if import_path:
+            await run_db(remove_files, import_path)
+
+# Данные одного пользователя в формате JSON Lines (перенос между базами, запросы GDPR).
+# Первая строка — заголовок, далее по строке на запись: {"table": ..., "row": {...}}.
+USER_EXPORT_FORMAT = "compass-user-export"
+
+def iter_user_export(telegram_id: int):
+    """Генератор строк NDJSON: записи читаются курсором по одной, память не растёт с объёмом данных"""
+    conn = open_connection(DATABASE_PATH)
+    try:
+        # Одна read-транзакция — согласованный снимок всех таблиц
+        conn.execute("BEGIN")
+        header = {
+            "format": USER_EXPORT_FORMAT,
+            "schemaVersion": schema_version(conn),
+            "telegram_id": telegram_id,
+            "exportedAt": datetime.now().isoformat(),
+        }
+        yield json.dumps(header, ensure_ascii=False) + "\n"
+        for table, _mode, _key in USER_DATA_TABLES:
+            for row in conn.execute(f"SELECT * FROM {table} WHERE telegram_id = ?", (telegram_id,)):
+                yield json.dumps({"table": table, "row": row_dict(row)}, ensure_ascii=False) + "\n"
+        conn.commit()
+    finally:
+        conn.close()
+
+@app.get("/api/database/users/{telegram_id}/export")
+async def export_user_data(telegram_id: int):
+    """Экспорт всех данных пользователя (NDJSON, потоково)"""
+    def select():
+        with get_db_connection() as conn:
+            return conn.execute('SELECT 1 FROM users WHERE telegram_id = ?', (telegram_id,)).fetchone()
+    
+    try:
+        if not await run_db(select):
+            raise HTTPException(status_code=404, detail="Пользователь не найден")
         
-        # Восстанавливаем резервную копию в случае ошибки
-        backup_path = f"{DATABASE_PATH}.backup"
-        if os.path.exists(backup_path):
-            shutil.copy2(backup_path, DATABASE_PATH)
+        return StreamingResponse(
+            iter_user_export(telegram_id),
+            media_type="application/x-ndjson",
+            headers={"Content-Disposition": f'attachment; filename="compass_user_{telegram_id}.ndjson"'},
+        )
+            
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Ошибка экспорта данных пользователя: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/api/database/users/{telegram_id}/import")
+async def import_user_data(telegram_id: int, request: Request):
+    """
+    Импорт данных пользователя из NDJSON (формат export_user_data).
+    Строки сливаются с базой через _import_user_records одной транзакцией;
+    telegram_id из пути заменяет telegram_id в строках — так данные можно перенести на другой аккаунт.
+    """
+    known_tables = {table for table, _mode, _key in USER_DATA_TABLES}
+    
+    def load_rules():
+        with get_db_connection() as conn:
+            return import_row_rules(conn)
+    
+    def parse_line(line: bytes, records: Dict[str, list]):
+        item = json.loads(line)
+        if not isinstance(item, dict):
+            raise ValueError(f"Ожидался JSON-объект: {line[:100]!r}")
+        if "format" in item:
+            if item["format"] != USER_EXPORT_FORMAT:
+                raise ValueError(f"Неизвестный формат: {item['format']}")
+            version = item.get("schemaVersion", 0)
+            if isinstance(version, bool) or not isinstance(version, int):
+                raise ValueError(f"Некорректная версия схемы: {version!r}")
+            if version > SCHEMA_VERSION:
+                raise ValueError("Экспорт сделан более новой версией сервера")
+            return
+        if item.get("table") not in known_tables or not isinstance(item.get("row"), dict):
+            raise ValueError(f"Неизвестная строка: {line[:100]!r}")
+        check_import_row(item["table"], item["row"], rules)
+        records[item["table"]].append(item["row"])
+    
+    try:
+        rules = await run_db(load_rules)
+        records = {table: [] for table in known_tables}
+        size = 0
+        pending = b""
+        line_number = 0
+        async for chunk in request.stream():
+            size += len(chunk)
+            if size > IMPORT_MAX_BYTES:
+                raise HTTPException(status_code=413, detail="Файл слишком большой")
+            *lines, pending = (pending + chunk).split(b"\n")
+            for line in lines:
+                line_number += 1
+                if line.strip():
+                    try:
+                        parse_line(line, records)
+                    except ValueError as e:
+                        raise HTTPException(status_code=400, detail=f"Строка {line_number}: {e}")
+        if pending.strip():
+            try:
+                parse_line(pending, records)
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=f"Строка {line_number + 1}: {e}")
+        
+        if not records["users"]:
+            raise HTTPException(status_code=400, detail="В данных нет строки users")
         
+        try:
+            imported = await write_db(_import_user_records, telegram_id, records)
+        except (sqlite3.IntegrityError, TypeError, ValueError) as e:
+            # задание писателя откатывается целиком — в базе ничего не меняется
+            raise HTTPException(status_code=400, detail=f"Данные не подходят для импорта: {e}")
+        response_cache.invalidate_user(telegram_id)
+        logger.info(f"Данные пользователя {telegram_id} импортированы: {imported}")
+        return {"message": "Данные пользователя импортированы", "imported": imported}
+            
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Ошибка импорта данных пользователя: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 if __name__ == "__main__":
+    import sys
     import uvicorn
     
     # Инициализируем базу данных при запуске
     init_database()
     
+    with get_db_connection() as conn:
+        plan_problems = check_query_plans(conn)
+    for problem in plan_problems:
+        logger.warning(f"Неоптимальный план запроса: {problem}")
+    
+    # python server.py --check-query-plans — проверка планов без запуска сервера
+    if "--check-query-plans" in sys.argv:
+        sys.exit(1 if plan_problems else 0)
+    
     # Запускаем сервер
-    uvicorn.run(app, host="0.0.0.0", port=8000, log_level="info")
\ No newline at end of file
+    uvicorn.run(app, host="0.0.0.0", port=8000, log_level="info")
@@ -1,6 +1,6 @@
 import { useState, useEffect } from 'react';
 import GlassCard from '../base/GlassCard';
-import { dbManager, getTelegramUserId, type EmotionEntry } from '../../utils/database';
+import { dbManager, getTelegramUserId, type EmotionStats } from '../../utils/database';
 
 type ChartPeriod = 'week' | 'month';
 type ChartStyle = 'line' | 'bars' | 'area';
@@ -20,7 +20,7 @@ const colorSchemes = {
 };
 
 export default function EmotionChart() {
-  const [chartData, setChartData] = useState<EmotionEntry[]>([]);
+  const [stats, setStats] = useState<EmotionStats | null>(null);
   const [loading, setLoading] = useState(true);
   const [showSettings, setShowSettings] = useState(false);
   const [settings, setSettings] = useState<ChartSettings>({
@@ -38,20 +38,15 @@ export default function EmotionChart() {
       setLoading(true);
       await dbManager.init();
       const telegramId = getTelegramUserId();
-      const days = settings.period === 'week' ? 7 : 30;
-      const entries = await dbManager.getEmotionEntriesByTelegramId(telegramId, days * 2);
+      // Средние по дням периода считает сервер (GET /stats), записи целиком не загружаем
+      const days = getDays();
+      const data = await dbManager.getEmotionStats(telegramId, days[0].date, days[days.length - 1].date);
 
-      const cutoffDate = new Date();
-      cutoffDate.setDate(cutoffDate.getDate() - days);
-      const filteredEntries = entries.filter(entry =>
-        new Date(entry.date) >= cutoffDate
-      );
-
-      console.log('Загружено записей эмоций:', filteredEntries.length);
-      setChartData(filteredEntries);
+      console.log('Загружено записей эмоций:', data.totals.entries);
+      setStats(data);
     } catch (error) {
       console.error('Ошибка загрузки данных графика:', error);
-      setChartData([]);
+      setStats(null);
     } finally {
       setLoading(false);
     }
@@ -106,17 +101,17 @@ export default function EmotionChart() {
   }
 
   const days = getDays();
-  const groupedData = chartData.reduce((acc, entry) => {
-    const date = entry.date;
-    if (!acc[date]) {
-      acc[date] = {};
-    }
-    acc[date][entry.type] = entry;
+  const groupedData = (stats?.buckets ?? []).reduce((acc, bucket) => {
+    acc[bucket.bucket] = {
+      morning: bucket.avgMorningLevel != null ? { level: bucket.avgMorningLevel } : undefined,
+      evening: bucket.avgEveningLevel != null ? { level: bucket.avgEveningLevel } : undefined,
+    };
     return acc;
-  }, {} as Record<string, Record<string, EmotionEntry>>);
+  }, {} as Record<string, { morning?: { level: number }; evening?: { level: number } }>);
 
   const maxLevel = 10;
-  const hasData = chartData.length > 0;
+  const entriesCount = stats?.totals.entries ?? 0;
+  const hasData = entriesCount > 0;
 
   if (!hasData) {
     return (
@@ -425,7 +420,7 @@ export default function EmotionChart() {
             className="text-base font-bold"
             style={{ color: colors.morning, textShadow: `0 0 10px ${colors.glow}` }}
           >
-            {chartData.length > 0 ? Math.round(chartData.reduce((sum, entry) => sum + entry.level, 0) / chartData.length) : 0}
+            {Math.round(stats?.totals.avgLevel ?? 0)}
           </div>
           <div className="text-white/60 text-xs">Средний</div>
         </div>
@@ -434,7 +429,7 @@ export default function EmotionChart() {
             className="text-base font-bold"
             style={{ color: colors.evening, textShadow: `0 0 10px ${colors.glow}` }}
           >
-            {chartData.length}
+            {entriesCount}
           </div>
           <div className="text-white/60 text-xs">Записей</div>
         </div>
@@ -7,11 +7,15 @@ import EmotionChart from '../../components/feature/EmotionChart';
 import NeonButton from '../../components/base/NeonButton';
 import { dbManager, getTelegramUserId, type EmotionEntry } from '../../utils/database';
 
+const HISTORY_PAGE_SIZE = 30;
+
 export default function Emotions() {
   const navigate = useNavigate();
   const [emotionHistory, setEmotionHistory] = useState<EmotionEntry[]>([]);
   const [selectedFilter, setSelectedFilter] = useState<'all' | 'morning' | 'evening'>('all');
   const [loading, setLoading] = useState(true);
+  const [nextCursor, setNextCursor] = useState<string | null>(null);
+  const [loadingMore, setLoadingMore] = useState(false);
 
   const emotions = [
     { key: 'joy', label: 'Радость', color: '#fbbf24', icon: 'ri-emotion-happy-line' },
@@ -34,8 +38,9 @@ export default function Emotions() {
     try {
       await dbManager.init();
       const telegramId = getTelegramUserId();
-      const entries = await dbManager.getEmotionEntriesByTelegramId(telegramId);
-      setEmotionHistory(entries);
+      const page = await dbManager.getEmotionEntriesPage(telegramId, { limit: HISTORY_PAGE_SIZE });
+      setEmotionHistory(page.items);
+      setNextCursor(page.nextCursor);
     } catch (error) {
       console.error('Ошибка загрузки истории эмоций:', error);
     } finally {
@@ -43,6 +48,22 @@ export default function Emotions() {
     }
   };
 
+  // Следующая страница истории по курсору из X-Next-Cursor
+  const loadMoreHistory = async () => {
+    if (!nextCursor || loadingMore) return;
+    setLoadingMore(true);
+    try {
+      const telegramId = getTelegramUserId();
+      const page = await dbManager.getEmotionEntriesPage(telegramId, { after: nextCursor, limit: HISTORY_PAGE_SIZE });
+      setEmotionHistory(prev => [...prev, ...page.items]);
+      setNextCursor(page.nextCursor);
+    } catch (error) {
+      console.error('Ошибка загрузки истории эмоций:', error);
+    } finally {
+      setLoadingMore(false);
+    }
+  };
+
   const filteredHistory = emotionHistory.filter(entry => 
     selectedFilter === 'all' || entry.type === selectedFilter
   );
@@ -218,6 +239,17 @@ export default function Emotions() {
               </div>
             </GlassCard>
           )}
+
+          {/* Подгрузка более старых записей */}
+          {nextCursor && (
+            <button
+              onClick={loadMoreHistory}
+              disabled={loadingMore}
+              className="w-full py-3 rounded-full bg-white/10 text-white/70 text-sm hover:bg-white/20 transition-colors disabled:opacity-50"
+            >
+              {loadingMore ? 'Загрузка...' : 'Показать ещё'}
+            </button>
+          )}
         </div>
       </div>
 
@@ -6,6 +6,8 @@ import GlassCard from '../../components/base/GlassCard';
 import NeonButton from '../../components/base/NeonButton';
 import { dbManager, getTelegramUserId, type JournalEntry } from '../../utils/database';
 
+const JOURNAL_PAGE_SIZE = 20;
+
 interface WeeklyReport {
   id?: number;
   telegram_id: number;
@@ -22,6 +24,8 @@ export default function Journal() {
   const [entries, setEntries] = useState<JournalEntry[]>([]);
   const [weeklyReports, setWeeklyReports] = useState<WeeklyReport[]>([]);
   const [loading, setLoading] = useState(true);
+  const [nextCursor, setNextCursor] = useState<string | null>(null);
+  const [loadingMore, setLoadingMore] = useState(false);
   const [showAddForm, setShowAddForm] = useState(false);
   const [showWeeklyReportForm, setShowWeeklyReportForm] = useState(false);
   const [generatingReport, setGeneratingReport] = useState(false);
@@ -54,8 +58,9 @@ export default function Journal() {
       const telegramId = getTelegramUserId();
       
       // Загружаем обычные записи
-      const journalEntries = await dbManager.getJournalEntriesByTelegramId(telegramId);
-      setEntries(journalEntries);
+      const page = await dbManager.getJournalEntriesPage(telegramId, { limit: JOURNAL_PAGE_SIZE });
+      setEntries(page.items);
+      setNextCursor(page.nextCursor);
       
       // Загружаем еженедельные отчеты (пока из localStorage, позже добавим в базу)
       const savedReports = localStorage.getItem(`weekly_reports_${telegramId}`);
@@ -69,6 +74,22 @@ export default function Journal() {
     }
   };
 
+  // Следующая страница журнала по курсору из X-Next-Cursor
+  const loadMoreEntries = async () => {
+    if (!nextCursor || loadingMore) return;
+    setLoadingMore(true);
+    try {
+      const telegramId = getTelegramUserId();
+      const page = await dbManager.getJournalEntriesPage(telegramId, { after: nextCursor, limit: JOURNAL_PAGE_SIZE });
+      setEntries(prev => [...prev, ...page.items]);
+      setNextCursor(page.nextCursor);
+    } catch (error) {
+      console.error('Ошибка загрузки журнала:', error);
+    } finally {
+      setLoadingMore(false);
+    }
+  };
+
   const addEntry = async () => {
     if (!newEntry.title.trim() || !newEntry.content.trim()) return;
 
@@ -107,7 +128,7 @@ export default function Journal() {
       const telegramId = getTelegramUserId();
       
       // Получаем эмоциональные данные за последнюю неделю
-      const emotionEntries = await dbManager.getEmotionEntriesByTelegramId(telegramId, 50);
+      const { items: emotionEntries } = await dbManager.getEmotionEntriesPage(telegramId, { limit: 50 });
       const weekAgo = new Date();
       weekAgo.setDate(weekAgo.getDate() - 7);
       
@@ -420,6 +441,16 @@ export default function Journal() {
                       </GlassCard>
                     );
                   })}
+                  {/* Подгрузка более старых записей */}
+                  {nextCursor && (
+                    <button
+                      onClick={loadMoreEntries}
+                      disabled={loadingMore}
+                      className="w-full py-3 rounded-full bg-white/10 text-white/70 text-sm hover:bg-white/20 transition-colors disabled:opacity-50"
+                    >
+                      {loadingMore ? 'Загрузка...' : 'Показать ещё'}
+                    </button>
+                  )}
                 </div>
               ) : (
                 <GlassCard className="p-8">
@@ -79,13 +79,102 @@ export interface AskezaEntry {
   updated_at: string;
 }
 
+export interface Page<T> {
+  items: T[];
+  nextCursor: string | null; // передать как `after`, чтобы получить следующую страницу
+}
+
+// Стартовое состояние мини-приложения (GET /bootstrap/{telegramId})
+export interface BootstrapState {
+  user: UserProfile;
+  clientProfile: ClientProfile | null;
+  homeAskezas: AskezaEntry[];
+  date: string;
+  morning: EmotionEntry | null;
+  evening: EmotionEntry | null;
+  journal: JournalEntry[];
+  journalNextCursor: string | null;
+}
+
+// Изменения после seq (GET /sync/{telegramId}?since=seq).
+// reset: true — пришёл полный набор строк, локальный кэш нужно заменить, а не дополнить
+export interface SyncChanges {
+  seq: number;
+  since: number;
+  reset: boolean;
+  changes: {
+    user: UserProfile[];
+    clientProfile: ClientProfile[];
+    emotions: EmotionEntry[];
+    journal: JournalEntry[];
+    askezas: AskezaEntry[];
+  };
+  deleted: {
+    user: number[];
+    clientProfile: number[];
+    emotions: number[];
+    journal: number[];
+    askezas: number[];
+  };
+}
+
+// Пакетная запись (POST /batch): key — идемпотентности, повтор с тем же key не создаёт дубль
+export type BatchOperation =
+  | { op: 'emotion'; key?: string; data: EmotionEntry }
+  | { op: 'journal'; key?: string; data: JournalEntry }
+  | { op: 'user_response'; key?: string; data: UserResponses };
+
+export interface BatchResult {
+  index: number;
+  key: string | null;
+  status: 'created' | 'duplicate' | 'error';
+  id?: number;
+  error?: string;
+}
+
+// Агрегаты для графиков эмоций (GET /emotions/user/{telegramId}/stats)
+export interface EmotionStatsValues {
+  days: number;
+  entries: number;
+  avgLevel: number | null;
+  avgMorningLevel: number | null;
+  avgEveningLevel: number | null;
+  avgDayRating: number | null;
+  avgSleepQuality: number | null;
+}
+
+export interface EmotionStats {
+  from: string;
+  to: string;
+  bucket: 'day' | 'week' | 'month';
+  totals: EmotionStatsValues;
+  buckets: (EmotionStatsValues & { bucket: string })[];
+  emotions: { emotion: string; count: number }[];
+  streaks: { current: number; longest: number };
+}
+
+export interface PageParams {
+  after?: string | null;
+  limit?: number;
+}
+
 class DatabaseManager {
   private baseUrl = '/api/database'; // API endpoint на вашем сервере
   private initialized = false;
+  private initializing: Promise<void> | null = null;
 
   async init(): Promise<void> {
     if (this.initialized) return;
+    // Компоненты при монтировании вызывают init() одновременно — делим один запрос
+    if (!this.initializing) {
+      this.initializing = this.requestInit().finally(() => {
+        this.initializing = null;
+      });
+    }
+    return this.initializing;
+  }
 
+  private async requestInit(): Promise<void> {
     try {
       // Проверяем соединение с сервером и инициализируем базу данных
       const response = await fetch(`${this.baseUrl}/init`, {
@@ -108,6 +197,76 @@ class DatabaseManager {
     }
   }
 
+  // Постраничные списки: курсор следующей страницы приходит в заголовке X-Next-Cursor
+  private async fetchPage<T>(path: string, params: PageParams = {}, extra: Record<string, string> = {}): Promise<Page<T>> {
+    const query = new URLSearchParams(extra);
+    if (params.after) query.append('after', params.after);
+    if (params.limit) query.append('limit', params.limit.toString());
+
+    const url = query.toString() ? `${this.baseUrl}${path}?${query.toString()}` : `${this.baseUrl}${path}`;
+    const response = await fetch(url);
+
+    if (!response.ok) {
+      throw new Error(`Ошибка получения списка ${path}: ${response.statusText}`);
+    }
+
+    return {
+      items: await response.json(),
+      nextCursor: response.headers.get('X-Next-Cursor'),
+    };
+  }
+
+  async getEmotionEntriesPage(telegramId: number, params?: PageParams): Promise<Page<EmotionEntry>> {
+    return this.fetchPage<EmotionEntry>(`/emotions/user/${telegramId}`, params);
+  }
+
+  async getJournalEntriesPage(telegramId: number, params?: PageParams): Promise<Page<JournalEntry>> {
+    return this.fetchPage<JournalEntry>(`/journal/user/${telegramId}`, params);
+  }
+
+  async getAskezaEntriesPage(telegramId: number, params?: PageParams): Promise<Page<AskezaEntry>> {
+    return this.fetchPage<AskezaEntry>(`/askeza/user/${telegramId}`, params);
+  }
+
+  async getUserResponsesPage(telegramId: number, responseType?: string, params?: PageParams): Promise<Page<UserResponses>> {
+    return this.fetchPage<UserResponses>(`/user-responses/${telegramId}`, params, responseType ? { type: responseType } : {});
+  }
+
+  // Всё для главного экрана одним запросом; ETag/304 обрабатывает HTTP-кэш браузера
+  async getBootstrap(telegramId: number, date?: string, journalLimit?: number): Promise<BootstrapState | null> {
+    const query = new URLSearchParams();
+    if (date) query.append('date', date);
+    if (journalLimit) query.append('journal_limit', journalLimit.toString());
+    const qs = query.toString();
+
+    const response = await fetch(`${this.baseUrl}/bootstrap/${telegramId}${qs ? `?${qs}` : ''}`);
+
+    if (response.status === 404) {
+      return null;
+    }
+
+    if (!response.ok) {
+      throw new Error(`Ошибка получения стартового состояния: ${response.statusText}`);
+    }
+
+    const state: BootstrapState = await response.json();
+    state.clientProfile = this.parseClientProfile(state.clientProfile);
+    return state;
+  }
+
+  // Строки, изменённые после since; seq из ответа передать в следующий вызов
+  async getSyncChanges(telegramId: number, since = 0): Promise<SyncChanges> {
+    const response = await fetch(`${this.baseUrl}/sync/${telegramId}?since=${since}`);
+
+    if (!response.ok) {
+      throw new Error(`Ошибка синхронизации: ${response.statusText}`);
+    }
+
+    const sync: SyncChanges = await response.json();
+    sync.changes.clientProfile = sync.changes.clientProfile.map(profile => this.parseClientProfile(profile)!);
+    return sync;
+  }
+
   // Методы для работы с пользователями
   async createUser(user: UserProfile): Promise<number> {
     console.log('Создание нового пользователя...');
@@ -192,9 +351,11 @@ class DatabaseManager {
       throw new Error(`Ошибка получения профиля клиента: ${response.statusText}`);
     }
 
-    const profile = await response.json();
-    
-    // Парсим JSON строки обратно в массивы
+    return this.parseClientProfile(await response.json());
+  }
+
+  // Парсим JSON строки обратно в массивы
+  private parseClientProfile(profile: any): ClientProfile | null {
     if (profile) {
       try {
         profile.selected_widgets = typeof profile.selected_widgets === 'string' 
@@ -314,30 +475,29 @@ class DatabaseManager {
     return result.id;
   }
 
-  async getEmotionEntriesByTelegramId(telegramId: number, limit?: number): Promise<EmotionEntry[]> {
-    let url = `${this.baseUrl}/emotions/user/${telegramId}`;
-    if (limit) {
-      url += `?limit=${limit}`;
+  async getEmotionEntryByDate(telegramId: number, date: string, type: 'morning' | 'evening'): Promise<EmotionEntry | null> {
+    const response = await fetch(`${this.baseUrl}/emotions/user/${telegramId}/date/${date}/${type}`);
+    
+    if (response.status === 404) {
+      return null;
     }
 
-    const response = await fetch(url);
-
     if (!response.ok) {
-      throw new Error(`Ошибка получения эмоциональных записей: ${response.statusText}`);
+      throw new Error(`Ошибка получения эмоциональной записи: ${response.statusText}`);
     }
 
     return await response.json();
   }
 
-  async getEmotionEntryByDate(telegramId: number, date: string, type: 'morning' | 'evening'): Promise<EmotionEntry | null> {
-    const response = await fetch(`${this.baseUrl}/emotions/user/${telegramId}/date/${date}/${type}`);
-    
-    if (response.status === 404) {
-      return null;
-    }
+  async getEmotionStats(telegramId: number, from?: string, to?: string, bucket: 'day' | 'week' | 'month' = 'day'): Promise<EmotionStats> {
+    const query = new URLSearchParams({ bucket });
+    if (from) query.append('from', from);
+    if (to) query.append('to', to);
+
+    const response = await fetch(`${this.baseUrl}/emotions/user/${telegramId}/stats?${query.toString()}`);
 
     if (!response.ok) {
-      throw new Error(`Ошибка получения эмоциональной записи: ${response.statusText}`);
+      throw new Error(`Ошибка получения статистики эмоций: ${response.statusText}`);
     }
 
     return await response.json();
@@ -361,19 +521,22 @@ class DatabaseManager {
     return result.id;
   }
 
-  async getJournalEntriesByTelegramId(telegramId: number, limit?: number): Promise<JournalEntry[]> {
-    let url = `${this.baseUrl}/journal/user/${telegramId}`;
-    if (limit) {
-      url += `?limit=${limit}`;
-    }
-
-    const response = await fetch(url);
+  // Отправка накопленных офлайн записей одним запросом
+  async writeBatch(operations: BatchOperation[]): Promise<BatchResult[]> {
+    const response = await fetch(`${this.baseUrl}/batch`, {
+      method: 'POST',
+      headers: {
+        'Content-Type': 'application/json',
+      },
+      body: JSON.stringify(operations)
+    });
 
     if (!response.ok) {
-      throw new Error(`Ошибка получения журнальных записей: ${response.statusText}`);
+      throw new Error(`Ошибка пакетной записи: ${response.statusText}`);
     }
 
-    return await response.json();
+    const result = await response.json();
+    return result.results;
   }
 
   // Методы для работы с аскезами
@@ -454,8 +617,9 @@ class DatabaseManager {
     }
   }
 
-  async exportData(): Promise<Blob> {
-    const response = await fetch(`${this.baseUrl}/export`);
+  // Снимок базы; compression='gzip' уменьшает файл, zstd — если на сервере есть пакет zstandard
+  async exportData(compression: 'none' | 'gzip' | 'zstd' = 'none'): Promise<Blob> {
+    const response = await fetch(`${this.baseUrl}/export${compression !== 'none' ? `?compression=${compression}` : ''}`);
 
     if (!response.ok) {
       throw new Error(`Ошибка экспорта данных: ${response.statusText}`);
@@ -464,11 +628,13 @@ class DatabaseManager {
     return await response.blob();
   }
 
-  async importData(file: File): Promise<void> {
+  // Без telegramId файл заменяет всю базу; с telegramId — сливаются только данные этого пользователя
+  async importData(file: File, telegramId?: number): Promise<void> {
     const formData = new FormData();
     formData.append('database', file);
 
-    const response = await fetch(`${this.baseUrl}/import`, {
+    const query = telegramId !== undefined ? `?mode=merge&telegram_id=${telegramId}` : '';
+    const response = await fetch(`${this.baseUrl}/import${query}`, {
       method: 'POST',
       body: formData
     });
@@ -478,9 +644,38 @@ class DatabaseManager {
     }
   }
 
+  // Данные одного пользователя в JSON Lines: перенос между базами, выдача по запросу пользователя
+  async exportUserData(telegramId: number): Promise<Blob> {
+    const response = await fetch(`${this.baseUrl}/users/${telegramId}/export`);
+
+    if (!response.ok) {
+      throw new Error(`Ошибка экспорта данных пользователя: ${response.statusText}`);
+    }
+
+    return await response.blob();
+  }
+
+  async importUserData(telegramId: number, data: Blob): Promise<Record<string, number>> {
+    const response = await fetch(`${this.baseUrl}/users/${telegramId}/import`, {
+      method: 'POST',
+      headers: {
+        'Content-Type': 'application/x-ndjson',
+      },
+      body: data
+    });
+
+    if (!response.ok) {
+      throw new Error(`Ошибка импорта данных пользователя: ${response.statusText}`);
+    }
+
+    const result = await response.json();
+    return result.imported;
+  }
+
   // Метод для проверки состояния базы данных
-  async getDatabaseInfo(): Promise<{ userCount: number; emotionCount: number; journalCount: number; askezaCount: number; clientProfileCount: number; userResponsesCount: number }> {
-    const response = await fetch(`${this.baseUrl}/info`);
+  // exact=true — точный пересчёт (медленно), по умолчанию счётчики из table_counters
+  async getDatabaseInfo(exact = false): Promise<{ userCount: number; emotionCount: number; journalCount: number; askezaCount: number; clientProfileCount: number; userResponsesCount: number; pageSize?: number; pageCount?: number; freePages?: number; sizeBytes?: number; tables?: { name: string; pages: number; sizeBytes: number }[] | null }> {
+    const response = await fetch(`${this.baseUrl}/info${exact ? '?exact=1' : ''}`);
 
     if (!response.ok) {
       throw new Error(`Ошибка получения информации о базе: ${response.statusText}`);
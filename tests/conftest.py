@@ -0,0 +1,70 @@
+import itertools
+import os
+import sqlite3
+import sys
+import tempfile
+
+import pytest
+
+# tg_bot.py и server.py читают окружение при импорте: временная база и фиктивный токен.
+# server.py открывает compass.db в текущем каталоге — переходим во временный,
+# чтобы тесты никогда не трогали рабочую базу; бот смотрит на тот же файл.
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+TEST_DIR = tempfile.mkdtemp(prefix="compass_tests_")
+os.chdir(TEST_DIR)
+os.environ["DB_PATH"] = os.path.join(TEST_DIR, "compass.db")
+os.environ.setdefault("BOT_TOKEN", "test-token")
+os.environ.setdefault("APP_URL", "https://example.invalid")
+os.environ.setdefault("BOT_STATUS_PATH", "")
+# Кэш ответов server.py сбрасывается по ленте изменений — опрашиваем её часто
+os.environ.setdefault("CHANGES_POLL_SEC", "0.05")
+
+_telegram_ids = itertools.count(700000)
+
+
+@pytest.fixture(scope="session")
+def client():
+    """TestClient сервера (lifespan: миграции, писатель, лента изменений)"""
+    from fastapi.testclient import TestClient
+
+    import server
+
+    with TestClient(server.app) as test_client:
+        yield test_client
+
+
+@pytest.fixture
+def db():
+    """Отдельное соединение с тестовой базой — для проверок и записи "со стороны"""
+    conn = sqlite3.connect(os.environ["DB_PATH"])
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA foreign_keys = ON")
+    yield conn
+    conn.close()
+
+
+@pytest.fixture
+def new_user(client):
+    """Регистрирует нового пользователя через API и возвращает его telegram_id"""
+    def register() -> int:
+        tg_id = next(_telegram_ids)
+        response = client.post("/api/database/users", json={
+            "telegram_id": tg_id,
+            "name": "Test",
+            "birth_date": "2000-01-01",
+            "birth_place": "Moscow",
+            "about_me": "",
+            "problem": "",
+            "created_at": "2026-01-01T00:00:00",
+        })
+        assert response.status_code == 200, response.text
+        return tg_id
+    return register
+
+
+@pytest.fixture
+def telegram_id(new_user):
+    """Новый зарегистрированный пользователь на каждый тест"""
+    return new_user()
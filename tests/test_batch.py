@@ -0,0 +1,46 @@
+"""Пакетная запись (/api/database/batch): ключи идемпотентности."""
+
+
+def journal_op(telegram_id, key, title):
+    return {"op": "journal", "key": key, "data": {
+        "telegram_id": telegram_id, "title": title, "content": "", "created_at": "2026-04-01T10:00:00",
+    }}
+
+
+def journal_count(db, telegram_id):
+    return db.execute("SELECT COUNT(*) FROM journal_entries WHERE telegram_id = ?", (telegram_id,)).fetchone()[0]
+
+
+def test_repeated_batch_returns_same_ids(client, db, telegram_id):
+    operations = [journal_op(telegram_id, "k1", "Первая"), journal_op(telegram_id, "k2", "Вторая")]
+    first = client.post("/api/database/batch", json=operations).json()["results"]
+    assert [result["status"] for result in first] == ["created", "created"]
+
+    # Клиент не получил ответ и отправил очередь ещё раз
+    retry = client.post("/api/database/batch", json=operations).json()["results"]
+    assert [result["status"] for result in retry] == ["duplicate", "duplicate"]
+    assert [result["id"] for result in retry] == [result["id"] for result in first]
+    assert journal_count(db, telegram_id) == 2
+
+
+def test_duplicate_key_inside_batch_writes_once(client, db, telegram_id):
+    operations = [journal_op(telegram_id, "same", "Раз"), journal_op(telegram_id, "same", "Два")]
+    results = client.post("/api/database/batch", json=operations).json()["results"]
+    assert [result["status"] for result in results] == ["created", "duplicate"]
+    assert results[0]["id"] == results[1]["id"]
+    assert journal_count(db, telegram_id) == 1
+
+
+def test_bad_operation_fails_alone(client, db, telegram_id):
+    operations = [
+        journal_op(telegram_id, "ok", "Запись"),
+        {"op": "journal", "key": "broken", "data": {"telegram_id": telegram_id}},
+        journal_op(telegram_id + 10**6, "stranger", "Нет пользователя"),  # внешний ключ
+    ]
+    results = client.post("/api/database/batch", json=operations).json()["results"]
+    assert [result["status"] for result in results] == ["created", "error", "error"]
+    assert journal_count(db, telegram_id) == 1
+
+    # Ключ неудачной операции не запоминается: исправленный повтор записывается
+    fixed = client.post("/api/database/batch", json=[journal_op(telegram_id, "broken", "Исправлено")]).json()
+    assert fixed["results"][0]["status"] == "created"
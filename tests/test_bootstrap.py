@@ -0,0 +1,26 @@
+"""Стартовое состояние мини-приложения (/api/database/bootstrap)."""
+import pytest
+
+
+def add_journal(client, telegram_id, count):
+    for i in range(count):
+        response = client.post("/api/database/journal", json={
+            "telegram_id": telegram_id, "title": f"Запись {i}", "content": "",
+            "created_at": f"2026-01-01T00:00:{i:02d}",
+        })
+        assert response.status_code == 200, response.text
+
+
+@pytest.mark.parametrize("journal_limit", [-1, 0])
+def test_non_positive_journal_limit_uses_default(client, telegram_id, journal_limit):
+    add_journal(client, telegram_id, 3)
+    response = client.get(f"/api/database/bootstrap/{telegram_id}", params={"journal_limit": journal_limit})
+    assert response.status_code == 200, response.text
+    assert len(response.json()["journal"]) == 3
+
+
+def test_journal_limit_pages_journal(client, telegram_id):
+    add_journal(client, telegram_id, 3)
+    state = client.get(f"/api/database/bootstrap/{telegram_id}", params={"journal_limit": 2}).json()
+    assert [entry["title"] for entry in state["journal"]] == ["Запись 2", "Запись 1"]
+    assert state["journalNextCursor"]
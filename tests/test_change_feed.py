@@ -0,0 +1,35 @@
+"""ChangeFeed бота: чтение ленты changes через потоки базы (db_run)."""
+import asyncio
+
+import tg_bot
+
+
+def add_user(db, telegram_id):
+    with db:
+        db.execute(
+            "INSERT INTO users (telegram_id, name, birth_date, birth_place, about_me, problem, created_at) "
+            "VALUES (?, 'Test', '2000-01-01', 'Moscow', '', '', '2026-01-01')",
+            (telegram_id,),
+        )
+
+
+def test_poll_returns_changed_users_then_nothing(client, db):
+    feed = tg_bot.ChangeFeed()
+    feed.reset(asyncio.run(tg_bot.db_run(tg_bot.ChangeFeed.last_seq)))
+    add_user(db, 910001)
+    add_user(db, 910002)
+
+    assert asyncio.run(feed.poll()) == [910001, 910002]
+    assert asyncio.run(feed.poll()) == []
+
+
+def test_poll_requests_rebuild_after_gap(client, db):
+    feed = tg_bot.ChangeFeed()
+    feed.reset(asyncio.run(tg_bot.db_run(tg_bot.ChangeFeed.last_seq)))
+    add_user(db, 910003)
+    add_user(db, 910004)
+    # Очистка удалила записи, которые бот ещё не прочитал
+    with db:
+        db.execute("DELETE FROM changes WHERE telegram_id = 910003")
+
+    assert asyncio.run(feed.poll()) is None
@@ -0,0 +1,79 @@
+"""Импорт файла базы (/api/database/import): проверка файла и слияние одного пользователя."""
+import sqlite3
+
+import pytest
+
+import db_schema
+
+TG_ID = 810001
+
+
+@pytest.fixture
+def export_file(tmp_path):
+    """Файл базы другого сервера с одним пользователем, его аскезой и записью эмоций"""
+    path = tmp_path / "export.db"
+    conn = sqlite3.connect(path)
+    db_schema.migrate(conn)
+    with conn:
+        conn.execute(
+            "INSERT INTO users (telegram_id, name, birth_date, birth_place, about_me, problem, created_at) "
+            "VALUES (?, 'Imported', '1990-01-01', 'Kazan', '', '', '2025-01-01')",
+            (TG_ID,),
+        )
+        conn.execute(
+            "INSERT INTO askeza_entries (telegram_id, title, icon, color, duration, created_at, updated_at) "
+            "VALUES (?, 'Аскеза', 'icon', '#000', 30, '2025-01-02', '2025-01-02')",
+            (TG_ID,),
+        )
+        conn.execute(
+            "INSERT INTO emotion_entries (telegram_id, type, emotion, level, date, created_at) "
+            "VALUES (?, 'morning', 'joy', 6, '2025-01-03', '2025-01-03T08:00:00')",
+            (TG_ID,),
+        )
+    conn.close()
+    return path
+
+
+def upload(client, path, **params):
+    with open(path, "rb") as f:
+        return client.post("/api/database/import", params=params, files={"database": ("compass.db", f)})
+
+
+def test_merge_imports_one_user_and_is_repeatable(client, db, export_file):
+    for _attempt in range(2):
+        response = upload(client, export_file, mode="merge", telegram_id=TG_ID)
+        assert response.status_code == 200, response.text
+        assert response.json()["foreignKeyErrors"] == 0
+
+    assert db.execute("SELECT name FROM users WHERE telegram_id = ?", (TG_ID,)).fetchone()["name"] == "Imported"
+    for table in ("askeza_entries", "emotion_entries"):
+        assert db.execute(f"SELECT COUNT(*) FROM {table} WHERE telegram_id = ?", (TG_ID,)).fetchone()[0] == 1
+    # Дневная сводка и счётчики ведутся триггерами и при импорте
+    assert db.execute("SELECT entries FROM emotion_daily_rollup WHERE telegram_id = ?", (TG_ID,)).fetchone()[0] == 1
+    assert client.get("/api/database/info").json()["emotionCount"] == \
+        db.execute("SELECT COUNT(*) FROM emotion_entries").fetchone()[0]
+
+
+def test_merge_of_missing_user_is_404(client, export_file):
+    assert upload(client, export_file, mode="merge", telegram_id=TG_ID + 1).status_code == 404
+
+
+@pytest.mark.parametrize("params", [{"mode": "append"}, {"mode": "merge"}], ids=["unknown_mode", "merge_without_user"])
+def test_bad_parameters_are_rejected(client, export_file, params):
+    assert upload(client, export_file, **params).status_code == 400
+
+
+def test_broken_file_is_rejected_without_touching_database(client, db, tmp_path):
+    users_before = db.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+    broken = tmp_path / "broken.db"
+    broken.write_bytes(b"SQLite format 3\x00" + b"\xff" * 4096)
+    assert upload(client, broken, mode="replace").status_code == 400
+    assert db.execute("SELECT COUNT(*) FROM users").fetchone()[0] == users_before
+
+
+def test_newer_schema_is_rejected(client, export_file):
+    with sqlite3.connect(export_file) as conn:
+        conn.execute(f"PRAGMA user_version = {db_schema.SCHEMA_VERSION + 1}")
+    response = upload(client, export_file, mode="merge", telegram_id=TG_ID)
+    assert response.status_code == 400
+    assert "новее" in response.json()["detail"]
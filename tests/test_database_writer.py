@@ -0,0 +1,73 @@
+"""DatabaseWriter: групповой коммит и изоляция заданий в SAVEPOINT."""
+import asyncio
+import sqlite3
+
+import pytest
+
+import server
+
+
+@pytest.fixture
+def writer(tmp_path):
+    path = str(tmp_path / "writer.db")
+    with sqlite3.connect(path) as conn:
+        conn.execute("CREATE TABLE items (name TEXT NOT NULL UNIQUE)")
+    writer = server.DatabaseWriter(path, window_ms=200, max_batch=10, max_queue=100)
+    yield writer, path
+    writer.shutdown()
+
+
+def insert(conn, name):
+    conn.execute("INSERT INTO items (name) VALUES (?)", (name,))
+    return name
+
+
+def insert_then_fail(conn, name):
+    conn.execute("INSERT INTO items (name) VALUES (?)", (name,))
+    raise ValueError("задание упало после записи")
+
+
+def names(path):
+    with sqlite3.connect(path) as conn:
+        return sorted(row[0] for row in conn.execute("SELECT name FROM items"))
+
+
+def test_concurrent_jobs_share_one_commit(writer):
+    writer, path = writer
+
+    async def submit_all():
+        return await asyncio.gather(*(writer.submit(insert, f"item{i}") for i in range(5)))
+
+    assert asyncio.run(submit_all()) == [f"item{i}" for i in range(5)]
+    metrics = writer.metrics()
+    assert metrics["batches"] == 1
+    assert metrics["batch_size_max"] == 5
+    assert names(path) == [f"item{i}" for i in range(5)]
+
+
+def test_failed_job_does_not_roll_back_its_batch(writer):
+    writer, path = writer
+
+    async def submit_all():
+        return await asyncio.gather(
+            writer.submit(insert, "first"),
+            writer.submit(insert_then_fail, "broken"),
+            writer.submit(insert, "first"),  # UNIQUE: ошибка SQLite внутри той же пачки
+            writer.submit(insert, "last"),
+            return_exceptions=True,
+        )
+
+    first, broken, duplicate, last = asyncio.run(submit_all())
+    assert (first, last) == ("first", "last")
+    assert isinstance(broken, ValueError)
+    assert isinstance(duplicate, sqlite3.IntegrityError)
+    assert writer.metrics()["batches"] == 1
+    assert names(path) == ["first", "last"]
+
+
+def test_shutdown_rejects_new_jobs(writer):
+    writer, _path = writer
+    writer.shutdown()
+    with pytest.raises(server.HTTPException) as error:
+        asyncio.run(writer.submit(insert, "late"))
+    assert error.value.status_code == 503
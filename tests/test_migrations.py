@@ -0,0 +1,50 @@
+"""Миграции db_schema на базах старых версий."""
+import sqlite3
+
+import db_schema
+
+
+def migrate_to(conn, version):
+    for migration_version, _description, steps in db_schema.MIGRATIONS:
+        if migration_version > version:
+            break
+        for step in steps:
+            if callable(step):
+                step(conn)
+            else:
+                conn.execute(step)
+    conn.execute(f"PRAGMA user_version = {version}")
+    conn.commit()
+
+
+def test_fold_skips_orphan_askeza_notification_settings(tmp_path):
+    conn = sqlite3.connect(tmp_path / "legacy.db")
+    conn.execute("PRAGMA foreign_keys = ON")
+    migrate_to(conn, 2)
+    conn.execute(
+        "INSERT INTO users (telegram_id, name, birth_date, birth_place, about_me, problem, created_at) "
+        "VALUES (1, 'Test', '2000-01-01', 'Moscow', '', '', '2025-01-01')"
+    )
+    askeza_id = conn.execute(
+        "INSERT INTO askeza_entries (telegram_id, title, icon, color, duration, created_at, updated_at) "
+        "VALUES (1, 'Аскеза', 'icon', '#000', 30, '2025-01-01', '2025-01-01')"
+    ).lastrowid
+    # Таблица из migrate_askeza_notifications.sql: без внешних ключей
+    conn.execute("""
+        CREATE TABLE askeza_notification_settings (
+            telegram_id INTEGER, askeza_id INTEGER, time TEXT, enabled INTEGER, created_at TEXT, updated_at TEXT
+        )
+    """)
+    conn.executemany(
+        "INSERT INTO askeza_notification_settings VALUES (?, ?, '08:15', 1, '2025-01-01', '2025-01-01')",
+        [(1, askeza_id), (2, askeza_id), (1, askeza_id + 100)],
+    )
+    conn.commit()
+
+    assert db_schema.migrate(conn) == db_schema.SCHEMA_VERSION
+    rows = conn.execute("SELECT telegram_id, askeza_id, time FROM askeza_reminder_settings").fetchall()
+    assert rows == [(1, askeza_id, "08:15")]
+    assert not conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE name = 'askeza_notification_settings'"
+    ).fetchone()
+    conn.close()
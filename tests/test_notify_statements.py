@@ -0,0 +1,94 @@
+"""
+Каждое нажатие в меню уведомлений — одна транзакция с фиксированным числом запросов,
+которое не растёт с числом аскез пользователя.
+"""
+import sqlite3
+
+import pytest
+
+import tg_bot
+
+TG_ID = 100500
+
+# Загрузка расписания пользователя (ReminderScheduler.load_user): пользователь и его аскезы
+SCHEDULE_LOAD = 2
+
+# (функция транзакции обработчика, аргументы после telegram_id, число запросов)
+HANDLER_PATHS = {
+    "start": (tg_bot.register_user_settings, (), 2 + SCHEDULE_LOAD),
+    "mytime": (tg_bot.fetch_mytime, (), 2),
+    "notifications": (tg_bot.fetch_notify_row, (), 1),
+    "toggle_checkin": (tg_bot.toggle_notify_and_load, ("checkin",), 1 + SCHEDULE_LOAD),
+    "toggle_checkout": (tg_bot.toggle_notify_and_load, ("checkout",), 1 + SCHEDULE_LOAD),
+    "toggle_askeza_master": (tg_bot.toggle_notify_and_load, ("askeza_master",), 1 + SCHEDULE_LOAD),
+    "askeza_list": (tg_bot.fetch_askeza_notify_rows, (), 1),
+    "askeza_toggle": (tg_bot.toggle_askeza_notify_and_load, ("ASKEZA",), 2 + SCHEDULE_LOAD),
+    "set_checkin_time": (tg_bot.save_notify_time, ("checkin", "08:30"), 1 + SCHEDULE_LOAD),
+    "set_checkout_time": (tg_bot.save_notify_time, ("checkout", "22:15"), 1 + SCHEDULE_LOAD),
+    "askeza_set_time": (tg_bot.save_askeza_notify_time, ("ASKEZA", "07:45"), 2 + SCHEDULE_LOAD),
+}
+
+
+def count_statements(conn: sqlite3.Connection, fn, *args):
+    # Для каждого запроса внутри триггера trace_callback повторяет текст внешнего
+    # запроса: подряд идущие одинаковые строки считаем одним запросом
+    statements = []
+
+    def trace(sql: str):
+        if not statements or statements[-1] != sql:
+            statements.append(sql)
+
+    conn.set_trace_callback(trace)
+    try:
+        fn(conn, TG_ID, *args)
+    finally:
+        conn.set_trace_callback(None)
+    return statements
+
+
+@pytest.fixture(params=[1, 5], ids=["1_askeza", "5_askezas"])
+def user_db(request):
+    """Соединение с зарегистрированным пользователем и его аскезами; возвращает (conn, id первой аскезы)"""
+    tg_bot.ensure_tables()
+    conn = sqlite3.connect(tg_bot.DB_PATH, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA foreign_keys = ON")
+    conn.execute("BEGIN")
+    conn.execute(
+        "INSERT INTO users (telegram_id, name, birth_date, birth_place, about_me, problem, created_at) "
+        "VALUES (?, 'Test', '2000-01-01', 'Moscow', '', '', datetime('now'))",
+        (TG_ID,),
+    )
+    askeza_ids = [
+        conn.execute(
+            "INSERT INTO askeza_entries (telegram_id, title, icon, color, duration, created_at, updated_at) "
+            "VALUES (?, ?, 'icon', '#000', 30, datetime('now'), datetime('now'))",
+            (TG_ID, f"Аскеза {i}"),
+        ).lastrowid
+        for i in range(request.param)
+    ]
+    yield conn, askeza_ids[0]
+    # Каждый тест — в своей транзакции, база остаётся пустой
+    conn.execute("ROLLBACK")
+    conn.close()
+
+
+@pytest.mark.parametrize("path", HANDLER_PATHS)
+def test_handler_statement_count(user_db, path):
+    conn, askeza_id = user_db
+    fn, args, expected = HANDLER_PATHS[path]
+    args = tuple(askeza_id if arg == "ASKEZA" else arg for arg in args)
+    statements = count_statements(conn, fn, *args)
+    assert len(statements) == expected, statements
+
+
+@pytest.mark.parametrize("path", ["toggle_checkin", "set_checkin_time"])
+def test_unregistered_user_gets_no_settings_row(user_db, path):
+    conn, _askeza_id = user_db
+    fn, args, _count = HANDLER_PATHS[path]
+    stranger = TG_ID + 1
+    # Раньше вставка падала на внешнем ключе (IntegrityError), и обработчик не отвечал
+    row, users = fn(conn, stranger, *args)
+    assert row is None
+    assert users == {}
+    assert conn.execute("SELECT 1 FROM notification_settings WHERE telegram_id=?", (stranger,)).fetchone() is None
@@ -0,0 +1,56 @@
+"""Постраничная выдача списков: курсор из X-Next-Cursor проходит весь список без пропусков и повторов."""
+import pytest
+
+
+def walk(client, path, limit):
+    """Все страницы списка по курсору; возвращает (записи, число страниц)"""
+    items, pages, after = [], 0, None
+    while True:
+        params = {"limit": limit, **({"after": after} if after else {})}
+        response = client.get(path, params=params)
+        assert response.status_code == 200, response.text
+        page = response.json()
+        assert len(page) <= limit
+        items.extend(page)
+        pages += 1
+        after = response.headers.get("X-Next-Cursor")
+        if not after:
+            return items, pages
+
+
+def test_journal_pages_with_equal_created_at(client, telegram_id):
+    # Одинаковое created_at: порядок и курсор держатся на id
+    for i in range(5):
+        client.post("/api/database/journal", json={
+            "telegram_id": telegram_id, "title": f"Запись {i}", "content": "", "created_at": "2026-03-01T10:00:00",
+        })
+    # Без limit и after — весь список одной страницей
+    response = client.get(f"/api/database/journal/user/{telegram_id}")
+    full = response.json()
+    assert "X-Next-Cursor" not in response.headers
+
+    items, pages = walk(client, f"/api/database/journal/user/{telegram_id}", 2)
+    assert pages == 3
+    assert [entry["id"] for entry in items] == [entry["id"] for entry in full]
+    assert len({entry["id"] for entry in items}) == 5
+
+
+def test_emotion_pages_follow_date_order(client, telegram_id):
+    for day in range(1, 4):
+        for kind in ("morning", "evening"):
+            response = client.post("/api/database/emotions", json={
+                "telegram_id": telegram_id, "type": kind, "emotion": "joy", "level": 5,
+                "date": f"2026-03-0{day}", "created_at": f"2026-03-0{day}T{'08' if kind == 'morning' else '21'}:00:00",
+            })
+            assert response.status_code == 200, response.text
+
+    items, _pages = walk(client, f"/api/database/emotions/user/{telegram_id}", 4)
+    keys = [(entry["date"], entry["created_at"], entry["id"]) for entry in items]
+    assert keys == sorted(keys, reverse=True)
+    assert len(keys) == 6
+
+
+@pytest.mark.parametrize("after", ["garbage", "2026-01-01T00:00:00,not-an-id"])
+def test_malformed_cursor_is_rejected(client, telegram_id, after):
+    response = client.get(f"/api/database/journal/user/{telegram_id}", params={"after": after})
+    assert response.status_code == 400
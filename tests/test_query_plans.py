@@ -0,0 +1,13 @@
+"""Горячие запросы server.py и бота не сортируют через временный B-tree и не сканируют таблицы."""
+import sqlite3
+
+import db_schema
+
+
+def test_fresh_database_query_plans(tmp_path):
+    conn = sqlite3.connect(tmp_path / "fresh.db")
+    try:
+        assert db_schema.migrate(conn) == db_schema.SCHEMA_VERSION
+        assert db_schema.check_query_plans(conn) == []
+    finally:
+        conn.close()
@@ -0,0 +1,145 @@
+"""ReminderScheduler: срабатывания, досылка и повтор без обращения к Telegram."""
+import asyncio
+import sqlite3
+import time
+from datetime import datetime, timezone
+
+import pytest
+
+import tg_bot
+
+TG_ID = 424242
+
+
+def make_user(checkin_min=600, quiet=None, tz="UTC"):
+    row = {
+        "telegram_id": TG_ID, "timezone": tz, "checkin_time": None, "checkout_time": None,
+        "enable_checkin": 1, "enable_checkout": 0, "enable_askeza": 0,
+        "checkin_min": checkin_min, "checkout_min": 1260,
+        "quiet_start_min": quiet[0] if quiet else None, "quiet_end_min": quiet[1] if quiet else None,
+    }
+    return tg_bot.UserReminders(row)
+
+
+class FakeSender:
+    late = 0
+
+    def __init__(self):
+        self.submitted = []
+
+    def is_pending(self, telegram_id, kind, day_iso):
+        return False
+
+    async def submit(self, telegram_id, kind, day_iso, text, due_at):
+        self.submitted.append((telegram_id, kind, day_iso))
+
+
+@pytest.fixture
+def sender(monkeypatch):
+    fake = FakeSender()
+    monkeypatch.setattr(tg_bot, "sender", fake)
+    return fake
+
+
+@pytest.fixture
+def scheduler():
+    scheduler = tg_bot.ReminderScheduler()
+    scheduler._schedule_user(make_user(), datetime.now(timezone.utc))
+    return scheduler
+
+
+def flaky_db_run(monkeypatch, failures):
+    """db_run, который первые failures раз падает, а потом отдаёт по сообщению на кандидата"""
+    calls = []
+
+    async def db_run(fn, candidates, write=False):
+        calls.append(len(candidates))
+        if len(calls) <= failures:
+            raise sqlite3.OperationalError("database is locked")
+        return [(tg, kind, day, "text", fire_at) for tg, kind, day, fire_at in candidates]
+
+    monkeypatch.setattr(tg_bot, "db_run", db_run)
+    return calls
+
+
+def test_failed_check_is_retried_within_grace(monkeypatch, scheduler, sender):
+    calls = flaky_db_run(monkeypatch, failures=1)
+    asyncio.run(scheduler._fire([(time.time() - 60, TG_ID, "checkin")]))
+    assert sender.submitted == []
+    assert scheduler.metrics()["retrying"] == 1
+
+    asyncio.run(scheduler._retry_failed())
+    assert calls == [1, 1]
+    assert [kind for _tg, kind, _day in sender.submitted] == ["checkin"]
+    assert scheduler.metrics()["retrying"] == 0
+
+
+def test_failed_check_past_grace_counts_as_missed(monkeypatch, scheduler, sender):
+    calls = flaky_db_run(monkeypatch, failures=1)
+    asyncio.run(scheduler._fire([(time.time() - 60, TG_ID, "checkin")]))
+    monkeypatch.setattr(tg_bot, "REMINDER_GRACE_SEC", 30)
+
+    asyncio.run(scheduler._retry_failed())
+    assert calls == [1]
+    assert sender.submitted == []
+    assert scheduler.metrics()["missed"] == 1
+
+
+def minutes_ago(minutes):
+    """Минута суток (UTC), которая была minutes минут назад"""
+    now = datetime.now(timezone.utc)
+    return (now.hour * 60 + now.minute - minutes) % 1440
+
+
+def test_restart_catches_up_reminders_within_grace(monkeypatch, sender):
+    flaky_db_run(monkeypatch, failures=0)
+    scheduler = tg_bot.ReminderScheduler()
+    now = time.time()
+    # Бот лежал 10 минут; чек-ин был 5 минут назад
+    scheduler._last_sweep = now - 600
+    scheduler._schedule_user(make_user(checkin_min=minutes_ago(5)), datetime.now(timezone.utc))
+
+    due = scheduler._pop_due(now)
+    assert [kind for _fire_at, _tg, kind in due] == ["checkin"]
+    asyncio.run(scheduler._fire(due))
+    assert [kind for _tg, kind, _day in sender.submitted] == ["checkin"]
+    # Следующее срабатывание — через сутки
+    assert scheduler._heap[0][0] == pytest.approx(due[0][0] + 86400)
+
+
+def test_reminder_older_than_grace_is_missed_not_sent(monkeypatch, scheduler, sender):
+    calls = flaky_db_run(monkeypatch, failures=0)
+    asyncio.run(scheduler._fire([(time.time() - tg_bot.REMINDER_GRACE_SEC - 60, TG_ID, "checkin")]))
+    assert calls == []
+    assert sender.submitted == []
+    assert scheduler.metrics()["missed"] == 1
+
+
+def test_quiet_hours_skip_reminder_but_keep_schedule(monkeypatch, sender):
+    calls = flaky_db_run(monkeypatch, failures=0)
+    scheduler = tg_bot.ReminderScheduler()
+    scheduler._schedule_user(
+        make_user(checkin_min=minutes_ago(1), quiet=(minutes_ago(30), minutes_ago(-30))),
+        datetime.now(timezone.utc),
+    )
+    fire_at = time.time() - 60
+    scheduled = len(scheduler._heap)
+
+    asyncio.run(scheduler._fire([(fire_at, TG_ID, "checkin")]))
+    assert calls == []
+    assert sender.submitted == []
+    assert len(scheduler._heap) == scheduled + 1
+    assert scheduler.in_quiet_hours_now(TG_ID)
+
+
+@pytest.mark.parametrize("minute, quiet, expected", [
+    (23 * 60, (22 * 60, 7 * 60), True),   # через полночь: вечер
+    (3 * 60, (22 * 60, 7 * 60), True),    # через полночь: ночь
+    (12 * 60, (22 * 60, 7 * 60), False),
+    (7 * 60, (22 * 60, 7 * 60), True),    # границы включительно
+    (13 * 60, (12 * 60, 14 * 60), True),
+    (15 * 60, (12 * 60, 14 * 60), False),
+    (15 * 60, None, False),
+])
+def test_in_quiet_hours(minute, quiet, expected):
+    assert tg_bot.in_quiet_hours(minute, quiet) is expected
@@ -0,0 +1,64 @@
+"""Кэш ответов server.py: ETag/304 и сброс при записи — через API и из другого процесса."""
+import time
+
+
+def journal_path(telegram_id):
+    return f"/api/database/journal/user/{telegram_id}"
+
+
+def add_journal(client, telegram_id, title):
+    response = client.post("/api/database/journal", json={
+        "telegram_id": telegram_id, "title": title, "content": "", "created_at": "2026-05-01T10:00:00",
+    })
+    assert response.status_code == 200, response.text
+
+
+def test_unchanged_list_answers_304(client, telegram_id):
+    add_journal(client, telegram_id, "Запись")
+    first = client.get(journal_path(telegram_id))
+    etag = first.headers["ETag"]
+
+    again = client.get(journal_path(telegram_id), headers={"If-None-Match": etag})
+    assert again.status_code == 304
+    assert again.content == b""
+    assert again.headers["ETag"] == etag
+
+
+def test_api_write_changes_etag(client, telegram_id):
+    add_journal(client, telegram_id, "Первая")
+    etag = client.get(journal_path(telegram_id)).headers["ETag"]
+
+    add_journal(client, telegram_id, "Вторая")
+    response = client.get(journal_path(telegram_id), headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+    assert len(response.json()) == 2
+
+
+def test_write_from_other_process_invalidates_cache(client, db, telegram_id):
+    add_journal(client, telegram_id, "Первая")
+    etag = client.get(journal_path(telegram_id)).headers["ETag"]
+
+    # Так пишет бот: мимо server.py, кэш сбрасывает лента changes
+    with db:
+        db.execute(
+            "INSERT INTO journal_entries (telegram_id, title, content, created_at) VALUES (?, 'Бот', '', ?)",
+            (telegram_id, "2026-05-01T11:00:00"),
+        )
+    deadline = time.monotonic() + 5
+    while True:
+        response = client.get(journal_path(telegram_id), headers={"If-None-Match": etag})
+        if response.status_code == 200 or time.monotonic() > deadline:
+            break
+        time.sleep(0.05)
+    assert response.status_code == 200
+    assert [entry["title"] for entry in response.json()] == ["Бот", "Первая"]
+
+
+def test_other_users_cache_survives_write(client, new_user):
+    reader, writer = new_user(), new_user()
+    add_journal(client, reader, "Своя")
+    etag = client.get(journal_path(reader)).headers["ETag"]
+
+    add_journal(client, writer, "Чужая")
+    assert client.get(journal_path(reader), headers={"If-None-Match": etag}).status_code == 304
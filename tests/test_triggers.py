@@ -0,0 +1,123 @@
+"""Служебные таблицы, которые ведут триггеры db_schema: счётчики, сводка, /sync."""
+import pytest
+
+EMOTION_INSERT = (
+    "INTO emotion_entries (telegram_id, type, emotion, level, date, created_at) "
+    "VALUES (?, 'morning', ?, ?, '2026-02-01', '2026-02-01T08:00:00')"
+)
+
+# Запись в emotion_entries поверх существующей (telegram_id, date, type)
+CONFLICT_WRITES = {
+    "replace": ("INSERT OR REPLACE " + EMOTION_INSERT, True),
+    "upsert": (
+        "INSERT " + EMOTION_INSERT
+        + " ON CONFLICT (telegram_id, date, type) DO UPDATE SET emotion = excluded.emotion, level = excluded.level",
+        False,
+    ),
+    "ignore": ("INSERT OR IGNORE " + EMOTION_INSERT, False),
+}
+
+
+@pytest.fixture
+def conn(client, db):
+    """Соединение с теми же PRAGMA, что у server.py и бота"""
+    db.execute("PRAGMA recursive_triggers = ON")
+    return db
+
+
+def counter(conn, table):
+    return conn.execute("SELECT row_count FROM table_counters WHERE name = ?", (table,)).fetchone()[0]
+
+
+def tombstones(conn, telegram_id):
+    return [row["row_id"] for row in conn.execute(
+        "SELECT row_id FROM sync_tombstones WHERE telegram_id = ? AND table_name = 'emotion_entries'",
+        (telegram_id,),
+    )]
+
+
+@pytest.mark.parametrize("write", CONFLICT_WRITES)
+def test_conflicting_emotion_write_keeps_counters_and_sync(conn, telegram_id, write):
+    sql, replaces = CONFLICT_WRITES[write]
+    with conn:
+        first_id = conn.execute("INSERT " + EMOTION_INSERT, (telegram_id, "joy", 4)).lastrowid
+    with conn:
+        conn.execute(sql, (telegram_id, "calm", 8))
+
+    assert counter(conn, "emotion_entries") == conn.execute("SELECT COUNT(*) FROM emotion_entries").fetchone()[0]
+    # Надгробие — только когда строка действительно удалена заменой
+    assert tombstones(conn, telegram_id) == ([first_id] if replaces else [])
+    rollup = conn.execute(
+        "SELECT entries, morning_level FROM emotion_daily_rollup WHERE telegram_id = ? AND date = '2026-02-01'",
+        (telegram_id,),
+    ).fetchone()
+    assert tuple(rollup) == (1, 4 if write == "ignore" else 8)
+
+
+def add_askeza(client, telegram_id, title):
+    response = client.post("/api/database/askeza", json={
+        "telegram_id": telegram_id, "title": title, "icon": "icon", "color": "#000", "duration": 30,
+        "current_day": 0, "is_active": True, "show_on_home": False,
+        "created_at": "2026-02-01T00:00:00", "updated_at": "2026-02-01T00:00:00",
+    })
+    assert response.status_code == 200, response.text
+    return response.json()["id"]
+
+
+def test_info_counters_follow_inserts_and_deletes(client, conn, telegram_id):
+    before = client.get("/api/database/info").json()["askezaCount"]
+    first = add_askeza(client, telegram_id, "Первая")
+    add_askeza(client, telegram_id, "Вторая")
+    client.delete(f"/api/database/askeza/{first}")
+
+    info = client.get("/api/database/info").json()
+    assert info["askezaCount"] == before + 1
+    exact = client.get("/api/database/info", params={"exact": 1}).json()
+    assert exact["askezaCount"] == info["askezaCount"]
+
+
+def test_rollup_follows_entry_changes(client, conn, telegram_id):
+    def rollup():
+        return conn.execute(
+            "SELECT entries, level_sum, morning_level, evening_level FROM emotion_daily_rollup "
+            "WHERE telegram_id = ? AND date = '2026-02-02'",
+            (telegram_id,),
+        ).fetchone()
+
+    for kind, level in (("morning", 3), ("evening", 7)):
+        client.post("/api/database/emotions", json={
+            "telegram_id": telegram_id, "type": kind, "emotion": "joy", "level": level,
+            "date": "2026-02-02", "created_at": "2026-02-02T10:00:00",
+        })
+    assert tuple(rollup()) == (2, 10, 3, 7)
+
+    with conn:
+        conn.execute("UPDATE emotion_entries SET level = 9 WHERE telegram_id = ? AND type = 'morning'", (telegram_id,))
+    assert tuple(rollup()) == (2, 16, 9, 7)
+
+    with conn:
+        conn.execute("DELETE FROM emotion_entries WHERE telegram_id = ? AND type = 'evening'", (telegram_id,))
+    assert tuple(rollup()) == (1, 9, 9, None)
+
+    with conn:
+        conn.execute("DELETE FROM emotion_entries WHERE telegram_id = ?", (telegram_id,))
+    assert rollup() is None
+
+
+def test_sync_returns_changes_and_deletions_since_seq(client, telegram_id):
+    kept = add_askeza(client, telegram_id, "Остаётся")
+    removed = add_askeza(client, telegram_id, "Удаляется")
+    seq = client.get(f"/api/database/sync/{telegram_id}").json()["seq"]
+
+    client.put(f"/api/database/askeza/{kept}", json={"current_day": 5})
+    client.delete(f"/api/database/askeza/{removed}")
+    delta = client.get(f"/api/database/sync/{telegram_id}", params={"since": seq}).json()
+    assert delta["reset"] is False
+    assert [row["id"] for row in delta["changes"]["askezas"]] == [kept]
+    assert delta["changes"]["askezas"][0]["current_day"] == 5
+    assert delta["deleted"]["askezas"] == [removed]
+    assert "updated_seq" not in delta["changes"]["askezas"][0]
+
+    # Ничего не менялось — пустой ответ
+    empty = client.get(f"/api/database/sync/{telegram_id}", params={"since": delta["seq"]}).json()
+    assert empty["changes"]["askezas"] == [] and empty["deleted"]["askezas"] == []
@@ -1,9 +1,16 @@
 import os
 import re
 import asyncio
+import heapq
+import json
 import logging
 import sqlite3
 import random
+import threading
+import time
+from functools import lru_cache
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
 from zoneinfo import ZoneInfo
 
@@ -16,11 +23,13 @@ from aiogram.types import (
     InlineKeyboardMarkup,
     InlineKeyboardButton,
 )
-from aiogram.exceptions import TelegramForbiddenError, TelegramBadRequest
+from aiogram.exceptions import TelegramForbiddenError, TelegramBadRequest, TelegramRetryAfter
 from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.fsm.state import StatesGroup, State
 from aiogram.fsm.context import FSMContext
 
+from db_schema import migrate
+
 # =========================
 # НАСТРОЙКИ ЧЕРЕЗ ENV
 # =========================
@@ -31,6 +40,10 @@ DB_PATH = os.getenv("DB_PATH", "/opt/compass/web/compass.db").strip()
 DEFAULT_TZ = os.getenv("DEFAULT_TZ", "Europe/Moscow").strip()
 POLL_INTERVAL_SEC = int(os.getenv("POLL_INTERVAL_SEC", "20"))
 
+# Потоки (и соединения) для запросов к базе; ожидание блокировки не останавливает event loop
+DB_THREADS = int(os.getenv("DB_THREADS", "4"))
+DB_BUSY_TIMEOUT_SEC = float(os.getenv("DB_BUSY_TIMEOUT_SEC", "30"))
+
 if not BOT_TOKEN:
     raise RuntimeError("Не задан BOT_TOKEN")
 if not APP_URL:
@@ -160,137 +173,144 @@ class NotifyStates(StatesGroup):
 # =========================
 def db_connect():
     # timeout побольше, чтобы не отваливалось при кратких блокировках
-    conn = sqlite3.connect(DB_PATH, timeout=30.0)
+    conn = sqlite3.connect(DB_PATH, timeout=DB_BUSY_TIMEOUT_SEC)
     conn.row_factory = sqlite3.Row
     conn.execute("PRAGMA foreign_keys = ON")
+    # INSERT OR REPLACE вызывает DELETE-триггеры для заменяемой строки (см. миграцию 11 в db_schema)
+    conn.execute("PRAGMA recursive_triggers = ON")
     return conn
 
 
-def ensure_tables():
+class BotDatabase:
     """
-    Создаём только то, что нужно для напоминаний.
-    Таблицы users/emotion_entries/askeza_entries у вас уже есть, поэтому их НЕ трогаем.
+    Доступ к базе из обработчиков и напоминаний.
+    Запросы выполняются в отдельных потоках: если server.py держит блокировку записи,
+    ждёт (до busy_timeout) поток, а не event loop — polling, callbacks и рассылка
+    продолжают работать. У каждого потока одно долгоживущее соединение.
     """
-    with db_connect() as conn:
-        conn.execute("""
-        CREATE TABLE IF NOT EXISTS notification_settings (
-          telegram_id INTEGER PRIMARY KEY,
-          timezone TEXT NOT NULL DEFAULT 'Europe/Moscow',
-
-          checkin_time  TEXT NOT NULL DEFAULT '12:00',
-          checkout_time TEXT NOT NULL DEFAULT '21:00',
-
-          enable_checkin  INTEGER NOT NULL DEFAULT 1,
-          enable_checkout INTEGER NOT NULL DEFAULT 1,
-
-          -- мастер-переключатель "все аскезы"
-          enable_askeza   INTEGER NOT NULL DEFAULT 1,
-
-          quiet_start TEXT DEFAULT NULL,
-          quiet_end   TEXT DEFAULT NULL,
-
-          created_at TEXT NOT NULL DEFAULT (datetime('now')),
-          updated_at TEXT NOT NULL DEFAULT (datetime('now')),
-
-          FOREIGN KEY (telegram_id) REFERENCES users (telegram_id) ON DELETE CASCADE
-        )
-        """)
-
-        # Пер-аскеза: включено/выключено + своё время
-        conn.execute("""
-        CREATE TABLE IF NOT EXISTS askeza_reminder_settings (
-          telegram_id INTEGER NOT NULL,
-          askeza_id   INTEGER NOT NULL,
-          time        TEXT    NOT NULL DEFAULT '12:00',
-          enabled     INTEGER NOT NULL DEFAULT 1,
-          created_at  TEXT NOT NULL DEFAULT (datetime('now')),
-          updated_at  TEXT NOT NULL DEFAULT (datetime('now')),
-          PRIMARY KEY (telegram_id, askeza_id),
-          FOREIGN KEY (telegram_id) REFERENCES users (telegram_id) ON DELETE CASCADE
-        )
-        """)
-        conn.execute("""
-        CREATE INDEX IF NOT EXISTS idx_askeza_reminders_tg
-        ON askeza_reminder_settings (telegram_id)
-        """)
-
-        # Лог, чтобы не слать по 2 раза в день одно и то же
-        conn.execute("""
-        CREATE TABLE IF NOT EXISTS reminder_log (
-          id INTEGER PRIMARY KEY AUTOINCREMENT,
-          telegram_id INTEGER NOT NULL,
-          kind TEXT NOT NULL,    -- 'checkin' | 'checkout' | 'askeza:<id>'
-          date TEXT NOT NULL,    -- YYYY-MM-DD (локальная дата пользователя)
-          sent_at TEXT NOT NULL, -- ISO UTC
-          UNIQUE(telegram_id, kind, date)
-        )
-        """)
-        conn.execute("""
-        CREATE INDEX IF NOT EXISTS idx_reminder_log_tgd_kind_date
-        ON reminder_log (telegram_id, kind, date)
-        """)
-        conn.commit()
-
-
-def user_exists(telegram_id: int) -> bool:
-    with db_connect() as conn:
-        row = conn.execute(
-            "SELECT 1 FROM users WHERE telegram_id=? LIMIT 1",
-            (telegram_id,),
-        ).fetchone()
-        return row is not None
 
-
-def ensure_notification_settings_row(telegram_id: int):
+    def __init__(self, threads: int):
+        self._executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="compass-bot-db")
+        self._local = threading.local()
+        self._connections: list[sqlite3.Connection] = []
+        self._lock = threading.Lock()
+        self._jobs = 0
+        self._errors = 0
+        self._hold_last_ms = 0.0
+        self._hold_max_ms = 0.0
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(DB_PATH, timeout=DB_BUSY_TIMEOUT_SEC, isolation_level=None, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA foreign_keys = ON")
+            conn.execute("PRAGMA recursive_triggers = ON")
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def _drop_connection(self):
+        conn = getattr(self._local, "conn", None)
+        self._local.conn = None
+        if conn is not None:
+            with self._lock:
+                self._connections.remove(conn)
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+
+    def _call(self, fn, args, write: bool):
+        """Одна транзакция на вызов: BEGIN (IMMEDIATE для записи), fn(conn, *args), COMMIT"""
+        conn = self._connection()
+        try:
+            conn.execute("BEGIN IMMEDIATE" if write else "BEGIN")
+            started = time.perf_counter()
+            try:
+                result = fn(conn, *args)
+                conn.execute("COMMIT")
+            except BaseException:
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK")
+                raise
+        except sqlite3.Error as e:
+            with self._lock:
+                self._errors += 1
+            if not isinstance(e, sqlite3.OperationalError):
+                # соединение могло прийти в негодность — следующий вызов откроет новое
+                self._drop_connection()
+            raise
+        held_ms = (time.perf_counter() - started) * 1000
+        with self._lock:
+            self._jobs += 1
+            if write:
+                self._hold_last_ms = held_ms
+                self._hold_max_ms = max(self._hold_max_ms, held_ms)
+        return result
+
+    async def run(self, fn, *args, write: bool = False):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self._call, fn, args, write)
+
+    def metrics(self) -> dict:
+        with self._lock:
+            return {
+                "connections": len(self._connections),
+                "jobs": self._jobs,
+                "errors": self._errors,
+                "write_lock_hold_last_ms": round(self._hold_last_ms, 2),
+                "write_lock_hold_max_ms": round(self._hold_max_ms, 2),
+            }
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            conn.close()
+
+
+bot_db = BotDatabase(DB_THREADS)
+
+
+async def db_run(fn, *args, write: bool = False):
     """
-    Создаём настройки только если пользователь уже есть в users.
-    Иначе FK не позволит (и это правильно).
+    Выполняет fn(conn, *args) в потоке базы одной транзакцией и возвращает результат.
+    write=True — транзакция сразу берёт блокировку записи (BEGIN IMMEDIATE):
+    так чтение с последующей записью не упирается в SQLITE_BUSY посреди транзакции.
     """
-    with db_connect() as conn:
-        conn.execute("""
-            INSERT OR IGNORE INTO notification_settings (telegram_id, created_at, updated_at)
-            VALUES (?, datetime('now'), datetime('now'))
-        """, (telegram_id,))
-        conn.commit()
+    return await bot_db.run(fn, *args, write=write)
 
 
-def ensure_askeza_reminder_rows(conn: sqlite3.Connection, telegram_id: int):
+def ensure_tables():
     """
-    Подтягиваем в таблицу настроек все активные аскезы пользователя.
-    Время по умолчанию: notification_settings.checkin_time? нет, берём 12:00.
+    Схема общая с server.py и описана миграциями в db_schema.py.
+    Если база уже актуальна, это одно чтение PRAGMA user_version.
     """
+    with db_connect() as conn:
+        version = migrate(conn)
+        log.info("DB schema version: %s", version)
+
+
+def user_exists(conn: sqlite3.Connection, telegram_id: int) -> bool:
     row = conn.execute(
-        "SELECT timezone, enable_askeza FROM notification_settings WHERE telegram_id=?",
+        "SELECT 1 FROM users WHERE telegram_id=? LIMIT 1",
         (telegram_id,),
     ).fetchone()
-    _ = row  # не используем, но оставляем на будущее
+    return row is not None
 
-    default_time = "12:00"
-    # Если раньше у вас было одно поле askeza_time, попробуем мигрировать:
-    # (оно могло быть в старой версии таблицы; если колонки нет — игнорируем)
-    try:
-        r2 = conn.execute(
-            "SELECT askeza_time FROM notification_settings WHERE telegram_id=?",
-            (telegram_id,),
-        ).fetchone()
-        if r2 and r2["askeza_time"]:
-            default_time = r2["askeza_time"]
-    except sqlite3.OperationalError:
-        pass
 
-    askezas = conn.execute(
-        "SELECT id FROM askeza_entries WHERE telegram_id=? AND is_active=1",
-        (telegram_id,),
-    ).fetchall()
-
-    for a in askezas:
-        conn.execute(
-            """
-            INSERT OR IGNORE INTO askeza_reminder_settings (telegram_id, askeza_id, time, enabled, created_at, updated_at)
-            VALUES (?, ?, ?, 1, datetime('now'), datetime('now'))
-            """,
-            (telegram_id, int(a["id"]), default_time),
-        )
+def ensure_notification_settings_row(conn: sqlite3.Connection, telegram_id: int):
+    """
+    Создаём настройки только если пользователь уже есть в users.
+    Иначе FK не позволит (и это правильно).
+    """
+    conn.execute("""
+        INSERT OR IGNORE INTO notification_settings (telegram_id, created_at, updated_at)
+        VALUES (?, datetime('now'), datetime('now'))
+    """, (telegram_id,))
 
 
 # =========================
@@ -312,40 +332,18 @@ def hhmm_is_valid(value: str) -> bool:
     return bool(re.fullmatch(r"(?:[01]\d|2[0-3]):[0-5]\d", (value or "").strip()))
 
 
-def parse_hhmm(value: str | None, default: str) -> tuple[int, int]:
-    v = (value or default).strip()
-    if not hhmm_is_valid(v):
-        v = default
-    h, m = v.split(":")
-    return int(h), int(m)
-
-
-def in_one_minute_window(now_local: datetime, target_h: int, target_m: int) -> bool:
-    # Окно 60 секунд, чтобы не зависеть от точного тика цикла.
-    t = now_local.replace(hour=target_h, minute=target_m, second=0, microsecond=0)
-    return abs((now_local - t).total_seconds()) <= 60
-
-
-def in_quiet_hours(now_local: datetime, quiet_start: str | None, quiet_end: str | None) -> bool:
+def in_quiet_hours(minute: int, quiet: tuple[int, int] | None) -> bool:
     """
     Тихие часы: если заданы, не шлём уведомления.
-    Формат HH:MM.
+    minute и границы — минуты от полуночи по местному времени, границы включительно.
     """
-    if not quiet_start or not quiet_end:
+    if quiet is None:
         return False
-    if not (hhmm_is_valid(quiet_start) and hhmm_is_valid(quiet_end)):
-        return False
-
-    sh, sm = parse_hhmm(quiet_start, "00:00")
-    eh, em = parse_hhmm(quiet_end, "00:00")
-
-    start = now_local.replace(hour=sh, minute=sm, second=0, microsecond=0)
-    end = now_local.replace(hour=eh, minute=em, second=0, microsecond=0)
-
+    start, end = quiet
     if start <= end:
-        return start <= now_local <= end
+        return start <= minute <= end
     # тихие часы через полночь
-    return now_local >= start or now_local <= end
+    return minute >= start or minute <= end
 
 
 def emotion_entry_exists(conn: sqlite3.Connection, telegram_id: int, day_iso: str, entry_type: str) -> bool:
@@ -371,13 +369,6 @@ def already_sent(conn: sqlite3.Connection, telegram_id: int, kind: str, day_iso:
     return row is not None
 
 
-def mark_sent(conn: sqlite3.Connection, telegram_id: int, kind: str, day_iso: str, sent_at_iso_utc: str):
-    conn.execute(
-        "INSERT OR IGNORE INTO reminder_log (telegram_id, kind, date, sent_at) VALUES (?, ?, ?, ?)",
-        (telegram_id, kind, day_iso, sent_at_iso_utc),
-    )
-
-
 async def send_with_compass(bot: Bot, telegram_id: int, text: str) -> bool:
     try:
         await bot.send_message(telegram_id, text, reply_markup=compass_kb())
@@ -385,6 +376,9 @@ async def send_with_compass(bot: Bot, telegram_id: int, text: str) -> bool:
     except (TelegramForbiddenError, TelegramBadRequest) as e:
         log.warning("Send failed to %s: %s", telegram_id, e)
         return False
+    except TelegramRetryAfter:
+        # повтор решает очередь отправки (ReminderSender)
+        raise
     except Exception as e:
         log.exception("Unexpected send error to %s: %s", telegram_id, e)
         return False
@@ -430,38 +424,84 @@ def kb_askeza_list(items: list[sqlite3.Row]) -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(inline_keyboard=rows)
 
 
-def fetch_notify_row(conn: sqlite3.Connection, telegram_id: int) -> sqlite3.Row:
-    row = conn.execute(
+# =========================
+# Репозиторий настроек уведомлений
+# =========================
+# Каждое действие в меню — одна транзакция из фиксированного числа запросов.
+# Строк настроек может ещё не быть: чтения подставляют значения по умолчанию
+# (так же, как SCHEDULE_USERS_SQL / SCHEDULE_ASKEZAS_SQL), записи — upsert.
+NOTIFY_COLUMNS = "timezone, checkin_time, checkout_time, enable_checkin, enable_checkout, enable_askeza"
+NOTIFY_TOGGLE_COLUMNS = {"checkin": "enable_checkin", "checkout": "enable_checkout", "askeza_master": "enable_askeza"}
+NOTIFY_TIME_COLUMNS = {"checkin": "checkin_time", "checkout": "checkout_time"}
+
+
+def fetch_notify_row(conn: sqlite3.Connection, telegram_id: int) -> sqlite3.Row | None:
+    """Настройки со значениями по умолчанию; None — пользователь не зарегистрирован"""
+    return conn.execute(
         """
         SELECT
-          timezone,
-          checkin_time,
-          checkout_time,
-          enable_checkin,
-          enable_checkout,
-          enable_askeza
-        FROM notification_settings
-        WHERE telegram_id=?
+          COALESCE(s.timezone, ?)            AS timezone,
+          COALESCE(s.checkin_time, '12:00')  AS checkin_time,
+          COALESCE(s.checkout_time, '21:00') AS checkout_time,
+          COALESCE(s.enable_checkin, 1)      AS enable_checkin,
+          COALESCE(s.enable_checkout, 1)     AS enable_checkout,
+          COALESCE(s.enable_askeza, 1)       AS enable_askeza
+        FROM users u
+        LEFT JOIN notification_settings s ON s.telegram_id = u.telegram_id
+        WHERE u.telegram_id=?
+        """,
+        (DEFAULT_TZ, telegram_id),
+    ).fetchone()
+
+
+# SELECT из users проверяет регистрацию в том же запросе: для незарегистрированного
+# пользователя строка не вставляется (вместо ошибки внешнего ключа) и RETURNING ничего не возвращает
+def toggle_notify_setting(conn: sqlite3.Connection, telegram_id: int, kind: str) -> sqlite3.Row | None:
+    """
+    Переключает флаг и возвращает настройки; без строки настроек — вставка с выключенным флагом.
+    None — пользователь не зарегистрирован.
+    """
+    column = NOTIFY_TOGGLE_COLUMNS[kind]
+    return conn.execute(
+        f"""
+        INSERT INTO notification_settings (telegram_id, {column}, created_at, updated_at)
+        SELECT telegram_id, 0, datetime('now'), datetime('now') FROM users WHERE telegram_id=?
+        ON CONFLICT (telegram_id) DO UPDATE SET {column} = 1 - {column}, updated_at=datetime('now')
+        RETURNING {NOTIFY_COLUMNS}
         """,
         (telegram_id,),
     ).fetchone()
-    return row
 
 
-def fetch_askeza_notify_rows(conn: sqlite3.Connection, telegram_id: int) -> list[sqlite3.Row]:
-    # гарантируем строки под активные аскезы
-    ensure_askeza_reminder_rows(conn, telegram_id)
+def set_notify_time(conn: sqlite3.Connection, telegram_id: int, kind: str, value: str) -> sqlite3.Row | None:
+    """None — пользователь не зарегистрирован"""
+    column = NOTIFY_TIME_COLUMNS[kind]
+    return conn.execute(
+        f"""
+        INSERT INTO notification_settings (telegram_id, {column}, created_at, updated_at)
+        SELECT telegram_id, ?, datetime('now'), datetime('now') FROM users WHERE telegram_id=?
+        ON CONFLICT (telegram_id) DO UPDATE SET {column} = excluded.{column}, updated_at=datetime('now')
+        RETURNING {NOTIFY_COLUMNS}
+        """,
+        (value, telegram_id),
+    ).fetchone()
+
 
+def fetch_askeza_notify_rows(conn: sqlite3.Connection, telegram_id: int) -> list[sqlite3.Row]:
+    """Активные аскезы с настройками напоминаний (askeza_time — время по умолчанию из старой версии)"""
     rows = conn.execute(
         """
         SELECT
           a.id   AS askeza_id,
           a.title AS title,
-          r.time AS time,
-          r.enabled AS enabled
+          a.duration AS duration,
+          a.current_day AS current_day,
+          COALESCE(r.time, s.askeza_time, '12:00') AS time,
+          COALESCE(r.enabled, 1) AS enabled
         FROM askeza_entries a
-        JOIN askeza_reminder_settings r
+        LEFT JOIN askeza_reminder_settings r
           ON r.telegram_id=a.telegram_id AND r.askeza_id=a.id
+        LEFT JOIN notification_settings s ON s.telegram_id=a.telegram_id
         WHERE a.telegram_id=? AND a.is_active=1
         ORDER BY a.id DESC
         """,
@@ -470,116 +510,706 @@ def fetch_askeza_notify_rows(conn: sqlite3.Connection, telegram_id: int) -> list
     return list(rows)
 
 
+# Строка askeza_reminder_settings создаётся при первом изменении; SELECT из askeza_entries
+# заодно проверяет, что аскеза принадлежит пользователю
+_ASKEZA_SETTING_UPSERT = """
+    INSERT INTO askeza_reminder_settings (telegram_id, askeza_id, time, enabled, created_at, updated_at)
+    SELECT a.telegram_id, a.id, {time}, {enabled}, datetime('now'), datetime('now')
+    FROM askeza_entries a
+    LEFT JOIN notification_settings s ON s.telegram_id=a.telegram_id
+    WHERE a.id=? AND a.telegram_id=?
+    ON CONFLICT (telegram_id, askeza_id) DO UPDATE SET {update}, updated_at=datetime('now')
+"""
+
+
+def toggle_askeza_notify(conn: sqlite3.Connection, telegram_id: int, askeza_id: int):
+    conn.execute(
+        _ASKEZA_SETTING_UPSERT.format(
+            time="COALESCE(s.askeza_time, '12:00')", enabled="0", update="enabled = 1 - enabled",
+        ),
+        (askeza_id, telegram_id),
+    )
+
+
+def set_askeza_notify_time(conn: sqlite3.Connection, telegram_id: int, askeza_id: int, value: str):
+    conn.execute(
+        _ASKEZA_SETTING_UPSERT.format(time="?", enabled="1", update="time = excluded.time"),
+        (value, askeza_id, telegram_id),
+    )
+
+
+# =========================
+# Очередь отправки
+# =========================
+# Напоминания не шлём последовательно из цикла планировщика: он кладёт их
+# в ограниченную очередь, а несколько воркеров отправляют параллельно,
+# соблюдая лимиты Telegram (около 30 сообщений/с на бота и не чаще
+# раза в секунду в один чат).
+SEND_WORKERS = int(os.getenv("SEND_WORKERS", "8"))
+SEND_QUEUE_SIZE = int(os.getenv("SEND_QUEUE_SIZE", "1000"))
+SEND_RATE_PER_SEC = float(os.getenv("SEND_RATE_PER_SEC", "25"))
+SEND_PER_CHAT_INTERVAL_SEC = float(os.getenv("SEND_PER_CHAT_INTERVAL_SEC", "1.0"))
+SEND_MAX_RETRIES = int(os.getenv("SEND_MAX_RETRIES", "3"))
+# Отметки в reminder_log пишем пачками, короткими транзакциями — не держим
+# блокировку записи SQLite, пока ждём ответа Telegram
+SEND_LOG_FLUSH_SEC = float(os.getenv("SEND_LOG_FLUSH_SEC", "1.0"))
+SEND_LOG_BATCH = int(os.getenv("SEND_LOG_BATCH", "200"))
+LATENCY_SAMPLES = 1000
+
+
+class TokenBucket:
+    """Глобальный лимит: rate токенов в секунду, запас не больше capacity"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds: float):
+        # RetryAfter от Telegram относится ко всему боту, а не к одному чату
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0.0
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+def write_reminder_log(conn: sqlite3.Connection, batch: list[tuple[int, str, str, str]]):
+    conn.executemany(
+        "INSERT OR IGNORE INTO reminder_log (telegram_id, kind, date, sent_at) VALUES (?, ?, ?, ?)",
+        batch,
+    )
+
+
+class ReminderSender:
+    def __init__(self):
+        self._queue: asyncio.Queue | None = None
+        self._workers: list[asyncio.Task] = []
+        self._bucket = TokenBucket(SEND_RATE_PER_SEC, SEND_RATE_PER_SEC)
+        self._chat_next_at: dict[int, float] = {}
+        self._chat_prune_at = 1024  # размер _chat_next_at, при котором удаляются прошедшие слоты
+        self._pending: set[tuple[int, str, str]] = set()  # (telegram_id, kind, date) в очереди или отправляется
+        self._latencies: deque[float] = deque(maxlen=LATENCY_SAMPLES)
+        self._sent = 0
+        self._failed = 0
+        self._retried = 0
+        self._late = 0
+        self._quiet_skipped = 0
+        self._in_flight = 0
+        self._delivered: list[tuple[int, str, str, str]] = []  # ждут записи в reminder_log
+        self._log_flushes = 0
+
+    def start(self, bot: Bot):
+        self._queue = asyncio.Queue(maxsize=SEND_QUEUE_SIZE)
+        self._workers = [asyncio.create_task(self._worker(bot)) for _ in range(SEND_WORKERS)]
+        self._workers.append(asyncio.create_task(self._flusher()))
+
+    def is_pending(self, telegram_id: int, kind: str, day_iso: str) -> bool:
+        return (telegram_id, kind, day_iso) in self._pending
+
+    async def submit(self, telegram_id: int, kind: str, day_iso: str, text: str, due_at: float):
+        """Ставит напоминание в очередь; при переполнении ждёт (backpressure для планировщика)"""
+        key = (telegram_id, kind, day_iso)
+        self._pending.add(key)
+        self._in_flight += 1
+        await self._queue.put((key, text, due_at))
+
+    async def _wait_chat_slot(self, telegram_id: int):
+        now = time.monotonic()
+        if len(self._chat_next_at) >= self._chat_prune_at:
+            # Прошедший слот ничего не ограничивает: храним только чаты, которым писали
+            # меньше SEND_PER_CHAT_INTERVAL_SEC назад. Чистим пачкой, когда словарь
+            # вырос вдвое, — в среднем O(1) на отправку
+            self._chat_next_at = {chat: at for chat, at in self._chat_next_at.items() if at > now}
+            self._chat_prune_at = max(2 * len(self._chat_next_at), 1024)
+        slot = max(now, self._chat_next_at.get(telegram_id, 0.0))
+        self._chat_next_at[telegram_id] = slot + SEND_PER_CHAT_INTERVAL_SEC
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+    async def _deliver(self, bot: Bot, telegram_id: int, text: str) -> bool:
+        for attempt in range(SEND_MAX_RETRIES + 1):
+            await self._wait_chat_slot(telegram_id)
+            await self._bucket.acquire()
+            try:
+                return await send_with_compass(bot, telegram_id, text)
+            except TelegramRetryAfter as e:
+                if attempt == SEND_MAX_RETRIES:
+                    break
+                self._retried += 1
+                log.warning("Flood control for %s, retry after %s s", telegram_id, e.retry_after)
+                self._bucket.pause(e.retry_after)
+        log.warning("Send to %s dropped after %s retries", telegram_id, SEND_MAX_RETRIES)
+        return False
+
+    async def _worker(self, bot: Bot):
+        while True:
+            key, text, due_at = await self._queue.get()
+            telegram_id, kind, day_iso = key
+            try:
+                if scheduler.in_quiet_hours_now(telegram_id):
+                    # Тихие часы проверены при срабатывании, но досылка или очередь
+                    # могли дотянуть отправку до них — не шлём, как и при срабатывании
+                    self._quiet_skipped += 1
+                    self._pending.discard(key)
+                    continue
+                ok = await self._deliver(bot, telegram_id, text)
+                if ok:
+                    self._sent += 1
+                    latency = time.time() - due_at
+                    self._latencies.append(latency)
+                    if latency > REMINDER_LATE_SEC:
+                        self._late += 1
+                    # ключ остаётся в _pending, пока отметка не записана в reminder_log
+                    self._delivered.append((telegram_id, kind, day_iso, datetime.now(timezone.utc).isoformat()))
+                else:
+                    self._failed += 1
+                    self._pending.discard(key)
+            except Exception as e:
+                self._failed += 1
+                self._pending.discard(key)
+                log.exception("Reminder delivery error for %s: %s", telegram_id, e)
+            finally:
+                self._queue.task_done()
+                self._in_flight -= 1
+                if len(self._delivered) >= SEND_LOG_BATCH or self._in_flight == 0:
+                    await self.flush_log()
+                if self._in_flight == 0:
+                    # пачка разослана — пишем сводку в лог для мониторинга
+                    log.info("Reminder delivery: %s, schedule: %s, db: %s",
+                             self.metrics(), scheduler.metrics(), bot_db.metrics())
+
+    async def _flusher(self):
+        while True:
+            await asyncio.sleep(SEND_LOG_FLUSH_SEC)
+            await self.flush_log()
+
+    async def flush_log(self):
+        """Одна короткая транзакция на пачку отметок: BEGIN IMMEDIATE, executemany, COMMIT"""
+        if not self._delivered:
+            return
+        batch, self._delivered = self._delivered, []
+        try:
+            await db_run(write_reminder_log, batch, write=True)
+        except Exception as e:
+            # вернём отметки в очередь — запишем при следующем сбросе
+            self._delivered = batch + self._delivered
+            log.exception("reminder_log flush error: %s", e)
+            return
+
+        self._log_flushes += 1
+        for telegram_id, kind, day_iso, _sent_at in batch:
+            self._pending.discard((telegram_id, kind, day_iso))
+
+    @property
+    def late(self) -> int:
+        return self._late
+
+    def metrics(self) -> dict:
+        lat = sorted(self._latencies)
+        return {
+            "queued": self._queue.qsize() if self._queue else 0,
+            "sent": self._sent,
+            "failed": self._failed,
+            "retried": self._retried,
+            "late": self._late,
+            "quiet_skipped": self._quiet_skipped,
+            "latency_p50_sec": round(lat[len(lat) // 2], 3) if lat else None,
+            "latency_p95_sec": round(lat[int(len(lat) * 0.95)], 3) if lat else None,
+            "latency_max_sec": round(lat[-1], 3) if lat else None,
+            "log_flushes": self._log_flushes,
+        }
+
+
+sender = ReminderSender()
+
+
 # =========================
 # Напоминания
 # =========================
-async def reminder_loop(bot: Bot):
+# Вместо опроса всех пользователей раз в POLL_INTERVAL_SEC планировщик
+# заранее вычисляет для каждого напоминания ближайший момент срабатывания
+# (UTC) и хранит их в min-heap. Цикл спит до ближайшего момента, а
+# пересчитывает расписание пользователя только когда меняются его настройки.
+#
+# Напоминание считается к отправке, если его время наступило после
+# предыдущего прохода и его ещё нет в reminder_log. Поэтому медленный проход
+# или перезапуск бота ничего не теряют: всё, что просрочено не больше чем на
+# REMINDER_GRACE_SEC, досылается; что старше — учитывается как пропущенное.
+REMINDER_GRACE_SEC = int(os.getenv("REMINDER_GRACE_SEC", "1800"))
+REMINDER_LATE_SEC = int(os.getenv("REMINDER_LATE_SEC", "60"))  # доставка позже — "опоздавшее"
+# Если проверка напоминаний в базе не удалась — повтор через REMINDER_RETRY_SEC (в пределах grace)
+REMINDER_RETRY_SEC = int(os.getenv("REMINDER_RETRY_SEC", "30"))
+# Изменения приходят по ленте changes; полный пересчёт — страховка на случай, если она прервётся
+RESYNC_INTERVAL_SEC = int(os.getenv("RESYNC_INTERVAL_SEC", "3600"))
+# Сводка для мониторинга (пропущенные/опоздавшие напоминания, очередь, база) — JSON-файл,
+# который бот перезаписывает раз в BOT_STATUS_INTERVAL_SEC. Пустой путь — не писать.
+BOT_STATUS_PATH = os.getenv("BOT_STATUS_PATH", os.path.join(os.path.dirname(DB_PATH), "bot_status.json")).strip()
+BOT_STATUS_INTERVAL_SEC = int(os.getenv("BOT_STATUS_INTERVAL_SEC", "60"))
+
+SCHEDULE_USERS_SQL = """
+    SELECT
+      u.telegram_id,
+      COALESCE(s.timezone, ?)            AS timezone,
+      COALESCE(s.checkin_time, '12:00')  AS checkin_time,
+      COALESCE(s.checkout_time, '21:00') AS checkout_time,
+      COALESCE(s.enable_checkin, 1)      AS enable_checkin,
+      COALESCE(s.enable_checkout, 1)     AS enable_checkout,
+      COALESCE(s.enable_askeza, 1)       AS enable_askeza,
+      COALESCE(s.checkin_min, 720)       AS checkin_min,
+      COALESCE(s.checkout_min, 1260)     AS checkout_min,
+      s.quiet_start_min,
+      s.quiet_end_min
+    FROM users u
+    LEFT JOIN notification_settings s ON s.telegram_id = u.telegram_id
+"""
+
+# Строки askeza_reminder_settings могут ещё не существовать:
+# берём значения по умолчанию так же, как fetch_askeza_notify_rows.
+# Время — в минутах от полуночи (*_min пишут триггеры базы, см. db_schema.MINUTE_COLUMNS)
+SCHEDULE_ASKEZAS_SQL = """
+    SELECT
+      a.telegram_id,
+      a.id AS askeza_id,
+      COALESCE(CASE WHEN r.telegram_id IS NULL THEN s.askeza_min ELSE r.time_min END, 720) AS time_min,
+      COALESCE(r.enabled, 1)                   AS enabled
+    FROM askeza_entries a
+    LEFT JOIN askeza_reminder_settings r
+      ON r.telegram_id=a.telegram_id AND r.askeza_id=a.id
+    LEFT JOIN notification_settings s ON s.telegram_id=a.telegram_id
+    WHERE a.is_active=1
+"""
+
+
+@lru_cache(maxsize=None)
+def resolve_tz(name: str | None) -> ZoneInfo:
+    try:
+        return ZoneInfo(name or DEFAULT_TZ)
+    except Exception:
+        return ZoneInfo(DEFAULT_TZ)
+
+
+def next_fire_utc(after_utc: datetime, tz: ZoneInfo, minutes: int) -> datetime:
+    """Первый момент minutes (от полуночи) по местному времени строго позже after_utc"""
+    local_day = after_utc.astimezone(tz).date()
+    h, m = divmod(minutes, 60)
+    for shift in (0, 1, 2):
+        day = local_day + timedelta(days=shift)
+        candidate = datetime(day.year, day.month, day.day, h, m, tzinfo=tz).astimezone(timezone.utc)
+        if candidate > after_utc:
+            return candidate
+    return candidate
+
+
+class UserReminders:
     """
-    Цикл работает только пока процесс бота запущен.
-    Для "всегда запущен" используйте systemd.
+    Настройки напоминаний одного пользователя: разобранные для планировщика
+    и исходные (settings) — для меню /notifications без обращения к базе.
     """
-    while True:
-        now_utc = datetime.now(timezone.utc)
 
-        try:
-            with db_connect() as conn:
-                users = conn.execute(
-                    """
-                    SELECT
-                      u.telegram_id,
-                      COALESCE(s.timezone, ?)            AS timezone,
-                      COALESCE(s.checkin_time, '12:00')  AS checkin_time,
-                      COALESCE(s.checkout_time, '21:00') AS checkout_time,
-                      COALESCE(s.enable_checkin, 1)      AS enable_checkin,
-                      COALESCE(s.enable_checkout, 1)     AS enable_checkout,
-                      COALESCE(s.enable_askeza, 1)       AS enable_askeza,
-                      s.quiet_start,
-                      s.quiet_end
-                    FROM users u
-                    LEFT JOIN notification_settings s ON s.telegram_id = u.telegram_id
-                    """,
-                    (DEFAULT_TZ,),
-                ).fetchall()
-
-                for u in users:
-                    telegram_id = int(u["telegram_id"])
-
-                    try:
-                        tz = ZoneInfo(u["timezone"])
-                    except Exception:
-                        tz = ZoneInfo(DEFAULT_TZ)
-
-                    now_local = now_utc.astimezone(tz)
-                    today = now_local.date().isoformat()
-
-                    if in_quiet_hours(now_local, u["quiet_start"], u["quiet_end"]):
-                        continue
-
-                    # Чек-ин => emotion_entries.type='morning'
-                    if int(u["enable_checkin"]) == 1:
-                        h, m = parse_hhmm(u["checkin_time"], "12:00")
-                        if in_one_minute_window(now_local, h, m):
-                            if not already_sent(conn, telegram_id, "checkin", today):
-                                if not emotion_entry_exists(conn, telegram_id, today, "morning"):
-                                    ok = await send_with_compass(bot, telegram_id, build_checkin_text())
-                                    if ok:
-                                        mark_sent(conn, telegram_id, "checkin", today, now_utc.isoformat())
-
-                    # Чек-аут => emotion_entries.type='evening'
-                    if int(u["enable_checkout"]) == 1:
-                        h, m = parse_hhmm(u["checkout_time"], "21:00")
-                        if in_one_minute_window(now_local, h, m):
-                            if not already_sent(conn, telegram_id, "checkout", today):
-                                if not emotion_entry_exists(conn, telegram_id, today, "evening"):
-                                    ok = await send_with_compass(bot, telegram_id, build_checkout_text())
-                                    if ok:
-                                        mark_sent(conn, telegram_id, "checkout", today, now_utc.isoformat())
-
-                    # Аскезы: мастер-переключатель + настройки по каждой
-                    if int(u["enable_askeza"]) == 1:
-                        ensure_askeza_reminder_rows(conn, telegram_id)
-
-                        rows = conn.execute(
-                            """
-                            SELECT
-                              r.askeza_id,
-                              r.time,
-                              r.enabled,
-                              a.title,
-                              a.duration,
-                              a.current_day
-                            FROM askeza_reminder_settings r
-                            JOIN askeza_entries a ON a.id=r.askeza_id
-                            WHERE r.telegram_id=? AND r.enabled=1 AND a.is_active=1
-                            ORDER BY a.id DESC
-                            """,
-                            (telegram_id,),
-                        ).fetchall()
-
-                        for r in rows:
-                            h, m = parse_hhmm(r["time"], "12:00")
-                            if not in_one_minute_window(now_local, h, m):
-                                continue
-
-                            kind = f"askeza:{int(r['askeza_id'])}"
-                            if already_sent(conn, telegram_id, kind, today):
-                                continue
-
-                            title = r["title"]
-                            cd = int(r["current_day"])
-                            dur = int(r["duration"])
-                            text = build_askeza_text(title, cd, dur)
-                            ok = await send_with_compass(bot, telegram_id, text)
-                            if ok:
-                                mark_sent(conn, telegram_id, kind, today, now_utc.isoformat())
-
-                conn.commit()
+    def __init__(self, row: sqlite3.Row):
+        self.telegram_id = int(row["telegram_id"])
+        self.settings = {column: row[column] for column in NOTIFY_COLUMNS.split(", ")}
+        # Пользователи одного часового пояса делят объект ZoneInfo и расчёты в ReminderScheduler
+        self.tz_name = row["timezone"]
+        self.tz = resolve_tz(self.tz_name)
+        self.quiet: tuple[int, int] | None = None
+        if row["quiet_start_min"] is not None and row["quiet_end_min"] is not None:
+            self.quiet = (int(row["quiet_start_min"]), int(row["quiet_end_min"]))
+        self.enable_askeza = int(row["enable_askeza"]) == 1
+        # kind -> минуты от полуночи по местному времени
+        self.times: dict[str, int] = {}
+        if int(row["enable_checkin"]) == 1:
+            self.times["checkin"] = int(row["checkin_min"])
+        if int(row["enable_checkout"]) == 1:
+            self.times["checkout"] = int(row["checkout_min"])
+
+    def add_askeza(self, row: sqlite3.Row):
+        if self.enable_askeza and int(row["enabled"]) == 1:
+            self.times[f"askeza:{int(row['askeza_id'])}"] = int(row["time_min"])
+
+
+def collect_reminders(conn: sqlite3.Connection, candidates: list[tuple[int, str, str, float]]) -> list[tuple[int, str, str, str, float]]:
+    """
+    Проверяет кандидатов одним снимком (read-транзакция без блокировки записи)
+    и возвращает готовые сообщения. Отправка начинается уже после транзакции.
+    """
+    messages = []
+    for telegram_id, kind, day_iso, fire_at in candidates:
+        if already_sent(conn, telegram_id, kind, day_iso):
+            continue
+
+        # Чек-ин => emotion_entries.type='morning', чек-аут => 'evening'
+        if kind == "checkin":
+            if emotion_entry_exists(conn, telegram_id, day_iso, "morning"):
+                continue
+            text = build_checkin_text()
+        elif kind == "checkout":
+            if emotion_entry_exists(conn, telegram_id, day_iso, "evening"):
+                continue
+            text = build_checkout_text()
+        else:
+            askeza = conn.execute(
+                "SELECT title, duration, current_day FROM askeza_entries WHERE id=? AND is_active=1",
+                (int(kind.split(":", 1)[1]),),
+            ).fetchone()
+            if askeza is None:
+                continue
+            text = build_askeza_text(askeza["title"], int(askeza["current_day"]), int(askeza["duration"]))
+
+        messages.append((telegram_id, kind, day_iso, text, fire_at))
+    return messages
 
+
+class ChangeFeed:
+    """
+    Читатель таблицы changes (её пишут триггеры — и для server.py, и для бота).
+    Опрос идёт через db_run, как и остальные запросы бота; пока базу никто не менял,
+    это один поиск по первичному ключу changes (seq > последнего прочитанного).
+    Расписание зависит только от части таблиц — изменения остальных пропускаются.
+    """
+
+    SOURCES = ("users", "notification_settings", "askeza_entries", "askeza_reminder_settings")
+
+    def __init__(self):
+        self._seq = 0
+        self.received = 0
+
+    @staticmethod
+    def last_seq(conn: sqlite3.Connection) -> int:
+        # счётчик AUTOINCREMENT, а не MAX(seq): не откатывается, когда очистка удалила всю ленту
+        return conn.execute("SELECT COALESCE((SELECT seq FROM sqlite_sequence WHERE name = 'changes'), 0)").fetchone()[0]
+
+    def reset(self, seq: int):
+        self._seq = seq
+
+    def _poll(self, conn: sqlite3.Connection) -> list[int] | None:
+        # вызовы идут по одному (из цикла планировщика), поэтому _seq меняется без блокировки
+        rows = conn.execute(
+            "SELECT seq, telegram_id, source FROM changes WHERE seq > ? ORDER BY seq", (self._seq,)
+        ).fetchall()
+        if not rows:
+            if self.last_seq(conn) < self._seq:
+                # базу заменили импортом — лента началась заново
+                return None
+            return []
+        # seq идут подряд; разрыв — записи удалены очисткой, пока бот отставал
+        gap = rows[0][0] > self._seq + 1
+        self._seq = rows[-1][0]
+        self.received += len(rows)
+        if gap:
+            return None
+        return sorted({int(row[1]) for row in rows if row[2] in self.SOURCES})
+
+    async def poll(self) -> list[int] | None:
+        """Пользователи, у которых что-то изменилось с прошлого опроса; None — нужен полный пересчёт"""
+        return await db_run(self._poll)
+
+
+change_feed = ChangeFeed()
+
+
+class ReminderScheduler:
+    def __init__(self):
+        self._heap: list[tuple[float, int, int, str, int]] = []  # (fire_at, seq, telegram_id, kind, generation)
+        self._seq = 0
+        self._users: dict[int, UserReminders] = {}
+        self._generation: dict[int, int] = {}
+        self._wakeup = asyncio.Event()
+        self._next_resync = 0.0
+        self._last_sweep = 0.0  # до этого момента (UTC timestamp) всё наступившее уже обработано
+        self._missed = 0
+        self._next_status = 0.0
+        # Кандидаты, которых не удалось проверить в базе: повторяются в _retry_failed
+        self._retry: list[tuple[int, str, str, float]] = []
+        self._retry_at = 0.0
+        # Загрузки из базы идут в потоке: номер загрузки не даёт применить
+        # устаревший снимок поверх более нового
+        self._load_seq = 0
+        self._user_load_seq: dict[int, int] = {}
+
+    # ---- расчёт расписания ----
+    def _load(self, conn: sqlite3.Connection, telegram_ids: list[int] | None = None) -> dict[int, UserReminders]:
+        users_sql, askezas_sql, params = SCHEDULE_USERS_SQL, SCHEDULE_ASKEZAS_SQL, ()
+        if telegram_ids is not None:
+            users_sql += " WHERE u.telegram_id IN (SELECT value FROM json_each(?))"
+            askezas_sql += " AND a.telegram_id IN (SELECT value FROM json_each(?))"
+            params = (json.dumps(telegram_ids),)
+
+        users = {}
+        for row in conn.execute(users_sql, (DEFAULT_TZ, *params)).fetchall():
+            users[int(row["telegram_id"])] = UserReminders(row)
+        for row in conn.execute(askezas_sql, params).fetchall():
+            user = users.get(int(row["telegram_id"]))
+            if user:
+                user.add_askeza(row)
+        return users
+
+    def _push(self, fire_ts: float, telegram_id: int, kind: str):
+        self._seq += 1
+        heapq.heappush(self._heap, (fire_ts, self._seq, telegram_id, kind, self._generation[telegram_id]))
+
+    @staticmethod
+    def _next_fire(after_ts: float, user: UserReminders, minutes: int, memo: dict) -> float:
+        # Для одного момента отсчёта результат зависит только от пояса и времени:
+        # пользователи с одинаковыми настройками считаются один раз
+        key = (user.tz_name, after_ts, minutes)
+        fire_ts = memo.get(key)
+        if fire_ts is None:
+            after_utc = datetime.fromtimestamp(after_ts, timezone.utc)
+            fire_ts = memo[key] = next_fire_utc(after_utc, user.tz, minutes).timestamp()
+        return fire_ts
+
+    def _schedule_user(self, user: UserReminders, now_utc: datetime, memo: dict | None = None):
+        tg_id = user.telegram_id
+        self._users[tg_id] = user
+        self._generation[tg_id] = self._generation.get(tg_id, 0) + 1
+        # Наступившее после прошлого прохода (но не старше grace) попадёт в ближайший проход
+        since = max(now_utc.timestamp() - REMINDER_GRACE_SEC, self._last_sweep)
+        memo = {} if memo is None else memo
+        for kind, minutes in user.times.items():
+            self._push(self._next_fire(since, user, minutes, memo), tg_id, kind)
+
+    async def rebuild_all(self):
+        """Полный пересчёт: при старте и раз в RESYNC_INTERVAL_SEC (подхватывает изменения из приложения)"""
+        self._load_seq += 1
+        load_seq = self._load_seq
+        users, change_seq = await db_run(self._load_snapshot)
+        change_feed.reset(change_seq)
+        now_utc = datetime.now(timezone.utc)
+        self._heap.clear()
+        self._users.clear()
+        self._generation.clear()
+        memo = {}
+        for user in users.values():
+            self._schedule_user(user, now_utc, memo)
+        self._next_resync = time.monotonic() + RESYNC_INTERVAL_SEC
+        log.info("Reminder schedule rebuilt: %s", self.metrics())
+
+        # Пользователи, изменившие настройки, пока читался полный снимок
+        newer = [tg_id for tg_id, seq in self._user_load_seq.items() if seq > load_seq]
+        self._user_load_seq = {}
+        for tg_id in newer:
+            await self.reschedule_user(tg_id)
+
+    def _load_snapshot(self, conn: sqlite3.Connection) -> tuple[dict[int, UserReminders], int]:
+        # Позиция ленты изменений читается в той же транзакции: всё, что позже, придёт через ленту
+        return self._load(conn), ChangeFeed.last_seq(conn)
+
+    def load_user(self, conn: sqlite3.Connection, telegram_id: int) -> dict[int, UserReminders]:
+        """Для вызова внутри транзакции, изменившей настройки (в потоке базы)"""
+        return self._load(conn, [telegram_id])
+
+    def begin_user_load(self, telegram_id: int) -> int:
+        """Номер загрузки; вызывается в event loop до чтения настроек пользователя"""
+        self._load_seq += 1
+        self._user_load_seq[telegram_id] = self._load_seq
+        return self._load_seq
+
+    async def reschedule_user(self, telegram_id: int):
+        """Пересчитывает расписание одного пользователя после изменения его настроек"""
+        await self.reschedule_users([telegram_id])
+
+    async def reschedule_users(self, telegram_ids: list[int]):
+        load_seqs = {tg_id: self.begin_user_load(tg_id) for tg_id in telegram_ids}
+        users = await db_run(self._load, telegram_ids)
+        for tg_id, load_seq in load_seqs.items():
+            self.apply_user(tg_id, users, load_seq)
+
+    def notify_settings(self, telegram_id: int) -> dict | None:
+        """Настройки для меню из памяти; None — пользователя нет в расписании (читать из базы)"""
+        user = self._users.get(telegram_id)
+        return user.settings if user else None
+
+    def apply_user(self, telegram_id: int, users: dict[int, UserReminders], load_seq: int):
+        if self._user_load_seq.get(telegram_id, load_seq) != load_seq:
+            return  # уже идёт более новая загрузка этого пользователя
+        user = users.get(telegram_id)
+        if user is None:
+            self._users.pop(telegram_id, None)
+            self._generation[telegram_id] = self._generation.get(telegram_id, 0) + 1
+        else:
+            self._schedule_user(user, datetime.now(timezone.utc))
+        self._wakeup.set()
+
+    def _pop_due(self, now_ts: float) -> list[tuple[float, int, str]]:
+        due = []
+        while self._heap and self._heap[0][0] <= now_ts:
+            fire_at, _seq, tg_id, kind, generation = heapq.heappop(self._heap)
+            if self._generation.get(tg_id) == generation:
+                due.append((fire_at, tg_id, kind))
+        return due
+
+    # ---- срабатывание ----
+    def _candidates(self, due: list[tuple[float, int, str]]) -> list[tuple[int, str, str, float]]:
+        """
+        Без обращения к базе: планирует следующие срабатывания и отбрасывает
+        пропущенные, попавшие в тихие часы и уже стоящие в очереди отправки.
+        """
+        candidates = []
+        now_ts = time.time()
+        # Срабатывания приходят пачками (у многих одинаковые пояс и время):
+        # местное время момента считается один раз на пояс, дальше — сравнения целых
+        next_memo = {}
+        local_memo: dict[tuple[str, float], tuple[int, str]] = {}
+        for fire_at, telegram_id, kind in due:
+            user = self._users.get(telegram_id)
+            if user is None or kind not in user.times:
+                continue
+
+            # Сразу планируем следующее срабатывание (завтра)
+            self._push(self._next_fire(fire_at, user, user.times[kind], next_memo), telegram_id, kind)
+
+            if now_ts - fire_at > REMINDER_GRACE_SEC:
+                self._missed += 1
+                log.warning("Reminder %s for %s missed: %.0f s late", kind, telegram_id, now_ts - fire_at)
+                continue
+
+            local = local_memo.get((user.tz_name, fire_at))
+            if local is None:
+                fire_local = datetime.fromtimestamp(fire_at, user.tz)
+                local = local_memo[(user.tz_name, fire_at)] = (
+                    fire_local.hour * 60 + fire_local.minute, fire_local.date().isoformat()
+                )
+            minute, day_iso = local
+
+            if in_quiet_hours(minute, user.quiet):
+                continue
+            if sender.is_pending(telegram_id, kind, day_iso):
+                continue
+            candidates.append((telegram_id, kind, day_iso, fire_at))
+        return candidates
+
+    async def _fire(self, due: list[tuple[float, int, str]]):
+        await self._submit(self._candidates(due))
+
+    async def _retry_failed(self):
+        candidates, self._retry = self._retry, []
+        now_ts = time.time()
+        retry = []
+        for telegram_id, kind, day_iso, fire_at in candidates:
+            user = self._users.get(telegram_id)
+            if user is None or kind not in user.times:
+                continue  # напоминание отключили, пока ждали повтора
+            if now_ts - fire_at > REMINDER_GRACE_SEC:
+                self._missed += 1
+                log.warning("Reminder %s for %s missed: database unavailable for %.0f s", kind, telegram_id, now_ts - fire_at)
+                continue
+            retry.append((telegram_id, kind, day_iso, fire_at))
+        await self._submit(retry)
+
+    async def _submit(self, candidates: list[tuple[int, str, str, float]]):
+        if not candidates:
+            return
+        try:
+            messages = await db_run(collect_reminders, candidates)
         except Exception as e:
-            # чтобы цикл не умирал из-за временных проблем с БД/сетью
-            log.exception("reminder_loop error: %s", e)
+            # Следующие срабатывания уже в heap, а эти из него извлечены: без повтора они пропадут
+            log.warning("Reminder check failed, %s reminders retry in %s s: %s", len(candidates), REMINDER_RETRY_SEC, e)
+            self._retry.extend(candidates)
+            self._retry_at = time.time() + REMINDER_RETRY_SEC
+            return
+        for telegram_id, kind, day_iso, text, fire_at in messages:
+            await sender.submit(telegram_id, kind, day_iso, text, fire_at)
+
+    def in_quiet_hours_now(self, telegram_id: int) -> bool:
+        """Тихие часы пользователя в текущий момент (проверка непосредственно перед отправкой)"""
+        user = self._users.get(telegram_id)
+        if user is None or user.quiet is None:
+            return False
+        now_local = datetime.now(user.tz)
+        return in_quiet_hours(now_local.hour * 60 + now_local.minute, user.quiet)
+
+    def metrics(self) -> dict:
+        return {
+            "users": len(self._users),
+            "changes_received": change_feed.received,
+            "scheduled": len(self._heap),
+            "retrying": len(self._retry),
+            "missed": self._missed,
+            "late": sender.late,
+        }
+
+    async def run(self):
+        """
+        Цикл работает только пока процесс бота запущен.
+        Для "всегда запущен" используйте systemd.
+        """
+        while True:
+            try:
+                if time.monotonic() >= self._next_resync:
+                    await self.rebuild_all()
+                else:
+                    changed = await change_feed.poll()
+                    if changed is None:
+                        await self.rebuild_all()
+                    elif changed:
+                        await self.reschedule_users(changed)
+                now_ts = time.time()
+                due = self._pop_due(now_ts)
+                self._last_sweep = now_ts
+                if due:
+                    await self._fire(due)
+                if self._retry and now_ts >= self._retry_at:
+                    await self._retry_failed()
+                if BOT_STATUS_PATH and time.monotonic() >= self._next_status:
+                    self._next_status = time.monotonic() + BOT_STATUS_INTERVAL_SEC
+                    await asyncio.to_thread(write_bot_status, bot_status())
+            except Exception as e:
+                # чтобы цикл не умирал из-за временных проблем с БД/сетью
+                log.exception("reminder_loop error: %s", e)
+
+            # Спим до ближайшего напоминания или пересчёта, но не дольше POLL_INTERVAL_SEC
+            # (страховка от перевода системных часов)
+            timeout = min(POLL_INTERVAL_SEC, max(self._next_resync - time.monotonic(), 0))
+            if self._heap:
+                timeout = min(timeout, max(self._heap[0][0] - time.time(), 0))
+            if self._retry:
+                timeout = min(timeout, max(self._retry_at - time.time(), 0))
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+
+
+scheduler = ReminderScheduler()
+
+
+def bot_status() -> dict:
+    return {
+        "updated_at": datetime.now(timezone.utc).isoformat(),
+        "schedule": scheduler.metrics(),
+        "delivery": sender.metrics(),
+        "db": bot_db.metrics(),
+    }
+
+
+def write_bot_status(status: dict):
+    # Через временный файл: читатель никогда не увидит наполовину записанный JSON
+    tmp_path = f"{BOT_STATUS_PATH}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(status, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, BOT_STATUS_PATH)
 
-        await asyncio.sleep(POLL_INTERVAL_SEC)
+
+async def reminder_loop(bot: Bot):
+    sender.start(bot)
+    await scheduler.run()
 
 
 # =========================
@@ -588,49 +1218,59 @@ async def reminder_loop(bot: Bot):
 dp = Dispatcher(storage=MemoryStorage())
 
 
+# Транзакции обработчиков (выполняются через db_run). Каждое нажатие — одна транзакция
+# с фиксированным числом запросов, не зависящим от числа аскез (tests/test_notify_statements.py).
+def register_user_settings(conn: sqlite3.Connection, telegram_id: int) -> dict[int, UserReminders] | None:
+    """/start: строка настроек по умолчанию и расписание; None — пользователь не зарегистрирован"""
+    if not user_exists(conn, telegram_id):
+        return None
+    ensure_notification_settings_row(conn, telegram_id)
+    return scheduler.load_user(conn, telegram_id)
+
+
+def fetch_mytime(conn: sqlite3.Connection, telegram_id: int):
+    # Для вывода /mytime подтягиваем настройки всех активных аскез
+    return fetch_notify_row(conn, telegram_id), fetch_askeza_notify_rows(conn, telegram_id)
+
+
+def toggle_notify_and_load(conn: sqlite3.Connection, telegram_id: int, kind: str):
+    return toggle_notify_setting(conn, telegram_id, kind), scheduler.load_user(conn, telegram_id)
+
+
+def toggle_askeza_notify_and_load(conn: sqlite3.Connection, telegram_id: int, askeza_id: int):
+    toggle_askeza_notify(conn, telegram_id, askeza_id)
+    return fetch_askeza_notify_rows(conn, telegram_id), scheduler.load_user(conn, telegram_id)
+
+
+def save_notify_time(conn: sqlite3.Connection, telegram_id: int, kind: str, value: str):
+    return set_notify_time(conn, telegram_id, kind, value), scheduler.load_user(conn, telegram_id)
+
+
+def save_askeza_notify_time(conn: sqlite3.Connection, telegram_id: int, askeza_id: int, value: str):
+    set_askeza_notify_time(conn, telegram_id, askeza_id, value)
+    return fetch_askeza_notify_rows(conn, telegram_id), scheduler.load_user(conn, telegram_id)
+
+
 @dp.message(CommandStart())
 async def cmd_start(message: Message):
     tg_id = message.from_user.id
 
-    if not user_exists(tg_id):
+    load_seq = scheduler.begin_user_load(tg_id)
+    users = await db_run(register_user_settings, tg_id, write=True)
+    if users is None:
         await message.answer(MSG_START_NOT_REGISTERED, reply_markup=compass_kb())
         return
 
-    ensure_notification_settings_row(tg_id)
+    scheduler.apply_user(tg_id, users, load_seq)
     await message.answer(MSG_START_REGISTERED, reply_markup=compass_kb())
 
 
 @dp.message(Command("mytime"))
 async def cmd_mytime(message: Message):
     tg_id = message.from_user.id
-    try:
-        with db_connect() as conn:
-            ensure_notification_settings_row(tg_id)
-            row = conn.execute(
-                "SELECT timezone, checkin_time, checkout_time, enable_checkin, enable_checkout, enable_askeza FROM notification_settings WHERE telegram_id=?",
-                (tg_id,),
-            ).fetchone()
 
-            # Для вывода /mytime подтягиваем настройки всех активных аскез
-            ensure_askeza_reminder_rows(conn, tg_id)
-            askeza_rows = conn.execute(
-                """
-                SELECT
-                  a.id AS askeza_id,
-                  a.title AS title,
-                  a.duration AS duration,
-                  a.current_day AS current_day,
-                  COALESCE(r.time, '12:00') AS time,
-                  COALESCE(r.enabled, 1) AS enabled
-                FROM askeza_entries a
-                LEFT JOIN askeza_reminder_settings r
-                  ON r.telegram_id=a.telegram_id AND r.askeza_id=a.id
-                WHERE a.telegram_id=? AND a.is_active=1
-                ORDER BY a.id DESC
-                """,
-                (tg_id,),
-            ).fetchall()
-            conn.commit()
+    try:
+        row, askeza_rows = await db_run(fetch_mytime, tg_id)
     except sqlite3.OperationalError:
         await message.answer(MSG_NOTIFY_DB_ERROR, reply_markup=compass_kb())
         return
@@ -665,19 +1305,17 @@ async def cmd_mytime(message: Message):
 @dp.message(Command("notifications"))
 async def cmd_notifications(message: Message):
     tg_id = message.from_user.id
-    if not user_exists(tg_id):
-        await message.answer(MSG_START_NOT_REGISTERED, reply_markup=compass_kb())
-        return
 
     try:
-        with db_connect() as conn:
-            ensure_notification_settings_row(tg_id)
-            row = fetch_notify_row(conn, tg_id)
-            conn.commit()
+        row = scheduler.notify_settings(tg_id) or await db_run(fetch_notify_row, tg_id)
     except sqlite3.OperationalError:
         await message.answer(MSG_NOTIFY_DB_ERROR, reply_markup=compass_kb())
         return
 
+    if row is None:
+        await message.answer(MSG_START_NOT_REGISTERED, reply_markup=compass_kb())
+        return
+
     await message.answer(MSG_NOTIFY_HEADER, reply_markup=kb_notify_main(row))
 
 
@@ -685,14 +1323,15 @@ async def cmd_notifications(message: Message):
 async def cb_nt_main(callback: CallbackQuery):
     tg_id = callback.from_user.id
     try:
-        with db_connect() as conn:
-            ensure_notification_settings_row(tg_id)
-            row = fetch_notify_row(conn, tg_id)
-            conn.commit()
+        row = scheduler.notify_settings(tg_id) or await db_run(fetch_notify_row, tg_id)
     except sqlite3.OperationalError:
         await callback.answer("DB error", show_alert=True)
         return
 
+    if row is None:
+        await callback.answer(MSG_START_NOT_REGISTERED, show_alert=True)
+        return
+
     await callback.message.edit_text(MSG_NOTIFY_HEADER, reply_markup=kb_notify_main(row))
     await callback.answer()
 
@@ -701,33 +1340,22 @@ async def cb_nt_main(callback: CallbackQuery):
 async def cb_nt_toggle(callback: CallbackQuery):
     tg_id = callback.from_user.id
     kind = callback.data.split(":")[-1]  # checkin/checkout/askeza_master
+    if kind not in NOTIFY_TOGGLE_COLUMNS:
+        await callback.answer()
+        return
 
     try:
-        with db_connect() as conn:
-            ensure_notification_settings_row(tg_id)
-
-            if kind == "checkin":
-                conn.execute(
-                    "UPDATE notification_settings SET enable_checkin = 1 - enable_checkin, updated_at=datetime('now') WHERE telegram_id=?",
-                    (tg_id,),
-                )
-            elif kind == "checkout":
-                conn.execute(
-                    "UPDATE notification_settings SET enable_checkout = 1 - enable_checkout, updated_at=datetime('now') WHERE telegram_id=?",
-                    (tg_id,),
-                )
-            elif kind == "askeza_master":
-                conn.execute(
-                    "UPDATE notification_settings SET enable_askeza = 1 - enable_askeza, updated_at=datetime('now') WHERE telegram_id=?",
-                    (tg_id,),
-                )
-
-            row = fetch_notify_row(conn, tg_id)
-            conn.commit()
+        load_seq = scheduler.begin_user_load(tg_id)
+        row, users = await db_run(toggle_notify_and_load, tg_id, kind, write=True)
+        scheduler.apply_user(tg_id, users, load_seq)
     except sqlite3.OperationalError:
         await callback.answer("DB error", show_alert=True)
         return
 
+    if row is None:
+        await callback.answer(MSG_START_NOT_REGISTERED, show_alert=True)
+        return
+
     await callback.message.edit_text(MSG_NOTIFY_HEADER, reply_markup=kb_notify_main(row))
     await callback.answer("Готово")
 
@@ -745,10 +1373,7 @@ async def cb_nt_set_time(callback: CallbackQuery, state: FSMContext):
 async def cb_nt_askeza_list(callback: CallbackQuery):
     tg_id = callback.from_user.id
     try:
-        with db_connect() as conn:
-            ensure_notification_settings_row(tg_id)
-            items = fetch_askeza_notify_rows(conn, tg_id)
-            conn.commit()
+        items = await db_run(fetch_askeza_notify_rows, tg_id)
     except sqlite3.OperationalError:
         await callback.answer("DB error", show_alert=True)
         return
@@ -770,16 +1395,9 @@ async def cb_nt_askeza_toggle(callback: CallbackQuery):
     askeza_id = int(callback.data.split(":")[-1])
 
     try:
-        with db_connect() as conn:
-            ensure_notification_settings_row(tg_id)
-            ensure_askeza_reminder_rows(conn, tg_id)
-
-            conn.execute(
-                "UPDATE askeza_reminder_settings SET enabled = 1 - enabled, updated_at=datetime('now') WHERE telegram_id=? AND askeza_id=?",
-                (tg_id, askeza_id),
-            )
-            items = fetch_askeza_notify_rows(conn, tg_id)
-            conn.commit()
+        load_seq = scheduler.begin_user_load(tg_id)
+        items, users = await db_run(toggle_askeza_notify_and_load, tg_id, askeza_id, write=True)
+        scheduler.apply_user(tg_id, users, load_seq)
     except sqlite3.OperationalError:
         await callback.answer("DB error", show_alert=True)
         return
@@ -811,38 +1429,22 @@ async def nt_receive_time(message: Message, state: FSMContext):
     askeza_id = data.get("askeza_id")
 
     try:
-        with db_connect() as conn:
-            ensure_notification_settings_row(tg_id)
-
-            if target_kind == "checkin":
-                conn.execute(
-                    "UPDATE notification_settings SET checkin_time=?, updated_at=datetime('now') WHERE telegram_id=?",
-                    (txt, tg_id),
-                )
-                row = fetch_notify_row(conn, tg_id)
-                conn.commit()
-                await message.answer("Сохранено.", reply_markup=kb_notify_main(row))
-
-            elif target_kind == "checkout":
-                conn.execute(
-                    "UPDATE notification_settings SET checkout_time=?, updated_at=datetime('now') WHERE telegram_id=?",
-                    (txt, tg_id),
-                )
-                row = fetch_notify_row(conn, tg_id)
-                conn.commit()
+        if target_kind in NOTIFY_TIME_COLUMNS:
+            load_seq = scheduler.begin_user_load(tg_id)
+            row, users = await db_run(save_notify_time, tg_id, target_kind, txt, write=True)
+            scheduler.apply_user(tg_id, users, load_seq)
+            if row is None:
+                await message.answer(MSG_START_NOT_REGISTERED, reply_markup=compass_kb())
+            else:
                 await message.answer("Сохранено.", reply_markup=kb_notify_main(row))
 
-            elif target_kind == "askeza" and askeza_id is not None:
-                ensure_askeza_reminder_rows(conn, tg_id)
-                conn.execute(
-                    "UPDATE askeza_reminder_settings SET time=?, updated_at=datetime('now') WHERE telegram_id=? AND askeza_id=?",
-                    (txt, tg_id, int(askeza_id)),
-                )
-                items = fetch_askeza_notify_rows(conn, tg_id)
-                conn.commit()
-                await message.answer("Сохранено.", reply_markup=kb_askeza_list(items))
-            else:
-                await message.answer("Не понял, что настраиваем. Откройте /notifications")
+        elif target_kind == "askeza" and askeza_id is not None:
+            load_seq = scheduler.begin_user_load(tg_id)
+            items, users = await db_run(save_askeza_notify_time, tg_id, int(askeza_id), txt, write=True)
+            scheduler.apply_user(tg_id, users, load_seq)
+            await message.answer("Сохранено.", reply_markup=kb_askeza_list(items))
+        else:
+            await message.answer("Не понял, что настраиваем. Откройте /notifications")
     except sqlite3.OperationalError:
         await message.answer(MSG_NOTIFY_DB_ERROR, reply_markup=compass_kb())
         return
@@ -857,7 +1459,10 @@ async def main():
     # Запуск напоминаний
     asyncio.create_task(reminder_loop(bot))
 
-    await dp.start_polling(bot)
+    try:
+        await dp.start_polling(bot)
+    finally:
+        bot_db.close()
 
 
 if __name__ == "__main__":